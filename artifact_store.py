@@ -0,0 +1,234 @@
+"""
+Хранилище скриншотов с ограничением по размеру (LRU)
+Version: 1.0.0
+- бюджет по байтам и количеству файлов, вытеснение самых давно использованных
+- индекс (screenshots/.artifact_index.json) вместо os.listdir + stat на каждом запуске:
+  очистка стоит O(вытесненных), полный скан - только раз в reconcile_hours
+  (подбирает файлы, оставшиеся после падений)
+- последний удачный скриншот каждого источника закреплен и не вытесняется
+"""
+
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+
+from atomic_io import atomic_write_json
+from sources_config import ARTIFACT_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+class ArtifactStore:
+    """LRU индекс файлов директории (имя файла -> размер, время доступа, источник)"""
+
+    def __init__(self, directory, settings=None):
+        self.directory = directory
+        self.settings = {**ARTIFACT_SETTINGS, **(settings or {})}
+        self.index_path = os.path.join(directory, self.settings['index_file'])
+        self.max_bytes = int(self.settings['max_mb'] * 1024 * 1024)
+        self.max_files = self.settings['max_files']
+        # Незакрепленные файлы в порядке доступа: первый - кандидат на вытеснение
+        self.entries = OrderedDict()
+        # source_key -> (имя файла, запись) - последний удачный скриншот источника
+        self.pinned = {}
+        self.total_bytes = 0
+        self.scanned_at = 0.0
+        self._dirty = False
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # --- индекс ---
+
+    def _load(self):
+        try:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    for name, entry in data.get('entries', []):
+                        self.entries[name] = entry
+                    self.pinned = {source: tuple(item) for source, item in data.get('pinned', {}).items()}
+                    self.scanned_at = data.get('scanned_at', 0.0)
+                    self.total_bytes = (sum(e['size'] for e in self.entries.values())
+                                        + sum(e['size'] for _, e in self.pinned.values()))
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка загрузки индекса скриншотов: {e}")
+            self.entries.clear()
+            self.pinned = {}
+            self.scanned_at = 0.0
+
+        if time.time() - self.scanned_at > self.settings['reconcile_hours'] * 3600:
+            self.reconcile()
+
+    def save(self):
+        """Сохраняет индекс если он менялся"""
+        if not self._dirty:
+            return True
+        try:
+            atomic_write_json(self.index_path, {
+                "version": INDEX_VERSION,
+                "scanned_at": self.scanned_at,
+                "entries": list(self.entries.items()),
+                "pinned": {source: list(item) for source, item in self.pinned.items()}
+            }, separators=(',', ':'))
+            self._dirty = False
+            return True
+        except OSError as e:
+            logger.warning(f"⚠️ Ошибка сохранения индекса скриншотов: {e}")
+            return False
+
+    def reconcile(self):
+        """
+        Полный скан директории (один stat на файл через scandir):
+        добавляет неучтенные файлы, убирает из индекса удаленные
+        """
+        on_disk = {}
+        index_name = os.path.basename(self.index_path)
+        for entry in os.scandir(self.directory):
+            if entry.name == index_name or entry.name.startswith('.') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            on_disk[entry.name] = (stat.st_size, stat.st_mtime)
+
+        pinned_names = {name for name, _ in self.pinned.values()}
+        for source_key, (name, _) in list(self.pinned.items()):
+            if name not in on_disk:
+                del self.pinned[source_key]
+        for name in list(self.entries):
+            if name not in on_disk:
+                del self.entries[name]
+
+        untracked = sorted(
+            (mtime, name, size) for name, (size, mtime) in on_disk.items()
+            if name not in self.entries and name not in pinned_names
+        )
+        if untracked:
+            # Неучтенные файлы (после падений) - самые старые, вытесняются первыми
+            merged = OrderedDict((name, {"size": size, "atime": mtime, "source": None})
+                                 for mtime, name, size in untracked)
+            merged.update(self.entries)
+            self.entries = merged
+            logger.info(f"  🔎 Найдено неучтенных файлов в {self.directory}: {len(untracked)}")
+
+        self.total_bytes = (sum(e['size'] for e in self.entries.values())
+                            + sum(e['size'] for _, e in self.pinned.values()))
+        self.scanned_at = time.time()
+        self._dirty = True
+
+    # --- операции ---
+
+    def add(self, path, source_key=None):
+        """Регистрирует новый файл (самый свежий в LRU) и применяет бюджет"""
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+        self._forget(name)
+        self.entries[name] = {"size": size, "atime": time.time(), "source": source_key}
+        self.total_bytes += size
+        self._dirty = True
+        self.enforce()
+
+    def touch(self, path):
+        """Отмечает использование файла (переносит в конец очереди вытеснения)"""
+        name = os.path.basename(path)
+        entry = self.entries.get(name)
+        if entry is not None:
+            entry['atime'] = time.time()
+            self.entries.move_to_end(name)
+            self._dirty = True
+
+    def pin(self, source_key, path):
+        """
+        Закрепляет последний удачный скриншот источника
+        Предыдущий закрепленный становится обычным файлом в конце очереди вытеснения
+        """
+        name = os.path.basename(path)
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            size = os.path.getsize(path)
+            entry = {"size": size, "atime": time.time(), "source": source_key}
+            self.total_bytes += size
+
+        previous = self.pinned.get(source_key)
+        if previous and previous[0] != name:
+            previous_entry = previous[1]
+            previous_entry['atime'] = time.time()
+            self.entries[previous[0]] = previous_entry
+
+        self.pinned[source_key] = (name, entry)
+        self._dirty = True
+        self.enforce()
+
+    def get_pinned(self, source_key):
+        """Путь к последнему удачному скриншоту источника или None"""
+        item = self.pinned.get(source_key)
+        return os.path.join(self.directory, item[0]) if item else None
+
+    def remove(self, path):
+        """Удаляет файл и запись индекса"""
+        name = os.path.basename(path)
+        self._forget(name)
+        self._unlink(name)
+
+    def _forget(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            for source_key, (pinned_name, pinned_entry) in list(self.pinned.items()):
+                if pinned_name == name:
+                    entry = pinned_entry
+                    del self.pinned[source_key]
+                    break
+        if entry is not None:
+            self.total_bytes -= entry['size']
+            self._dirty = True
+        return entry
+
+    def _unlink(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось удалить {name}: {e}")
+
+    def _evict_oldest(self):
+        name, entry = self.entries.popitem(last=False)
+        self.total_bytes -= entry['size']
+        self._unlink(name)
+        self._dirty = True
+        return entry['size']
+
+    def enforce(self, max_age_hours=None):
+        """
+        Вытесняет самые давно использованные незакрепленные файлы,
+        пока не выполнены бюджеты (и возраст, если max_age_hours задан)
+
+        Returns:
+            tuple: (количество удаленных файлов, освобождено байт)
+        """
+        deleted, freed = 0, 0
+        cutoff = time.time() - max_age_hours * 3600 if max_age_hours else None
+        count = lambda: len(self.entries) + len(self.pinned)
+
+        while self.entries:
+            oldest = next(iter(self.entries.values()))
+            over_budget = self.total_bytes > self.max_bytes or count() > self.max_files
+            expired = cutoff is not None and oldest['atime'] < cutoff
+            if not (over_budget or expired):
+                break
+            freed += self._evict_oldest()
+            deleted += 1
+
+        if self.total_bytes > self.max_bytes or count() > self.max_files:
+            logger.warning("⚠️ Бюджет скриншотов превышен только закрепленными файлами")
+        return deleted, freed
+
+    def cleanup(self, max_age_hours=None):
+        """Очистка перед запуском: возраст + бюджеты, затем сохранение индекса"""
+        max_age_hours = self.settings['max_age_hours'] if max_age_hours is None else max_age_hours
+        deleted, freed = self.enforce(max_age_hours)
+        self.save()
+        return deleted, freed
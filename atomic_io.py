@@ -0,0 +1,70 @@
+"""
+Атомарная запись файлов состояния
+Version: 1.0.0
+Запись во временный файл рядом с целевым + fsync + os.replace:
+при падении процесса (или отмене job в CI) на диске остается либо старая,
+либо новая версия файла, но никогда не обрезанный JSON
+"""
+
+import os
+import json
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def _fsync_directory(directory):
+    """fsync директории, чтобы rename пережил падение (на Windows не поддерживается)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_text(path, text):
+    """Атомарно заменяет содержимое файла"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp создает файл с правами 0600 - возвращаем обычные
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(directory)
+
+
+def atomic_write_json(path, data, **dump_kwargs):
+    """Атомарно записывает JSON (аргументы как у json.dump, ensure_ascii=False по умолчанию)"""
+    dump_kwargs.setdefault('ensure_ascii', False)
+    atomic_write_text(path, json.dumps(data, **dump_kwargs))
+
+
+def append_json_line(path, record):
+    """Дописывает одну JSON-строку в конец файла и сбрасывает ее на диск"""
+    line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+    # Оборванная последняя строка (падение посреди записи) не должна склеиться с новой
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = "\n" + line
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
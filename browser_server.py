@@ -0,0 +1,99 @@
+"""
+Общий долгоживущий Chromium для нескольких процессов парсера
+Version: 1.0.0
+Один процесс держит браузер с CDP-эндпоинтом на localhost, запуски парсера
+подключаются к нему (connect_over_cdp), берут изолированный контекст и отключаются.
+Стоимость запуска Chromium платится один раз на хост, а не на каждый запуск.
+Если сервер недоступен - парсер запускает браузер сам (browser_session.open_session)
+
+Использование:
+    python browser_server.py --port 9222
+    BROWSER_SERVER_URL=http://127.0.0.1:9222 python screenshot_parser.py
+"""
+
+import os
+import signal
+import asyncio
+import logging
+import argparse
+
+from browser_session import CHROMIUM_ARGS
+
+logger = logging.getLogger(__name__)
+
+BROWSER_SERVER_HOST = os.getenv('BROWSER_SERVER_HOST', '127.0.0.1')
+BROWSER_SERVER_PORT = int(os.getenv('BROWSER_SERVER_PORT', '9222'))
+BROWSER_SERVER_RESTART_DELAY = 5  # Пауза перед перезапуском упавшего браузера (сек)
+
+# Общему браузеру нужны отдельные процессы рендерера на каждый контекст:
+# --single-process из одноразового запуска здесь не подходит
+SERVER_ARGS = [arg for arg in CHROMIUM_ARGS if arg != '--single-process']
+
+
+async def serve(host=None, port=None, stop_event=None):
+    """
+    Держит Chromium запущенным и перезапускает его после падения
+
+    Args:
+        stop_event: asyncio.Event для остановки (по умолчанию SIGINT/SIGTERM)
+    """
+    from playwright.async_api import async_playwright
+
+    host = host or BROWSER_SERVER_HOST
+    port = port or BROWSER_SERVER_PORT
+    stop_event = stop_event or asyncio.Event()
+
+    async with async_playwright() as p:
+        while not stop_event.is_set():
+            browser = await p.chromium.launch(
+                headless=True,
+                args=SERVER_ARGS + [
+                    f'--remote-debugging-address={host}',
+                    f'--remote-debugging-port={port}'
+                ]
+            )
+            disconnected = asyncio.Event()
+            browser.on('disconnected', lambda _: disconnected.set())
+            logger.info(f"🌐 Chromium {browser.version} доступен: http://{host}:{port}")
+
+            stop_wait = asyncio.ensure_future(stop_event.wait())
+            crash_wait = asyncio.ensure_future(disconnected.wait())
+            await asyncio.wait({stop_wait, crash_wait}, return_when=asyncio.FIRST_COMPLETED)
+            stop_wait.cancel()
+            crash_wait.cancel()
+
+            if stop_event.is_set():
+                await browser.close()
+                logger.info("✓ Браузер остановлен")
+                break
+
+            logger.warning(f"⚠️ Chromium завершился, перезапуск через {BROWSER_SERVER_RESTART_DELAY} сек")
+            await asyncio.sleep(BROWSER_SERVER_RESTART_DELAY)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Общий Chromium для запусков парсера (CDP)")
+    parser.add_argument('--host', default=BROWSER_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=BROWSER_SERVER_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    async def run():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass  # Windows: остановка через Ctrl+C (KeyboardInterrupt)
+        await serve(args.host, args.port, stop_event)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Запуск браузера и контекста для захвата
+Version: 1.0.0
+- BROWSER_PROFILE=true - постоянный профиль Chromium (launch_persistent_context)
+  в BROWSER_PROFILE_DIR: JS-бандлы, шрифты и библиотеки графиков берутся из
+  HTTP-кэша на диске вместо повторной загрузки. Размер кэша ограничен
+  --disk-cache-size, профиль целиком - BROWSER_PROFILE_MAX_MB
+- BROWSER_PROFILE=false - прежнее поведение: одноразовый профиль на запуск
+- BROWSER_SERVER_URL - подключение к общему браузеру (browser_server.py) вместо запуска;
+  если сервер недоступен - обычный локальный запуск
+Директорию профиля можно сохранять между запусками CI (actions/cache)
+
+Сравнение холодного и теплого кэша:
+    python browser_session.py bench --source fear_greed
+    python browser_session.py bench --source btc_dominance --profile   # текущий профиль вместо временного
+"""
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+BROWSER_PROFILE = os.getenv('BROWSER_PROFILE', 'true').lower() == 'true'
+BROWSER_PROFILE_DIR = os.getenv('BROWSER_PROFILE_DIR', '.browser_profile')
+BROWSER_CACHE_MB = int(os.getenv('BROWSER_CACHE_MB', '150'))          # --disk-cache-size
+BROWSER_PROFILE_MAX_MB = int(os.getenv('BROWSER_PROFILE_MAX_MB', '400'))  # Больше - профиль сбрасывается
+# Метка рядом с профилем: браузер в этом запуске реально работал с профилем
+# (CI сохраняет кэш профиля только при ее наличии)
+PROFILE_USED_SUFFIX = '.used'
+BROWSER_SERVER_URL = os.getenv('BROWSER_SERVER_URL', '')  # Например: http://127.0.0.1:9222
+BROWSER_SERVER_CONNECT_TIMEOUT = float(os.getenv('BROWSER_SERVER_CONNECT_TIMEOUT', '5'))
+
+CHROMIUM_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--single-process',
+    '--disable-blink-features=AutomationControlled'  # ✅ Скрыть автоматизацию
+]
+
+# ✅ Дополнительные headers для обхода блокировки
+CONTEXT_HEADERS = {
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1'
+}
+
+# Файлы блокировки профиля: после восстановления из кэша CI указывают на чужой хост
+SINGLETON_FILES = ('SingletonLock', 'SingletonCookie', 'SingletonSocket')
+
+
+def directory_size(path):
+    """Размер директории в байтах (рекурсивно, через scandir)"""
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            continue
+    return total
+
+
+def prepare_profile(profile_dir, max_mb=None):
+    """
+    Готовит директорию профиля к запуску:
+    снимает устаревшие Singleton-блокировки и сбрасывает профиль, если он вырос сверх лимита
+    (кроме HTTP-кэша растут Code Cache, Service Worker и т.п., их Chromium не ограничивает)
+    """
+    max_mb = BROWSER_PROFILE_MAX_MB if max_mb is None else max_mb
+    os.makedirs(profile_dir, exist_ok=True)
+
+    size = directory_size(profile_dir)
+    if size > max_mb * 1024 * 1024:
+        logger.warning(f"⚠️ Профиль браузера {size / 1024 / 1024:.0f} MB > {max_mb} MB - сбрасываем (холодный кэш)")
+        shutil.rmtree(profile_dir, ignore_errors=True)
+        os.makedirs(profile_dir, exist_ok=True)
+        size = 0
+
+    for name in SINGLETON_FILES:
+        path = os.path.join(profile_dir, name)
+        if os.path.lexists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"⚠️ Не удалось снять блокировку профиля {name}: {e}")
+    return size
+
+
+def mark_profile_used(profile_dir):
+    """Создает метку <profile_dir>.used (вне профиля, чтобы не попасть в кэш)"""
+    try:
+        with open(f"{os.path.normpath(profile_dir)}{PROFILE_USED_SUFFIX}", 'w', encoding='utf-8') as f:
+            f.write(str(int(time.time())))
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось создать метку профиля: {e}")
+
+
+class BrowserSession:
+    """
+    Браузер + контекст одного запуска
+    - mode 'launch': свой браузер, закрывается целиком
+    - mode 'profile': постоянный контекст (browser = None), закрывается контекст
+    - mode 'shared': подключение к browser_server.py - закрывается только свой контекст,
+      затем отключение (сам браузер остается для следующих запусков)
+    """
+
+    def __init__(self, browser, context, mode='launch'):
+        self.browser = browser
+        self.context = context
+        self.mode = mode
+
+    @property
+    def persistent(self):
+        return self.mode == 'profile'
+
+    async def new_page(self):
+        # Постоянный контекст открывается с пустой вкладкой - используем ее
+        if self.persistent and self.context.pages:
+            return self.context.pages[0]
+        return await self.context.new_page()
+
+    async def close(self):
+        try:
+            if self.mode == 'shared':
+                await self.context.close()
+                await self.browser.close()  # Для подключенного браузера - только отключение
+                logger.info("✓ Отключено от общего браузера\n")
+                return
+            if self.browser:
+                await self.browser.close()
+            else:
+                await self.context.close()
+            logger.info("✓ Браузер закрыт\n")
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка закрытия браузера: {e}")
+
+
+async def connect_shared(playwright, context_options, server_url=None):
+    """Подключается к browser_server.py; None если сервер недоступен"""
+    server_url = server_url or BROWSER_SERVER_URL
+    if not server_url:
+        return None
+    try:
+        browser = await playwright.chromium.connect_over_cdp(
+            server_url, timeout=BROWSER_SERVER_CONNECT_TIMEOUT * 1000
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Общий браузер {server_url} недоступен ({e}), запускаем свой")
+        return None
+    try:
+        context = await browser.new_context(**context_options)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось создать контекст в общем браузере ({e}), запускаем свой")
+        await browser.close()
+        return None
+    logger.info(f"🌐 Подключено к общему браузеру {server_url} (Chromium {browser.version})")
+    return BrowserSession(browser, context, mode='shared')
+
+
+async def open_session(playwright, user_agent, viewport, profile_dir=None, use_profile=None, use_server=True):
+    """
+    Открывает контекст: общий браузер (BROWSER_SERVER_URL) -> постоянный профиль -> обычный запуск
+
+    Args:
+        playwright: объект async_playwright()
+        user_agent: User-Agent контекста
+        viewport: (ширина, высота)
+        profile_dir: директория профиля (по умолчанию BROWSER_PROFILE_DIR)
+        use_profile: постоянный профиль (по умолчанию BROWSER_PROFILE)
+        use_server: пробовать общий браузер BROWSER_SERVER_URL
+
+    Returns:
+        BrowserSession
+    """
+    use_profile = BROWSER_PROFILE if use_profile is None else use_profile
+    context_options = {
+        'user_agent': user_agent,
+        'viewport': {'width': viewport[0], 'height': viewport[1]},
+        'extra_http_headers': CONTEXT_HEADERS
+    }
+
+    session = await connect_shared(playwright, context_options) if use_server else None
+    if session:
+        return session
+
+    if use_profile:
+        profile_dir = profile_dir or BROWSER_PROFILE_DIR
+        size = prepare_profile(profile_dir)
+        logger.info(f"🌐 Запуск браузера с профилем {profile_dir} ({size / 1024 / 1024:.0f} MB, кэш до {BROWSER_CACHE_MB} MB)...")
+        try:
+            context = await playwright.chromium.launch_persistent_context(
+                profile_dir,
+                headless=True,
+                args=CHROMIUM_ARGS + [f'--disk-cache-size={BROWSER_CACHE_MB * 1024 * 1024}'],
+                **context_options
+            )
+            mark_profile_used(profile_dir)
+            return BrowserSession(None, context, mode='profile')
+        except Exception as e:
+            # Битый профиль не должен срывать публикацию
+            logger.warning(f"⚠️ Не удалось открыть профиль ({e}), запуск без профиля")
+
+    logger.info("🌐 Запуск браузера...")
+    browser = await playwright.chromium.launch(headless=True, args=CHROMIUM_ARGS)
+    try:
+        context = await browser.new_context(**context_options)
+    except BaseException:
+        await browser.close()
+        raise
+    return BrowserSession(browser, context)
+
+
+class CacheStats:
+    """Счетчики сетевых запросов страницы по CDP (сколько обслужено из кэша)"""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_network = 0
+        self._hits = set()  # requestId: одно попадание может прийти обоими событиями
+
+    @property
+    def cache_hits(self):
+        return len(self._hits)
+
+    @property
+    def hit_rate(self):
+        return self.cache_hits / self.requests if self.requests else 0.0
+
+    def _on_response(self, params):
+        self.requests += 1
+        response = params.get('response', {})
+        if response.get('fromDiskCache') or response.get('fromPrefetchCache'):
+            self._hits.add(params.get('requestId'))
+
+    def _on_served_from_cache(self, params):
+        # Из memory cache ответ приходит без fromDiskCache
+        self._hits.add(params.get('requestId'))
+
+    def _on_finished(self, params):
+        self.bytes_network += params.get('encodedDataLength', 0)
+
+
+async def watch_cache(context, page):
+    """Подписывается на Network.* события страницы; None если CDP недоступен"""
+    stats = CacheStats()
+    try:
+        cdp = await context.new_cdp_session(page)
+        cdp.on('Network.responseReceived', stats._on_response)
+        cdp.on('Network.requestServedFromCache', stats._on_served_from_cache)
+        cdp.on('Network.loadingFinished', stats._on_finished)
+        await cdp.send('Network.enable')
+        return stats
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось подключить CDP для статистики кэша: {e}")
+        return None
+
+
+async def _bench_visit(playwright, url, user_agent, viewport, profile_dir, use_profile):
+    session = await open_session(playwright, user_agent, viewport, profile_dir, use_profile, use_server=False)
+    try:
+        page = await session.new_page()
+        stats = await watch_cache(session.context, page)
+        started = time.perf_counter()
+        await page.goto(url, wait_until='load', timeout=60000)
+        elapsed = time.perf_counter() - started
+        # Даем догрузиться отложенным бандлам графиков
+        await asyncio.sleep(2)
+        return elapsed, stats
+    finally:
+        await session.close()
+
+
+async def bench(url, user_agent, viewport, profile_dir=None, runs=2):
+    """
+    Холодный и теплый заход на url
+
+    profile_dir=None - временный профиль (первый заход гарантированно холодный)
+
+    Returns:
+        list: [{"run", "load_s", "requests", "cache_hits", "hit_rate", "network_mb"}]
+    """
+    from playwright.async_api import async_playwright
+
+    temporary = profile_dir is None
+    profile_dir = profile_dir or tempfile.mkdtemp(prefix='cmc_profile_')
+    rows = []
+    try:
+        async with async_playwright() as p:
+            # Без профиля - базовая линия текущего поведения
+            elapsed, stats = await _bench_visit(p, url, user_agent, viewport, None, False)
+            rows.append(_bench_row('no-profile', elapsed, stats))
+            for run in range(runs):
+                label = 'cold' if run == 0 and temporary else f'warm#{run if temporary else run + 1}'
+                elapsed, stats = await _bench_visit(p, url, user_agent, viewport, profile_dir, True)
+                rows.append(_bench_row(label, elapsed, stats))
+    finally:
+        if temporary:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+    return rows
+
+
+def _bench_row(label, elapsed, stats):
+    return {
+        "run": label,
+        "load_s": elapsed,
+        "requests": stats.requests if stats else None,
+        "cache_hits": stats.cache_hits if stats else None,
+        "hit_rate": stats.hit_rate if stats else None,
+        "network_mb": stats.bytes_network / 1024 / 1024 if stats else None
+    }
+
+
+def main():
+    from sources_config import SCREENSHOT_SOURCES, SCREENSHOT_SETTINGS
+    from source_specs import compile_sources
+
+    parser = argparse.ArgumentParser(description="Постоянный профиль Chromium")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench_parser = commands.add_parser('bench', help='Сравнение холодного и теплого HTTP-кэша')
+    bench_parser.add_argument('--source', default='fear_greed')
+    bench_parser.add_argument('--runs', type=int, default=2, help='Заходов с профилем')
+    bench_parser.add_argument('--profile', action='store_true', help=f'Использовать {BROWSER_PROFILE_DIR} вместо временного')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    specs = compile_sources(SCREENSHOT_SOURCES, SCREENSHOT_SETTINGS)
+    spec = specs.get(args.source)
+    if not spec:
+        print(f"Неизвестный источник: {args.source}")
+        sys.exit(1)
+
+    rows = asyncio.run(bench(spec.url, spec.user_agent, spec.viewport,
+                             BROWSER_PROFILE_DIR if args.profile else None, args.runs))
+
+    print(f"Кэш браузера: {spec.name} ({spec.url})")
+    print(f"  {'заход':12} {'загрузка':>9} {'запросов':>9} {'из кэша':>8} {'доля':>6} {'сеть':>9}")
+    for row in rows:
+        hit_rate = f"{row['hit_rate']:.0%}" if row['hit_rate'] is not None else '-'
+        network = f"{row['network_mb']:.1f}MB" if row['network_mb'] is not None else '-'
+        print(f"  {row['run']:12} {row['load_s']:>8.1f}s {row['requests'] or 0:>9} "
+              f"{row['cache_hits'] or 0:>8} {hit_rate:>6} {network:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Сборка дайджеста: несколько скриншотов одной картинкой-сеткой с подписями
+Version: 1.0.0
+Плитки и сетка собираются операциями над numpy-массивами (срезы и reshape),
+а не PIL paste по одной картинке. Буферы холста переиспользуются между сборками
+(в воркере пула процессов - между запусками), подписи рендерятся один раз.
+На выходе одно JPEG-кодирование и одна загрузка вместо N
+
+Использование:
+    python digest_image.py a.jpg b.jpg c.jpg d.jpg -o digest.jpg
+"""
+
+import os
+import logging
+import argparse
+import functools
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+# Шрифт подписей: DejaVu есть на ubuntu-раннерах, иначе встроенный шрифт Pillow
+FONT_PATHS = (
+    'DejaVuSans-Bold.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+)
+LABEL_PADDING = 12  # Отступ подписи слева (px)
+
+# Переиспользуемые буферы: (имя, shape) -> np.ndarray
+_buffers = {}
+
+
+def _buffer(name, shape, fill):
+    """Буфер нужной формы, залитый цветом fill (выделяется один раз на форму)"""
+    key = (name, shape)
+    buf = _buffers.get(key)
+    if buf is None:
+        buf = _buffers[key] = np.empty(shape, dtype=np.uint8)
+    buf[...] = fill
+    return buf
+
+
+@functools.lru_cache(maxsize=8)
+def load_font(size):
+    """Жирный шрифт нужного размера (кэшируется)"""
+    for path in FONT_PATHS:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=size)
+
+
+@functools.lru_cache(maxsize=64)
+def label_strip(text, width, height, font_size, color, background):
+    """Полоса с подписью плитки (кэшируется: подписи между сборками не меняются)"""
+    strip = Image.new('RGB', (width, height), background)
+    draw = ImageDraw.Draw(strip)
+    font = load_font(font_size)
+    top, bottom = draw.textbbox((0, 0), text, font=font)[1::2]
+    draw.text((LABEL_PADDING, (height - (bottom - top)) // 2 - top), text, font=font, fill=color)
+    array = np.asarray(strip)
+    array.setflags(write=False)
+    return array
+
+
+def fit_tile(target, image_path, background):
+    """
+    Вписывает скриншот в target (срез буфера H x W x 3) с сохранением пропорций,
+    по центру, без увеличения; свободное место заливается background
+    """
+    height, width = target.shape[:2]
+    with Image.open(image_path) as img:
+        scale = min(width / img.width, height / img.height, 1.0)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img.draft('RGB', size)  # JPEG декодируется сразу в уменьшенном размере
+        img = img.convert('RGB')
+        if img.size != size:
+            img = img.resize(size, Image.Resampling.LANCZOS)
+        pixels = np.asarray(img)
+
+    target[...] = background
+    top = (height - size[1]) // 2
+    left = (width - size[0]) // 2
+    target[top:top + size[1], left:left + size[0]] = pixels
+
+
+def grid_shape(count, layout):
+    """(rows, height, width) итоговой картинки для count плиток"""
+    columns = min(layout['columns'], count)
+    rows = -(-count // columns)
+    tile_width, tile_height = layout['tile_size']
+    gap, margin = layout['gap'], layout['margin']
+    height = 2 * margin + rows * (layout['label_height'] + tile_height + gap) - gap
+    width = 2 * margin + columns * (tile_width + gap) - gap
+    return rows, height, width
+
+
+def compose_digest(tiles, layout, output_path):
+    """
+    Собирает сетку и сохраняет JPEG
+
+    Каждая плитка пишется в свою ячейку буфера (rows*cols, cell_h, cell_w, 3),
+    затем ячейки раскладываются в сетку одним reshape/swapaxes
+
+    Args:
+        tiles: [(подпись, путь к скриншоту)]
+        layout: DigestSpec.layout()
+        output_path: Куда сохранить JPEG
+
+    Returns:
+        str: output_path
+    """
+    if not tiles:
+        raise ValueError("Нет плиток для дайджеста")
+
+    columns = min(layout['columns'], len(tiles))
+    rows, height, width = grid_shape(len(tiles), layout)
+    tile_width, tile_height = layout['tile_size']
+    label_height, gap, margin = layout['label_height'], layout['gap'], layout['margin']
+    background = tuple(layout['background'])
+    tile_background = tuple(layout['tile_background'])
+
+    cell_height = label_height + tile_height + gap
+    cell_width = tile_width + gap
+    cells = _buffer('cells', (rows * columns, cell_height, cell_width, 3), background)
+
+    for index, (label, image_path) in enumerate(tiles):
+        cell = cells[index]
+        if label_height:
+            cell[:label_height, :tile_width] = label_strip(
+                label, tile_width, label_height, layout['font_size'],
+                tuple(layout['label_color']), background
+            )
+        fit_tile(cell[label_height:label_height + tile_height, :tile_width], image_path, tile_background)
+
+    # (rows, cols, cell_h, cell_w, 3) -> (rows * cell_h, cols * cell_w, 3)
+    grid = cells.reshape(rows, columns, cell_height, cell_width, 3).swapaxes(1, 2)
+    grid = grid.reshape(rows * cell_height, columns * cell_width, 3)
+
+    canvas = _buffer('canvas', (height, width, 3), background)
+    canvas[margin:height - margin, margin:width - margin] = grid[:rows * cell_height - gap, :columns * cell_width - gap]
+
+    Image.fromarray(canvas).save(output_path, 'JPEG', quality=layout['quality'], optimize=True)
+    return output_path
+
+
+def main():
+    from sources_config import DIGEST_SETTINGS
+
+    parser = argparse.ArgumentParser(description="Сборка дайджеста из готовых скриншотов")
+    parser.add_argument('images', nargs='+', help='Скриншоты (подпись - имя файла)')
+    parser.add_argument('-o', '--output', default='digest.jpg')
+    parser.add_argument('--columns', type=int, default=DIGEST_SETTINGS['columns'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    layout = {
+        'columns': args.columns,
+        'tile_size': (DIGEST_SETTINGS['tile_width'], DIGEST_SETTINGS['tile_height']),
+        **{name: DIGEST_SETTINGS[name] for name in (
+            'label_height', 'gap', 'margin', 'font_size', 'background',
+            'tile_background', 'label_color', 'quality')}
+    }
+    tiles = [(os.path.splitext(os.path.basename(path))[0], path) for path in args.images]
+    compose_digest(tiles, layout, args.output)
+    logger.info(f"✓ Дайджест: {args.output} ({os.path.getsize(args.output) / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Оптимизация скриншота для Telegram: обрезка, уменьшение, padding, JPEG
+Version: 1.0.0
+Отдельный модуль без зависимостей от парсера: воркер пула процессов (image_pool.py)
+при распаковке задачи импортирует только его, PIL и sources_config, а не весь бот
+"""
+
+import os
+import logging
+
+from PIL import Image
+
+from sources_config import IMAGE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+def optimize_image_for_telegram(image_path, skip_width_padding=False, crop=None):
+    """Оптимизирует изображение для Telegram
+    
+    Args:
+        image_path: Путь к изображению
+        skip_width_padding: Пропустить добавление padding по ширине
+        crop: Dict с параметрами обрезки {"top": N, "right": N, "bottom": N, "left": N} в пикселях
+    """
+    try:
+        logger.info(f"🖼️  Оптимизация изображения: {image_path}")
+        
+        img = Image.open(image_path)
+        original_size = os.path.getsize(image_path)
+        
+        logger.info(f"  Исходный размер: {img.size[0]}x{img.size[1]} ({original_size / 1024:.1f} KB)")
+        
+        # Конвертируем в RGB если нужно
+        if img.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+            img = background
+        
+        # ✅ НОВОЕ: Обрезка изображения
+        if crop:
+            top = crop.get('top', 0)
+            right = crop.get('right', 0)
+            bottom = crop.get('bottom', 0)
+            left = crop.get('left', 0)
+            
+            width, height = img.size
+            crop_box = (
+                left,                    # left
+                top,                     # top
+                width - right,           # right
+                height - bottom          # bottom
+            )
+            
+            img = img.crop(crop_box)
+            logger.info(f"  ✂️  Обрезано: {img.size[0]}x{img.size[1]} (top:{top}, right:{right}, bottom:{bottom}, left:{left})")
+        
+        # CRITICAL: Валидация размеров изображения
+        if img.size[0] == 0 or img.size[1] == 0:
+            logger.error(f"  ✗ ОШИБКА: Изображение имеет нулевые размеры: {img.size[0]}x{img.size[1]}")
+            return None
+        
+        # Изменяем размер если больше лимита
+        max_width = IMAGE_SETTINGS['telegram_max_width']
+        max_height = IMAGE_SETTINGS['telegram_max_height']
+        
+        if img.size[0] > max_width or img.size[1] > max_height:
+            img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+            logger.info(f"  Изменен размер: {img.size[0]}x{img.size[1]}")
+        
+        # Добавляем padding если изображение слишком узкое (если не отключено)
+        min_width = IMAGE_SETTINGS.get('telegram_min_width', 0)
+        add_padding = IMAGE_SETTINGS.get('add_padding_if_narrow', False)
+        
+        if add_padding and not skip_width_padding and img.size[0] < min_width:
+            padding_color = IMAGE_SETTINGS.get('padding_color', (255, 255, 255))
+            
+            # Валидация padding_color
+            if not (isinstance(padding_color, tuple) and len(padding_color) == 3):
+                logger.warning(f"  ⚠️ Некорректный padding_color: {padding_color}, используем белый")
+                padding_color = (255, 255, 255)
+            else:
+                r, g, b = padding_color
+                if not (0 <= r <= 255 and 0 <= g <= 255 and 0 <= b <= 255):
+                    logger.warning(f"  ⚠️ padding_color вне диапазона 0-255: {padding_color}, используем белый")
+                    padding_color = (255, 255, 255)
+            
+            # Сохраняем исходную ширину для логирования
+            original_width = img.size[0]
+            
+            # Создаем новое изображение с нужной шириной
+            new_width = min_width
+            new_height = img.size[1]
+            new_img = Image.new('RGB', (new_width, new_height), padding_color)
+            
+            # Центрируем исходное изображение
+            paste_x = (new_width - img.size[0]) // 2
+            new_img.paste(img, (paste_x, 0))
+            
+            img = new_img
+            logger.info(f"  ✓ Добавлен padding: {img.size[0]}x{img.size[1]} (было {original_width}px, padding {paste_x}px с каждой стороны)")
+        
+        # Сохраняем оптимизированное изображение
+        # FIX BUG #1: Правильная обработка любого расширения
+        base_name = os.path.splitext(image_path)[0]
+        optimized_path = f"{base_name}_optimized.jpg"
+        img.save(optimized_path, 'JPEG', quality=IMAGE_SETTINGS['quality'], optimize=True)
+        
+        optimized_size = os.path.getsize(optimized_path)
+        logger.info(f"  ✓ Оптимизировано: {optimized_size / 1024:.1f} KB (экономия: {(1 - optimized_size/original_size)*100:.1f}%)")
+        
+        return optimized_path
+        
+    except Exception as e:
+        logger.error(f"✗ Ошибка оптимизации изображения: {e}")
+        # FIX BUG #4: Проверяем что исходник существует
+        if os.path.exists(image_path):
+            logger.info(f"  ✓ Возвращаю исходный файл: {image_path}")
+            return image_path
+        else:
+            logger.error(f"  ✗ Исходный файл не существует: {image_path}")
+            return None
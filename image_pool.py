@@ -0,0 +1,107 @@
+"""
+Пулы для обработки изображений вне event loop
+Version: 1.0.0
+- process pool: CPU-тяжелое кодирование (RGBA->RGB, LANCZOS, JPEG optimize=True)
+- thread pool: декодирование/numpy, где PIL и numpy отпускают GIL
+Оба пула ограничены по размеру и создаются лениво.
+Функции для пула процессов - из легких модулей (image_optimize, digest_image):
+spawn-воркер импортирует модуль функции, и импорт всего бота стоил бы дороже кодирования
+"""
+
+import os
+import asyncio
+import logging
+import pickle
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# thread | process | inline (inline - старое поведение, прямо в event loop)
+# thread по умолчанию: PIL отпускает GIL при resize/JPEG, а запуск spawn-воркеров
+# (~0.25 s на процесс) дороже одного кодирования за запуск; process - для пакетной обработки
+IMAGE_POOL_MODE = os.getenv('IMAGE_POOL', 'thread').lower()
+IMAGE_POOL_WORKERS = int(os.getenv('IMAGE_POOL_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_process_pool = None
+_thread_pool = None
+
+
+def _noop():
+    return os.getpid()
+
+
+def _init_worker():
+    """Логи воркера в том же формате, что и у парсера"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # spawn: дочерние процессы не наследуют потоки Playwright/asyncio (fork с потоками небезопасен)
+        _process_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_POOL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+    return _process_pool
+
+
+def _get_thread_pool():
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=IMAGE_POOL_WORKERS, thread_name_prefix='image')
+    return _thread_pool
+
+
+def warm_up():
+    """Запускает воркеры заранее (пока браузер грузит страницу)"""
+    if IMAGE_POOL_MODE != 'process':
+        return
+    try:
+        pool = _get_process_pool()
+        for _ in range(IMAGE_POOL_WORKERS):
+            pool.submit(_noop)
+        logger.info(f"⚙️  Пул обработки изображений: {IMAGE_POOL_WORKERS} процессов")
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось запустить пул процессов: {e}")
+
+
+async def run_cpu(func, *args, **kwargs):
+    """
+    Выполняет CPU-тяжелую функцию в пуле процессов (func должна быть picklable)
+    При IMAGE_POOL=thread - в пуле потоков, при inline - прямо здесь
+    """
+    call = functools.partial(func, *args, **kwargs)
+    if IMAGE_POOL_MODE == 'inline':
+        return call()
+    loop = asyncio.get_running_loop()
+    if IMAGE_POOL_MODE == 'process':
+        try:
+            return await loop.run_in_executor(_get_process_pool(), call)
+        except (BrokenProcessPool, pickle.PicklingError, OSError) as e:
+            # Пул упал или функция не сериализуется - не теряем кадр, считаем в потоке
+            logger.warning(f"⚠️ Пул процессов недоступен ({e}), обрабатываю в потоке")
+    return await loop.run_in_executor(_get_thread_pool(), call)
+
+
+async def run_io(func, *args, **kwargs):
+    """Выполняет функцию в пуле потоков (декодирование, numpy - отпускают GIL)"""
+    call = functools.partial(func, *args, **kwargs)
+    if IMAGE_POOL_MODE == 'inline':
+        return call()
+    return await asyncio.get_running_loop().run_in_executor(_get_thread_pool(), call)
+
+
+def shutdown():
+    """Останавливает пулы (в конце запуска)"""
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=True)
+        _thread_pool = None
@@ -0,0 +1,199 @@
+"""
+Проверка качества скриншота до вызова OpenAI и публикации
+Version: 1.0.0
+Векторизованные метрики на декодированном изображении (numpy):
+- дисперсия яркости (пустой/неотрисованный canvas)
+- доля доминирующего цвета (белая страница, Cloudflare challenge)
+- плотность границ (нет графиков/текста)
+- сходство с эталонной сигнатурой источника (страница "не та")
+Плохой кадр отбрасывается за миллисекунды и уходит на повтор
+"""
+
+import os
+import json
+import logging
+
+from PIL import Image
+
+from atomic_io import atomic_write_json
+from sources_config import QUALITY_GATE_SETTINGS
+
+# numpy - опциональная зависимость: без нее проверка пропускается
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+logger = logging.getLogger(__name__)
+
+# Размер для анализа (метрики не требуют полного разрешения)
+ANALYSIS_SIZE = 256
+SIGNATURE_SIZE = 16
+
+
+class QualityVerdict:
+    """Результат проверки качества"""
+
+    __slots__ = ('ok', 'reasons', 'metrics')
+
+    def __init__(self, ok, reasons=None, metrics=None):
+        self.ok = ok
+        self.reasons = reasons or []
+        self.metrics = metrics or {}
+
+    def __bool__(self):
+        return self.ok
+
+    def describe(self):
+        return ", ".join(self.reasons) if self.reasons else "ok"
+
+
+def _decode(image_path):
+    """Декодирует и уменьшает изображение -> (rgb uint8 HxWx3, luminance float32 HxW)"""
+    with Image.open(image_path) as img:
+        img = img.convert('RGB')
+        img.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.Resampling.BILINEAR)
+        rgb = np.asarray(img, dtype=np.uint8)
+    # ITU-R BT.601 luma
+    luminance = rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    return rgb, luminance
+
+
+def compute_metrics(rgb, luminance):
+    """Считает метрики качества одним проходом по массивам"""
+    # Доля доминирующего цвета: квантуем до 4 бит на канал и считаем гистограмму
+    quantized = (rgb >> 4).astype(np.int32)
+    codes = (quantized[..., 0] << 8) | (quantized[..., 1] << 4) | quantized[..., 2]
+    dominant_ratio = float(np.bincount(codes.ravel(), minlength=4096).max()) / codes.size
+
+    # Плотность границ: доля пикселей с заметным градиентом яркости
+    grad_x = np.abs(np.diff(luminance, axis=1))[:-1, :]
+    grad_y = np.abs(np.diff(luminance, axis=0))[:, :-1]
+    edge_density = float(np.mean((grad_x + grad_y) > 24.0))
+
+    return {
+        "luminance_std": float(luminance.std()),
+        "dominant_ratio": dominant_ratio,
+        "edge_density": edge_density
+    }
+
+
+def compute_signature(luminance):
+    """Сигнатура: z-нормализованная миниатюра яркости SIGNATURE_SIZE x SIGNATURE_SIZE"""
+    h, w = luminance.shape
+    ys = np.linspace(0, h, SIGNATURE_SIZE + 1).astype(int)
+    xs = np.linspace(0, w, SIGNATURE_SIZE + 1).astype(int)
+    # Среднее по блокам через кумулятивные суммы (без цикла по пикселям)
+    integral = np.pad(luminance.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    sums = (integral[ys[1:, None], xs[None, 1:]] - integral[ys[:-1, None], xs[None, 1:]]
+            - integral[ys[1:, None], xs[None, :-1]] + integral[ys[:-1, None], xs[None, :-1]])
+    areas = np.maximum(np.outer(np.diff(ys), np.diff(xs)), 1)
+    blocks = (sums / areas).ravel()
+    std = blocks.std()
+    return (blocks - blocks.mean()) / std if std > 1e-6 else np.zeros_like(blocks)
+
+
+class SignatureStore:
+    """Эталонные сигнатуры по источникам (скользящее среднее принятых кадров)"""
+
+    def __init__(self, path=None):
+        self.path = path or QUALITY_GATE_SETTINGS['signatures_file']
+        self.signatures = {}
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.signatures = json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка загрузки сигнатур качества: {e}")
+
+    def similarity(self, source_key, signature):
+        """Корреляция с эталоном или None если эталон еще не набран"""
+        entry = self.signatures.get(source_key)
+        if not entry or entry['samples'] < QUALITY_GATE_SETTINGS['signature_min_samples']:
+            return None
+        reference = np.asarray(entry['vector'], dtype=np.float32)
+        if reference.shape != signature.shape:
+            return None
+        return float(np.dot(reference, signature) / len(signature))
+
+    def update(self, source_key, signature):
+        entry = self.signatures.get(source_key)
+        alpha = QUALITY_GATE_SETTINGS['signature_alpha']
+        if entry and len(entry['vector']) == len(signature):
+            vector = (1 - alpha) * np.asarray(entry['vector'], dtype=np.float32) + alpha * signature
+            # Ренормализация чтобы корреляция оставалась в [-1, 1]
+            std = vector.std()
+            vector = (vector - vector.mean()) / std if std > 1e-6 else vector
+            samples = entry['samples'] + 1
+        else:
+            vector, samples = signature, 1
+        self.signatures[source_key] = {
+            "samples": samples,
+            "vector": [round(float(v), 3) for v in vector]
+        }
+        try:
+            atomic_write_json(self.path, self.signatures, separators=(',', ':'))
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка сохранения сигнатур качества: {e}")
+
+
+_signature_store = None
+
+
+def _store():
+    global _signature_store
+    if _signature_store is None:
+        _signature_store = SignatureStore()
+    return _signature_store
+
+
+def assess_capture(image_path, source_key, overrides=None, fallback_viewport=False):
+    """
+    Проверяет скриншот перед AI и публикацией
+
+    Args:
+        image_path: Путь к оптимизированному изображению
+        source_key: Ключ источника (для эталонной сигнатуры)
+        overrides: Пороги источника (source_config["quality_gate"])
+        fallback_viewport: Селектор не найден и снят весь viewport (только на последней
+            попытке): проверяется на пустоту/однотонность, но не по эталону элемента
+
+    Returns:
+        QualityVerdict: ok=False если кадр битый/пустой/не тот
+    """
+    settings = {**QUALITY_GATE_SETTINGS, **(overrides or {})}
+    if not settings.get('enabled', True):
+        return QualityVerdict(True)
+
+    reasons = []
+    if fallback_viewport and settings.get('reject_viewport_fallback', False):
+        reasons.append("селектор не найден (скриншот viewport)")
+
+    if not HAS_NUMPY:
+        logger.info("  ℹ️  numpy не установлен - проверка качества пропущена")
+        return QualityVerdict(not reasons, reasons)
+
+    rgb, luminance = _decode(image_path)
+    values = compute_metrics(rgb, luminance)
+
+    if values['luminance_std'] < settings['min_luminance_std']:
+        reasons.append(f"нет контраста (std {values['luminance_std']:.1f})")
+    if values['dominant_ratio'] > settings['max_dominant_ratio']:
+        reasons.append(f"один цвет {values['dominant_ratio'] * 100:.0f}%")
+    if values['edge_density'] < settings['min_edge_density']:
+        reasons.append(f"нет деталей (edges {values['edge_density'] * 100:.2f}%)")
+
+    signature = compute_signature(luminance)
+    # Эталон снят с элемента - viewport с ним не сравнивается и его не обновляет
+    similarity = None if fallback_viewport else _store().similarity(source_key, signature)
+    if similarity is not None:
+        values['signature_similarity'] = similarity
+        if similarity < settings['min_signature_similarity']:
+            reasons.append(f"не похоже на эталон ({similarity:.2f})")
+
+    verdict = QualityVerdict(not reasons, reasons, {k: round(v, 4) for k, v in values.items()})
+    if verdict.ok and not fallback_viewport:
+        # Эталон обновляем только принятыми кадрами элемента
+        _store().update(source_key, signature)
+    return verdict
@@ -0,0 +1,453 @@
+"""
+Шкалы и карточки для скалярных индикаторов без браузера
+Version: 1.0.0
+Fear & Greed, Altcoin Season, BTC Dominance - это одно-два числа. Картинка рисуется
+локально из значений probe (source_probe.py) или собственного JSON-эндпоинта:
+- gauge: полукруглая шкала со стрелкой, значение и класс (Fear / Greed ...)
+- card: карточка с крупным числом и изменением
+
+Статичное рисуется один раз и кэшируется (в памяти и в RENDER_CACHE_DIR):
+фон с заголовком, кольцо шкалы с градиентом и делениями, атлас глифов цифр.
+На каждый рендер - только динамика: стрелка, число (склейка глифов из атласа
+и альфа-смешивание numpy), подпись класса и время
+
+Использование:
+    python indicator_renderer.py gauge --value 63 --title "Fear & Greed Index" -o gauge.jpg
+    python indicator_renderer.py card --value 57.32 --title "Bitcoin Dominance" -o card.jpg
+    python indicator_renderer.py --source btc_dominance -o card.jpg
+"""
+
+import os
+import sys
+import math
+import json
+import time
+import hashlib
+import logging
+import argparse
+import functools
+from datetime import datetime, timezone
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from digest_image import load_font
+from source_probe import PROBE_REPLAY_DIR, PROBE_USER_AGENT, HttpTransport, ReplayTransport, json_value
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_DIR = os.getenv('RENDER_CACHE_DIR', '.render_cache')
+ASSETS_VERSION = 1  # Увеличить при изменении отрисовки статичных слоев (сбрасывает кэш)
+
+# Символы атласа: все, что встречается в форматах значений
+ATLAS_CHARS = "0123456789.,%+-"
+
+COMMON_DEFAULTS = {
+    "width": 1200,
+    "height": 675,
+    "title": "",
+    "subtitle": "",
+    "background": (17, 24, 39),
+    "panel": (31, 41, 55),
+    "text_color": (249, 250, 251),
+    "muted_color": (156, 163, 175),
+    "quality": 90
+}
+
+GAUGE_DEFAULTS = {
+    **COMMON_DEFAULTS,
+    "min": 0,
+    "max": 100,
+    "format": "{:.0f}",
+    "value_size": 100,
+    # Цвета шкалы по значению (градиент между точками)
+    "stops": [[0, (234, 57, 67)], [25, (234, 140, 0)], [50, (243, 212, 47)], [75, (147, 217, 0)], [100, (22, 199, 132)]],
+    "ticks": [0, 25, 50, 75, 100],
+    "bands": []                  # [[верхняя граница, "подпись"], ...] - класс значения, если нет label
+}
+
+CARD_DEFAULTS = {
+    **COMMON_DEFAULTS,
+    "format": "{:.2f}%",
+    "delta_format": "{:+.2f}%",
+    "value_size": 200,
+    "accent": (247, 147, 26)
+}
+
+
+def _options(defaults, options):
+    merged = dict(defaults)
+    merged.update(options or {})
+    return merged
+
+
+# ---------------------------------------------------------------------------
+# Кэш статичных слоев
+# ---------------------------------------------------------------------------
+
+_layers = {}
+
+
+def cached_layer(kind, params, draw_func):
+    """
+    Статичный слой (H x W x 3 uint8): память -> RENDER_CACHE_DIR -> draw_func(params)
+
+    Ключ - хэш параметров слоя, так что изменение заголовка или цветов в конфиге
+    просто дает новый слой
+    """
+    digest = hashlib.sha1(json.dumps([kind, ASSETS_VERSION, params], sort_keys=True, default=list).encode()).hexdigest()[:16]
+    layer = _layers.get(digest)
+    if layer is not None:
+        return layer
+
+    path = os.path.join(RENDER_CACHE_DIR, f"{kind}_{digest}.png") if RENDER_CACHE_DIR else None
+    if path and os.path.exists(path):
+        try:
+            with Image.open(path) as img:
+                layer = np.asarray(img.convert('RGB'))
+        except Exception as e:
+            logger.warning(f"⚠️ Поврежден кэш слоя {path}: {e}")
+
+    if layer is None:
+        layer = draw_func(params)
+        if path:
+            try:
+                os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                Image.fromarray(layer).save(tmp_path, 'PNG')
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось сохранить кэш слоя: {e}")
+
+    layer.setflags(write=False)
+    _layers[digest] = layer
+    return layer
+
+
+class GlyphAtlas:
+    """Глифы ATLAS_CHARS одного размера в одной полосе-маске (альфа 0..1)"""
+
+    def __init__(self, size):
+        font = load_font(size)
+        ascent, descent = font.getmetrics()
+        self.height = ascent + descent
+        widths = [max(1, math.ceil(font.getlength(ch))) for ch in ATLAS_CHARS]
+        strip = Image.new('L', (sum(widths), self.height), 0)
+        draw = ImageDraw.Draw(strip)
+        self.offsets = {}
+        x = 0
+        for ch, width in zip(ATLAS_CHARS, widths):
+            draw.text((x, 0), ch, font=font, fill=255)
+            self.offsets[ch] = (x, x + width)
+            x += width
+        self.mask = np.asarray(strip, dtype=np.float32) / 255.0
+
+    def supports(self, text):
+        return all(ch in self.offsets for ch in text)
+
+    def text_mask(self, text):
+        """Маска строки: склейка срезов атласа (без отрисовки шрифта)"""
+        return np.concatenate([self.mask[:, slice(*self.offsets[ch])] for ch in text], axis=1)
+
+
+@functools.lru_cache(maxsize=8)
+def glyph_atlas(size):
+    return GlyphAtlas(size)
+
+
+def blend_mask(canvas, mask, left, top, color):
+    """Альфа-смешивание маски цветом в canvas (с обрезкой по краям)"""
+    height, width = mask.shape
+    x0, y0 = max(0, left), max(0, top)
+    x1, y1 = min(canvas.shape[1], left + width), min(canvas.shape[0], top + height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    alpha = mask[y0 - top:y1 - top, x0 - left:x1 - left, None]
+    region = canvas[y0:y1, x0:x1].astype(np.float32)
+    canvas[y0:y1, x0:x1] = (region + (np.asarray(color, dtype=np.float32) - region) * alpha).round().astype(np.uint8)
+
+
+def draw_value(canvas, text, center_x, top, size, color):
+    """Число через атлас глифов (символы вне атласа - обычным шрифтом)"""
+    atlas = glyph_atlas(size)
+    if atlas.supports(text):
+        mask = atlas.text_mask(text)
+        blend_mask(canvas, mask, center_x - mask.shape[1] // 2, top, color)
+        return canvas
+    image = Image.fromarray(canvas)
+    ImageDraw.Draw(image).text((center_x, top), text, font=load_font(size), fill=tuple(color), anchor='mt')
+    return np.array(image)
+
+
+def _timestamp(generated_at):
+    return f"Updated {generated_at.strftime('%d %b %Y %H:%M')} UTC"
+
+
+# ---------------------------------------------------------------------------
+# Gauge
+# ---------------------------------------------------------------------------
+
+def _gauge_geometry(options):
+    width, height = options['width'], options['height']
+    outer = min(width * 0.3, height * 0.45)
+    return {
+        'cx': width // 2,
+        'cy': int(height * 0.7),
+        'outer': outer,
+        'inner': outer * 0.8
+    }
+
+
+def _stop_colors(stops, values):
+    points = [float(point) for point, _ in stops]
+    return np.stack([np.interp(values, points, [color[i] for _, color in stops]) for i in range(3)], axis=-1)
+
+
+def _draw_gauge_background(params):
+    """Фон + заголовок + кольцо с градиентом (numpy, сглаженные края) + деления"""
+    width, height = params['width'], params['height']
+    canvas = np.empty((height, width, 3), dtype=np.uint8)
+    canvas[...] = params['background']
+    geometry = _gauge_geometry(params)
+    cx, cy, outer, inner = geometry['cx'], geometry['cy'], geometry['outer'], geometry['inner']
+
+    # Кольцо: полярные координаты всех пикселей описанного прямоугольника разом
+    x0, x1 = int(cx - outer - 2), int(cx + outer + 2)
+    y0, y1 = int(cy - outer - 2), int(cy + 2)
+    ys, xs = np.mgrid[y0:y1, x0:x1].astype(np.float32)
+    dx, dy = xs - cx, cy - ys
+    radius = np.hypot(dx, dy)
+    angle = np.arctan2(dy, dx)  # pi (слева, min) -> 0 (справа, max)
+    coverage = np.clip(outer - radius + 0.5, 0, 1) * np.clip(radius - inner + 0.5, 0, 1) * np.clip(dy + 0.5, 0, 1)
+    span = params['max'] - params['min']
+    values = params['min'] + (1 - np.clip(angle, 0, np.pi) / np.pi) * span
+    colors = _stop_colors(params['stops'], values)
+    region = canvas[y0:y1, x0:x1].astype(np.float32)
+    canvas[y0:y1, x0:x1] = (region + (colors - region) * coverage[..., None]).round().astype(np.uint8)
+
+    image = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(image)
+    draw.text((width // 2, int(height * 0.09)), params['title'], font=load_font(44),
+              fill=tuple(params['text_color']), anchor='mm')
+    if params['subtitle']:
+        draw.text((width // 2, int(height * 0.09) + 44), params['subtitle'], font=load_font(22),
+                  fill=tuple(params['muted_color']), anchor='mm')
+
+    tick_font = load_font(22)
+    for tick in params['ticks']:
+        theta = math.pi * (1 - (tick - params['min']) / span)
+        # Подпись отодвигается на половину своей ширины, чтобы не наезжать на деление по бокам
+        label_radius = outer + 22 + tick_font.getlength(str(tick)) / 2 * abs(math.cos(theta))
+        draw.text((cx + label_radius * math.cos(theta), cy - label_radius * math.sin(theta)),
+                  str(tick), font=tick_font, fill=tuple(params['muted_color']), anchor='mm')
+        draw.line([(cx + (outer + 4) * math.cos(theta), cy - (outer + 4) * math.sin(theta)),
+                   (cx + (outer + 12) * math.cos(theta), cy - (outer + 12) * math.sin(theta))],
+                  fill=tuple(params['muted_color']), width=3)
+    return np.array(image)
+
+
+def band_label(value, bands):
+    """Класс значения по bands ([[верхняя граница, подпись], ...])"""
+    for upper, label in bands:
+        if value <= upper:
+            return label
+    return bands[-1][1] if bands else None
+
+
+def render_gauge(value, output_path, options=None, label=None, generated_at=None):
+    """
+    Полукруглая шкала со стрелкой
+
+    Args:
+        value: Значение индикатора (в пределах min..max)
+        label: Подпись класса (по умолчанию - по bands)
+
+    Returns:
+        str: output_path
+    """
+    options = _options(GAUGE_DEFAULTS, options)
+    static = {key: options[key] for key in (
+        'width', 'height', 'title', 'subtitle', 'background', 'text_color', 'muted_color',
+        'min', 'max', 'stops', 'ticks')}
+    canvas = np.array(cached_layer('gauge', static, _draw_gauge_background))
+
+    geometry = _gauge_geometry(options)
+    cx, cy, inner = geometry['cx'], geometry['cy'], geometry['inner']
+    span = options['max'] - options['min']
+    clamped = min(max(float(value), options['min']), options['max'])
+    theta = math.pi * (1 - (clamped - options['min']) / span)
+    value_color = tuple(int(c) for c in _stop_colors(options['stops'], np.array([clamped]))[0].round())
+
+    # Стрелка и ось - единственная векторная динамика
+    image = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(image)
+    tip = (cx + (inner - 18) * math.cos(theta), cy - (inner - 18) * math.sin(theta))
+    base = 12
+    draw.polygon([
+        tip,
+        (cx + base * math.cos(theta + math.pi / 2), cy - base * math.sin(theta + math.pi / 2)),
+        (cx + base * math.cos(theta - math.pi / 2), cy - base * math.sin(theta - math.pi / 2))
+    ], fill=tuple(options['text_color']))
+    draw.ellipse([cx - 18, cy - 18, cx + 18, cy + 18], fill=value_color, outline=tuple(options['text_color']), width=4)
+
+    label = label or band_label(clamped, options['bands'])
+    if label:
+        draw.text((cx, cy + 34 + options["value_size"]), str(label), font=load_font(38), fill=value_color, anchor='mt')
+    generated_at = generated_at or datetime.now(timezone.utc)
+    draw.text((options['width'] - 24, options['height'] - 20), _timestamp(generated_at), font=load_font(18),
+              fill=tuple(options['muted_color']), anchor='rb')
+    canvas = np.array(image)
+
+    canvas = draw_value(canvas, options['format'].format(float(value)), cx, cy + 30, options['value_size'], value_color)
+    Image.fromarray(canvas).save(output_path, 'JPEG', quality=options['quality'], optimize=True)
+    return output_path
+
+
+# ---------------------------------------------------------------------------
+# Card
+# ---------------------------------------------------------------------------
+
+def _draw_card_background(params):
+    """Вертикальный градиент + панель с акцентной полосой + заголовок"""
+    width, height = params['width'], params['height']
+    background = np.asarray(params['background'], dtype=np.float32)
+    shade = np.linspace(1.0, 0.75, height, dtype=np.float32)[:, None, None]
+    canvas = np.broadcast_to(background * shade, (height, width, 3)).round().astype(np.uint8)
+
+    image = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(image)
+    margin = int(min(width, height) * 0.08)
+    draw.rounded_rectangle([margin, margin, width - margin, height - margin], radius=28, fill=tuple(params['panel']))
+    draw.rectangle([margin, margin + 40, margin + 10, height - margin - 40], fill=tuple(params['accent']))
+    draw.text((width // 2, margin + 70), params['title'], font=load_font(44),
+              fill=tuple(params['text_color']), anchor='mm')
+    if params['subtitle']:
+        draw.text((width // 2, margin + 118), params['subtitle'], font=load_font(22),
+                  fill=tuple(params['muted_color']), anchor='mm')
+    return np.array(image)
+
+
+def render_card(value, output_path, options=None, delta=None, generated_at=None):
+    """
+    Карточка с крупным числом
+
+    Args:
+        value: Основное значение
+        delta: Изменение (необязательно) - зеленым/красным под числом
+
+    Returns:
+        str: output_path
+    """
+    options = _options(CARD_DEFAULTS, options)
+    static = {key: options[key] for key in (
+        'width', 'height', 'title', 'subtitle', 'background', 'panel', 'accent', 'text_color', 'muted_color')}
+    canvas = np.array(cached_layer('card', static, _draw_card_background))
+
+    width, height = options['width'], options['height']
+    value_top = height // 2 - glyph_atlas(options['value_size']).height // 2 + 10
+    canvas = draw_value(canvas, options['format'].format(float(value)), width // 2, value_top,
+                        options['value_size'], options['accent'])
+
+    image = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(image)
+    if delta is not None:
+        delta = float(delta)
+        color = (22, 199, 132) if delta >= 0 else (234, 57, 67)
+        draw.text((width // 2, value_top + glyph_atlas(options['value_size']).height + 10),
+                  options['delta_format'].format(delta), font=load_font(36), fill=color, anchor='mt')
+    generated_at = generated_at or datetime.now(timezone.utc)
+    margin = int(min(width, height) * 0.08)
+    draw.text((width - margin - 24, height - margin - 20), _timestamp(generated_at), font=load_font(18),
+              fill=tuple(options['muted_color']), anchor='rb')
+    image.save(output_path, 'JPEG', quality=options['quality'], optimize=True)
+    return output_path
+
+
+# ---------------------------------------------------------------------------
+# Значения и точки входа для screenshot_parser
+# ---------------------------------------------------------------------------
+
+def resolve_values(source_key, options, values=None, transport=None):
+    """
+    Значения по путям options value / label / delta: из probe (values) или из options['url']
+
+    Returns:
+        dict: путь -> значение
+    """
+    paths = [options['value']] + [options[key] for key in ('label', 'delta') if options.get(key)]
+    if values and all(path in values for path in paths):
+        return values
+    if not options.get('url'):
+        raise ValueError(f"нет значений {paths}: probe их не вернул, url не задан")
+    transport = transport or (ReplayTransport(PROBE_REPLAY_DIR) if PROBE_REPLAY_DIR else HttpTransport())
+    status, _, body = transport.fetch(source_key, options['url'], {
+        'User-Agent': PROBE_USER_AGENT,
+        'Accept': 'application/json'
+    })
+    if status != 200:
+        raise ValueError(f"HTTP {status} от {options['url']}")
+    data = json.loads(body)
+    return {path: json_value(data, path) for path in paths}
+
+
+def render_gauge_source(source_key, options, output_path, values=None):
+    """native_render.renderer = "gauge\""""
+    values = resolve_values(source_key, options, values)
+    label = values.get(options['label']) if options.get('label') else None
+    return render_gauge(float(values[options['value']]), output_path, options, label=label)
+
+
+def render_card_source(source_key, options, output_path, values=None):
+    """native_render.renderer = "card\""""
+    values = resolve_values(source_key, options, values)
+    delta = values.get(options['delta']) if options.get('delta') else None
+    return render_card(float(values[options['value']]), output_path, options, delta=delta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Шкалы и карточки индикаторов без браузера")
+    parser.add_argument('kind', nargs='?', choices=('gauge', 'card'))
+    parser.add_argument('--value', type=float)
+    parser.add_argument('--label')
+    parser.add_argument('--delta', type=float)
+    parser.add_argument('--title', default='')
+    parser.add_argument('--source', help='Источник с native_render gauge/card в sources_config.py')
+    parser.add_argument('--bench', type=int, default=0, help='Повторить рендер N раз и показать время')
+    parser.add_argument('-o', '--output', default='indicator.jpg')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.source:
+        from sources_config import SCREENSHOT_SOURCES, SCREENSHOT_SETTINGS
+        from source_specs import compile_sources
+        spec = compile_sources(SCREENSHOT_SOURCES, SCREENSHOT_SETTINGS).get(args.source)
+        native = spec.native_render if spec else None
+        if not native or native.renderer not in ('gauge', 'card'):
+            logger.error(f"✗ У источника {args.source} нет native_render gauge/card")
+            sys.exit(2)
+        render = render_gauge_source if native.renderer == 'gauge' else render_card_source
+        values = resolve_values(args.source, native.options)
+        call = lambda: render(args.source, native.options, args.output, values)
+    elif args.kind and args.value is not None:
+        options = {'title': args.title}
+        if args.kind == 'gauge':
+            call = lambda: render_gauge(args.value, args.output, options, label=args.label)
+        else:
+            call = lambda: render_card(args.value, args.output, options, delta=args.delta)
+    else:
+        parser.error("нужен --source или kind с --value")
+
+    started = time.perf_counter()
+    call()
+    first = time.perf_counter() - started
+    logger.info(f"✓ {args.output}: {os.path.getsize(args.output) / 1024:.1f} KB, первый рендер {first * 1000:.0f} мс")
+    if args.bench:
+        started = time.perf_counter()
+        for _ in range(args.bench):
+            call()
+        logger.info(f"  Повторный рендер (слои из кэша): {(time.perf_counter() - started) / args.bench * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
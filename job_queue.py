@@ -0,0 +1,330 @@
+"""
+Локальная очередь задач с арендой (lease) в SQLite
+Version: 1.0.0
+Заменяет pid lock-файл в /tmp: вместо "один парсер на машину" каждая задача
+(слот расписания + дата MSK) захватывается ровно одним воркером.
+- claim: атомарный захват в транзакции BEGIN IMMEDIATE (нет гонки check-then-create)
+- heartbeat: продлевает аренду, пока воркер жив; упавший воркер перестает продлевать,
+  и после lease_until задачу подхватывает другой
+- задача с неудачным запуском возвращается в очередь (до max_attempts)
+- not_after: задачу после окончания слота уже не публикуем
+Несколько воркеров на одном хосте (или на нескольких, если JOB_QUEUE_PATH на общем
+диске с корректными блокировками файлов) захватывают разные задачи параллельно
+
+Использование:
+    python job_queue.py list              # задачи за сегодня и их состояние
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', os.path.join(tempfile.gettempdir(), 'cmc_jobs.sqlite'))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+MSK = timezone(timedelta(hours=3))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    slot TEXT NOT NULL,
+    source TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_until REAL,
+    not_after REAL NOT NULL,
+    publish_at REAL,
+    created_ts REAL NOT NULL,
+    finished_ts REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, not_after);
+
+CREATE TABLE IF NOT EXISTS ready (
+    job_id TEXT PRIMARY KEY,
+    post TEXT NOT NULL,
+    captured_ts REAL NOT NULL
+);
+"""
+
+# Колонки, добавленные после первой версии схемы (ALTER TABLE для старых баз)
+MIGRATIONS = {
+    "publish_at": "ALTER TABLE jobs ADD COLUMN publish_at REAL"
+}
+
+
+def worker_id():
+    """Идентификатор воркера: хост + pid"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def connect(path=None):
+    """Открывает базу очереди (создает схему при первом обращении)"""
+    path = path or JOB_QUEUE_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # isolation_level=None: транзакции открываем явно (BEGIN IMMEDIATE)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+    for column, statement in MIGRATIONS.items():
+        if column not in columns:
+            conn.execute(statement)
+    return conn
+
+
+def slot_job(slot_name, source_key, time_range_msk, publish_at_msk=None, now=None):
+    """
+    Параметры задачи слота расписания
+
+    Returns:
+        dict: {"job_id", "slot", "source", "run_date", "not_after", "publish_at"}
+    """
+    now_msk = (now or datetime.now(timezone.utc)).astimezone(MSK)
+    run_date = now_msk.strftime('%Y-%m-%d')
+    day_start = now_msk.replace(hour=0, minute=0, second=0, microsecond=0)
+    not_after = (day_start + timedelta(hours=time_range_msk[1])).timestamp()
+    publish_at = (day_start + timedelta(hours=publish_at_msk)).timestamp() if publish_at_msk is not None else None
+    return {
+        "job_id": f"{run_date}:{slot_name}",
+        "slot": slot_name,
+        "source": source_key,
+        "run_date": run_date,
+        "not_after": not_after,
+        "publish_at": publish_at
+    }
+
+
+class Job:
+    """Захваченная задача"""
+
+    __slots__ = ('job_id', 'slot', 'source', 'run_date', 'attempts', 'publish_at')
+
+    def __init__(self, job_id, slot, source, run_date, attempts, publish_at=None):
+        self.job_id = job_id
+        self.slot = slot
+        self.source = source
+        self.run_date = run_date
+        self.attempts = attempts
+        self.publish_at = publish_at  # UTC timestamp точного времени публикации или None
+
+    def __repr__(self):
+        return f"Job({self.job_id!r}, source={self.source!r}, attempt={self.attempts})"
+
+
+class JobQueue:
+    """Очередь задач одного воркера (одно соединение на поток)"""
+
+    def __init__(self, path=None, owner=None, lease_seconds=None, max_attempts=None):
+        self.path = path or JOB_QUEUE_PATH
+        self.owner = owner or worker_id()
+        self.lease_seconds = lease_seconds or JOB_LEASE_SECONDS
+        self.max_attempts = max_attempts or JOB_MAX_ATTEMPTS
+        self.conn = connect(self.path)
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, job_id, slot, source, run_date, not_after, publish_at=None):
+        """
+        Добавляет задачу (повторное добавление того же job_id ничего не меняет:
+        источник случайного слота выбирает первый воркер)
+
+        Returns:
+            bool: True если задача новая
+        """
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO jobs (job_id, slot, source, run_date, not_after, publish_at, created_ts) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, slot, source, run_date, not_after, publish_at, time.time())
+        )
+        return cursor.rowcount > 0
+
+    def claim(self, job_id=None):
+        """
+        Захватывает свободную задачу (или конкретную job_id): новую
+        или с истекшей арендой (воркер упал)
+
+        Returns:
+            Job или None
+        """
+        now = time.time()
+        where = ("(status = 'pending' OR (status = 'leased' AND lease_until < ?)) "
+                 "AND not_after > ? AND attempts < ?")
+        params = [now, now, self.max_attempts]
+        if job_id:
+            where += " AND job_id = ?"
+            params.append(job_id)
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                f"SELECT job_id, slot, source, run_date, attempts, status, owner, publish_at FROM jobs "
+                f"WHERE {where} ORDER BY not_after LIMIT 1",
+                params
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            if row[5] == 'leased':
+                logger.warning(f"⚠️ Аренда {row[0]} истекла (воркер {row[6]}), задача перехвачена")
+            self.conn.execute(
+                "UPDATE jobs SET status = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE job_id = ?",
+                (self.owner, now + self.lease_seconds, row[0])
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return Job(row[0], row[1], row[2], row[3], row[4] + 1, row[7])
+
+    def heartbeat(self, job):
+        """
+        Продлевает аренду
+
+        Returns:
+            bool: False если аренда потеряна (истекла и задачу забрал другой воркер)
+        """
+        cursor = self.conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND owner = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, job.job_id, self.owner)
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, job, success, error=None):
+        """
+        Завершает задачу: done, либо обратно в очередь (failed после max_attempts)
+
+        Returns:
+            bool: False если аренда уже потеряна
+        """
+        if success:
+            status = 'done'
+        else:
+            status = 'failed' if job.attempts >= self.max_attempts else 'pending'
+        cursor = self.conn.execute(
+            "UPDATE jobs SET status = ?, lease_until = NULL, finished_ts = ?, error = ? "
+            "WHERE job_id = ? AND owner = ? AND status = 'leased'",
+            (status, time.time(), error, job.job_id, self.owner)
+        )
+        return cursor.rowcount > 0
+
+    # --- готовые к публикации посты (capture-ahead) ---
+
+    def put_ready(self, job, post, captured_ts=None):
+        """Сохраняет подготовленный пост задачи (скриншот + caption)"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ready (job_id, post, captured_ts) VALUES (?, ?, ?)",
+            (job.job_id, json.dumps(post, ensure_ascii=False), captured_ts or time.time())
+        )
+
+    def get_ready(self, job):
+        """
+        Подготовленный пост задачи (например от воркера, упавшего до публикации)
+
+        Returns:
+            tuple: (post, captured_ts) или (None, None)
+        """
+        row = self.conn.execute("SELECT post, captured_ts FROM ready WHERE job_id = ?", (job.job_id,)).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def drop_ready(self, job):
+        self.conn.execute("DELETE FROM ready WHERE job_id = ?", (job.job_id,))
+
+    def prune(self, keep_days=14):
+        """Удаляет задачи старше keep_days"""
+        cutoff = time.time() - keep_days * 86400
+        self.conn.execute("DELETE FROM ready WHERE captured_ts < ?", (cutoff,))
+        return self.conn.execute("DELETE FROM jobs WHERE not_after < ?", (cutoff,)).rowcount
+
+    def list_jobs(self, run_date=None):
+        query = ("SELECT job_id, source, status, attempts, owner, lease_until, error FROM jobs"
+                 + (" WHERE run_date = ?" if run_date else "") + " ORDER BY not_after")
+        return self.conn.execute(query, (run_date,) if run_date else ()).fetchall()
+
+
+class Lease:
+    """
+    Аренда задачи на время работы: фоновый поток продлевает ее каждые lease/3 сек
+    Перед публикацией проверяйте lease.lost - если аренду перехватили, публиковать нельзя
+    """
+
+    def __init__(self, queue, job):
+        self.queue_path = queue.path
+        self.owner = queue.owner
+        self.lease_seconds = queue.lease_seconds
+        self.job = job
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        # sqlite3-соединение нельзя делить между потоками - у потока свое
+        queue = JobQueue(self.queue_path, self.owner, self.lease_seconds)
+        try:
+            while not self._stop.wait(self.lease_seconds / 3):
+                try:
+                    if not queue.heartbeat(self.job):
+                        self.lost = True
+                        logger.error(f"✗ Аренда задачи {self.job.job_id} потеряна")
+                        return
+                except sqlite3.Error as e:
+                    logger.warning(f"⚠️ Heartbeat задачи {self.job.job_id}: {e}")
+        finally:
+            queue.close()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.job.job_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Очередь задач парсера")
+    parser.add_argument('--db', default=None, help=f'Путь к базе (по умолчанию {JOB_QUEUE_PATH})')
+    commands = parser.add_subparsers(dest='command', required=True)
+    listing = commands.add_parser('list', help='Задачи и их состояние')
+    listing.add_argument('--date', default=None, help='Дата MSK (YYYY-MM-DD), по умолчанию сегодня')
+    listing.add_argument('--all', action='store_true', help='За все дни')
+    args = parser.parse_args()
+
+    queue = JobQueue(args.db)
+    run_date = None if args.all else (args.date or datetime.now(MSK).strftime('%Y-%m-%d'))
+    rows = queue.list_jobs(run_date)
+    queue.close()
+    if not rows:
+        print("Задач нет")
+        sys.exit(1)
+    now = time.time()
+    for job_id, source, status, attempts, owner, lease_until, error in rows:
+        lease = f" аренда {lease_until - now:+.0f}s" if lease_until else ""
+        print(f"  {job_id:40} {source:22} {status:8} попыток {attempts} {owner or '-'}{lease}"
+              f"{f'  ({error})' if error else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Метрики и тайминги запуска парсера
+Version: 1.0.0
+Лёгкий span/timer API и структурированная запись одного запуска:
+- JSON lines (одна строка на запуск) для построения графиков по источникам
+- опционально Prometheus text format (textfile collector)
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import functools
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Настройки (через переменные окружения)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_JSONL_PATH = os.getenv('METRICS_JSONL_PATH', os.path.join('metrics', 'runs.jsonl'))
+METRICS_PROM_PATH = os.getenv('METRICS_PROM_PATH')  # Например: /var/lib/node_exporter/cmc_parser.prom
+
+PROM_PREFIX = "cmc_parser"
+
+
+class Span:
+    """Один замер длительности (span) внутри запуска"""
+
+    __slots__ = ('name', 'attrs', 'started', 'duration', 'status')
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = dict(attrs or {})
+        self.started = time.perf_counter()
+        self.duration = None
+        self.status = 'ok'
+
+    def set(self, **attrs):
+        """Добавляет атрибуты к span (bytes, attempt, и т.д.)"""
+        self.attrs.update(attrs)
+
+    def end(self, status=None):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.started
+        if status:
+            self.status = status
+        return self
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "duration_ms": round((self.duration or 0) * 1000, 1),
+            "status": self.status,
+            **({"attrs": self.attrs} if self.attrs else {})
+        }
+
+
+class _NullSpan:
+    """Заглушка когда запуск не начат или метрики отключены"""
+
+    def set(self, **attrs):
+        pass
+
+    def end(self, status=None):
+        return self
+
+
+class RunMetrics:
+    """Метрики одного запуска парсера"""
+
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.source = None
+        self.spans = []
+        self.counters = {}
+        self.values = {}
+
+    def start_span(self, name, **attrs):
+        span_obj = Span(name, attrs)
+        self.spans.append(span_obj)
+        return span_obj
+
+    @contextmanager
+    def span(self, name, **attrs):
+        span_obj = self.start_span(name, **attrs)
+        try:
+            yield span_obj
+        except BaseException:
+            span_obj.end('error')
+            raise
+        else:
+            span_obj.end()
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_value(self, name, value):
+        self.values[name] = value
+
+    def timings(self):
+        """Суммарная длительность по имени span (мс)"""
+        totals = {}
+        for span_obj in self.spans:
+            if span_obj.duration is None:
+                continue
+            totals[span_obj.name] = round(totals.get(span_obj.name, 0) + span_obj.duration * 1000, 1)
+        return totals
+
+    def to_record(self, status):
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at.isoformat(),
+            "source": self.source,
+            "status": status,
+            "duration_ms": round((time.perf_counter() - self._started) * 1000, 1),
+            "timings_ms": self.timings(),
+            "counters": self.counters,
+            "values": self.values,
+            "spans": [s.to_dict() for s in self.spans if s.duration is not None]
+        }
+
+
+_current_run = None
+
+
+def start_run():
+    """Начинает новый запуск (сбрасывает предыдущий)"""
+    global _current_run
+    _current_run = RunMetrics() if METRICS_ENABLED else None
+    return _current_run
+
+
+def current_run():
+    return _current_run
+
+
+def set_source(source_key):
+    if _current_run:
+        _current_run.source = source_key
+
+
+def start_span(name, **attrs):
+    """Начинает span вручную (нужно вызвать .end())"""
+    if not _current_run:
+        return _NullSpan()
+    return _current_run.start_span(name, **attrs)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Контекстный менеджер для замера блока кода"""
+    if not _current_run:
+        yield _NullSpan()
+        return
+    with _current_run.span(name, **attrs) as span_obj:
+        yield span_obj
+
+
+def incr(name, value=1):
+    if _current_run:
+        _current_run.incr(name, value)
+
+
+def set_value(name, value):
+    if _current_run:
+        _current_run.set_value(name, value)
+
+
+def timed(name):
+    """
+    Декоратор: замеряет функцию (sync или async) как span.
+    Пустой результат (None/False) помечается статусом 'fail'.
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                span_obj = start_span(name)
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException:
+                    span_obj.end('error')
+                    raise
+                span_obj.end('ok' if result else 'fail')
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            span_obj = start_span(name)
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                span_obj.end('error')
+                raise
+            span_obj.end('ok' if result else 'fail')
+            return result
+        return wrapper
+    return decorator
+
+
+def _prom_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(record):
+    """Рендерит запись запуска в Prometheus text format"""
+    source = _prom_escape(record.get('source') or 'none')
+    lines = [
+        f"# HELP {PROM_PREFIX}_run_success 1 если последний запуск успешен",
+        f"# TYPE {PROM_PREFIX}_run_success gauge",
+        f'{PROM_PREFIX}_run_success{{source="{source}"}} {1 if record["status"] == "success" else 0}',
+        f"# HELP {PROM_PREFIX}_run_duration_seconds Длительность последнего запуска",
+        f"# TYPE {PROM_PREFIX}_run_duration_seconds gauge",
+        f'{PROM_PREFIX}_run_duration_seconds{{source="{source}"}} {record["duration_ms"] / 1000:.3f}',
+        f"# HELP {PROM_PREFIX}_run_timestamp_seconds Время начала последнего запуска",
+        f"# TYPE {PROM_PREFIX}_run_timestamp_seconds gauge",
+        f'{PROM_PREFIX}_run_timestamp_seconds{{source="{source}"}} '
+        f'{datetime.fromisoformat(record["started_at"]).timestamp():.0f}',
+        f"# HELP {PROM_PREFIX}_span_duration_seconds Суммарная длительность этапа в последнем запуске",
+        f"# TYPE {PROM_PREFIX}_span_duration_seconds gauge",
+    ]
+    for name, ms in sorted(record["timings_ms"].items()):
+        lines.append(f'{PROM_PREFIX}_span_duration_seconds{{source="{source}",span="{_prom_escape(name)}"}} {ms / 1000:.3f}')
+
+    lines.append(f"# HELP {PROM_PREFIX}_counter Счетчики последнего запуска (retries, bytes, ...)")
+    lines.append(f"# TYPE {PROM_PREFIX}_counter gauge")
+    for name, value in sorted(record["counters"].items()):
+        lines.append(f'{PROM_PREFIX}_counter{{source="{source}",name="{_prom_escape(name)}"}} {value}')
+
+    return "\n".join(lines) + "\n"
+
+
+def _write_record(record):
+    directory = os.path.dirname(METRICS_JSONL_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(METRICS_JSONL_PATH, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+
+    if METRICS_PROM_PATH:
+        # textfile collector требует атомарной замены файла
+        tmp_path = f"{METRICS_PROM_PATH}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(render_prometheus(record))
+        os.replace(tmp_path, METRICS_PROM_PATH)
+
+
+def finish_run(status):
+    """
+    Завершает запуск и записывает структурированную запись
+
+    Args:
+        status: 'success', 'failed' или 'skipped'
+
+    Returns:
+        dict: Запись запуска или None если метрики отключены
+    """
+    global _current_run
+    run = _current_run
+    if not run:
+        return None
+    _current_run = None
+
+    record = run.to_record(status)
+    try:
+        _write_record(record)
+        timings = ", ".join(f"{k}={v / 1000:.1f}s" for k, v in record["timings_ms"].items())
+        logger.info(f"📊 Метрики запуска записаны: {record['duration_ms'] / 1000:.1f}s ({timings})")
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось записать метрики: {e}")
+    return record
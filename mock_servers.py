@@ -0,0 +1,530 @@
+"""
+Локальные заглушки OpenAI и Telegram Bot API для нагрузочных тестов без ключей
+Version: 1.0.0
+Эндпоинты:
+- POST /v1/chat/completions           - Alpha Take (json_schema или текстовый формат)
+- GET|POST /bot<token>/getMe
+- POST /bot<token>/sendPhoto          - multipart, как отправляет requests
+- POST /bot<token>/sendMediaGroup
+- POST /bot<token>/editMessageCaption
+- GET /_stats                         - счетчики запросов
+Инъекция задержек, ошибок 5xx и 429 (с retry_after) - через MockConfig / аргументы CLI
+
+Использование:
+    python mock_servers.py serve --port 8081 --latency-ms 300 --rate-limit-rate 0.1
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 OPENAI_BASE_URL=http://127.0.0.1:8081/v1 python screenshot_parser.py
+
+    python mock_servers.py loadtest --sources 7 --chats 5 --concurrency 8 --error-rate 0.05
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+MOCK_BOT_USERNAME = "cmc_mock_bot"
+
+# Ответ в формате ALPHA_TAKE_SCHEMA (openai_integration.py)
+MOCK_ALPHA_TAKE = {
+    "indicator_line": "Fear & Greed Index at 42 (Fear)",
+    "alpha_take": "Fear is easing but buyers are still cautious, so prices will likely move sideways this week until volume returns.",
+    "context_tag": "Moderate neutral",
+    "hashtags": ["#FearAndGreed", "#Sideways", "#Crypto"]
+}
+
+
+class MockConfig:
+    """Параметры инъекции сбоев"""
+
+    __slots__ = ('latency_ms', 'jitter_ms', 'error_rate', 'rate_limit_rate', 'retry_after', 'seed')
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+
+
+class MockStats:
+    """Потокобезопасные счетчики запросов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.statuses = {}
+        self.photos_by_chat = {}
+        self.bytes_received = 0
+
+    def record(self, endpoint, status, size=0, chat_id=None, photos=0):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            self.bytes_received += size
+            if chat_id is not None and photos:
+                self.photos_by_chat[chat_id] = self.photos_by_chat.get(chat_id, 0) + photos
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "statuses": dict(self.statuses),
+                "photos_by_chat": dict(self.photos_by_chat),
+                "bytes_received": self.bytes_received
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Обработчик запросов (config, stats, rng - у сервера)"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("mock: " + format % args)
+
+    # --- ответы ---
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _parse_form(self, body):
+        """Поля и файлы запроса: multipart, json или urlencoded -> (fields, {name: size})"""
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body
+            )
+            fields, files = {}, {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                payload = part.get_payload(decode=True) or b''
+                if part.get_filename():
+                    files[name] = len(payload)
+                else:
+                    fields[name] = payload.decode('utf-8', errors='replace')
+            return fields, files
+        if 'json' in content_type:
+            return (json.loads(body) if body else {}), {}
+        return {k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()}, {}
+
+    def _inject(self, api):
+        """Задержка и сбои; код ответа если ошибка уже отправлена, иначе None"""
+        config = self.server.config
+        with self.server.rng_lock:
+            jitter = self.server.rng.uniform(0, config.jitter_ms)
+            roll = self.server.rng.random()
+        delay = (config.latency_ms + jitter) / 1000
+        if delay:
+            time.sleep(delay)
+
+        if roll < config.rate_limit_rate:
+            if api == 'telegram':
+                payload = {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {config.retry_after}",
+                    "parameters": {"retry_after": config.retry_after}
+                }
+            else:
+                payload = {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}}
+            self._send_json(429, payload, {'Retry-After': config.retry_after})
+            return 429
+        if roll < config.rate_limit_rate + config.error_rate:
+            if api == 'telegram':
+                payload = {"ok": False, "error_code": 500, "description": "Internal Server Error (mock)"}
+            else:
+                payload = {"error": {"message": "The server had an error (mock)", "type": "server_error"}}
+            self._send_json(500, payload)
+            return 500
+        return None
+
+    # --- маршрутизация ---
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/_stats':
+            self._send_json(200, self.server.stats.snapshot())
+            return
+        self._route(path, b'')
+
+    def do_POST(self):
+        self._route(urlparse(self.path).path, self._read_body())
+
+    def _route(self, path, body):
+        if path.endswith('/chat/completions'):
+            self._chat_completions(body)
+            return
+
+        parts = path.strip('/').split('/')
+        if len(parts) == 2 and parts[0].startswith('bot'):
+            method = parts[1]
+            handler = {
+                'getMe': self._get_me,
+                'sendPhoto': self._send_photo,
+                'sendMediaGroup': self._send_media_group,
+                'editMessageCaption': self._edit_caption
+            }.get(method)
+            if handler:
+                handler(body)
+                return
+            self.server.stats.record(method, 404)
+            self._send_json(404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"})
+            return
+
+        self._send_json(404, {"error": {"message": f"Unknown path {path}"}})
+
+    # --- OpenAI ---
+
+    def _chat_completions(self, body):
+        failed = self._inject('openai')
+        if failed:
+            self.server.stats.record('chat.completions', failed, len(body))
+            return
+
+        request = json.loads(body or b'{}')
+        response_format = request.get('response_format') or {}
+        if response_format.get('type') == 'json_schema':
+            content = json.dumps(MOCK_ALPHA_TAKE)
+        else:
+            content = "\n".join([
+                f"INDICATOR_LINE: {MOCK_ALPHA_TAKE['indicator_line']}",
+                f"ALPHA_TAKE: {MOCK_ALPHA_TAKE['alpha_take']}",
+                f"CONTEXT_TAG: {MOCK_ALPHA_TAKE['context_tag']}",
+                f"HASHTAGS: {' '.join(MOCK_ALPHA_TAKE['hashtags'])}"
+            ])
+
+        # Грубая оценка токенов: ~4 символа на токен, изображение не считаем
+        prompt_chars = sum(
+            len(part.get('text', '')) if isinstance(part, dict) else len(str(part))
+            for message in request.get('messages', [])
+            for part in (message.get('content') if isinstance(message.get('content'), list) else [message.get('content') or ''])
+        )
+        prompt_tokens = prompt_chars // 4
+        completion_tokens = len(content) // 4
+
+        self.server.stats.record('chat.completions', 200, len(body))
+        self._send_json(200, {
+            "id": f"chatcmpl-mock{self.server.next_id()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'mock'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": 0}
+            }
+        })
+
+    # --- Telegram ---
+
+    def _get_me(self, body):
+        failed = self._inject('telegram')
+        if failed:
+            self.server.stats.record('getMe', failed)
+            return
+        self.server.stats.record('getMe', 200)
+        self._send_json(200, {"ok": True, "result": {
+            "id": 1000001, "is_bot": True, "first_name": "CMC Mock", "username": MOCK_BOT_USERNAME
+        }})
+
+    def _message(self, chat_id, caption=None):
+        message = {
+            "message_id": self.server.next_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "channel"},
+            "photo": [{"file_id": f"mock-photo-{self.server.next_id()}", "width": 1280, "height": 720}]
+        }
+        if caption:
+            message["caption"] = caption
+        return message
+
+    def _send_photo(self, body):
+        failed = self._inject('telegram')
+        if failed:
+            self.server.stats.record('sendPhoto', failed, len(body))
+            return
+        fields, files = self._parse_form(body)
+        chat_id = fields.get('chat_id')
+        if not chat_id or 'photo' not in files and 'photo' not in fields:
+            self.server.stats.record('sendPhoto', 400, len(body))
+            self._send_json(400, {"ok": False, "error_code": 400, "description": "Bad Request: chat_id and photo are required"})
+            return
+        self.server.stats.record('sendPhoto', 200, len(body), chat_id, 1)
+        self._send_json(200, {"ok": True, "result": self._message(chat_id, fields.get('caption'))})
+
+    def _send_media_group(self, body):
+        failed = self._inject('telegram')
+        if failed:
+            self.server.stats.record('sendMediaGroup', failed, len(body))
+            return
+        fields, files = self._parse_form(body)
+        chat_id = fields.get('chat_id')
+        try:
+            media = fields.get('media')
+            media = json.loads(media) if isinstance(media, str) else (media or [])
+        except ValueError:
+            media = []
+        # Альбом: от 2 до 10 элементов, attach://name должен ссылаться на загруженный файл
+        missing = [item.get('media') for item in media
+                   if str(item.get('media', '')).startswith('attach://') and item['media'][len('attach://'):] not in files]
+        if not chat_id or not 2 <= len(media) <= 10 or missing:
+            self.server.stats.record('sendMediaGroup', 400, len(body))
+            self._send_json(400, {"ok": False, "error_code": 400, "description": "Bad Request: invalid media group"})
+            return
+        self.server.stats.record('sendMediaGroup', 200, len(body), chat_id, len(media))
+        self._send_json(200, {"ok": True, "result": [self._message(chat_id, item.get('caption')) for item in media]})
+
+    def _edit_caption(self, body):
+        failed = self._inject('telegram')
+        if failed:
+            self.server.stats.record('editMessageCaption', failed, len(body))
+            return
+        fields, _ = self._parse_form(body)
+        chat_id = fields.get('chat_id')
+        if not chat_id or not str(fields.get('message_id', '')).isdigit():
+            self.server.stats.record('editMessageCaption', 400, len(body))
+            self._send_json(400, {"ok": False, "error_code": 400, "description": "Bad Request: message to edit not found"})
+            return
+        self.server.stats.record('editMessageCaption', 200, len(body), chat_id)
+        message = self._message(chat_id, fields.get('caption'))
+        message["message_id"] = int(fields['message_id'])
+        self._send_json(200, {"ok": True, "result": message})
+
+
+class MockServer:
+    """OpenAI + Telegram заглушка в фоновом потоке"""
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or MockConfig()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = self.config
+        self.httpd.stats = MockStats()
+        self.httpd.rng = random.Random(self.config.seed)
+        self.httpd.rng_lock = threading.Lock()
+        counter = iter(range(1, sys.maxsize))
+        id_lock = threading.Lock()
+
+        def next_id():
+            with id_lock:
+                return next(counter)
+        self.httpd.next_id = next_id
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def telegram_api_base(self):
+        return self.base_url
+
+    @property
+    def openai_base_url(self):
+        return f"{self.base_url}/v1"
+
+    @property
+    def stats(self):
+        return self.httpd.stats
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='mock-servers', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _make_test_image(directory):
+    """Тестовый JPEG похожего на скриншот размера"""
+    from PIL import Image
+    path = os.path.join(directory, "loadtest.jpg")
+    pixels = os.urandom(1280 * 720 * 3)
+    Image.frombytes('RGB', (1280, 720), pixels).save(path, 'JPEG', quality=85)
+    return path
+
+
+def run_load_test(sources=7, chats=3, concurrency=8, config=None, with_ai=True):
+    """
+    Прогоняет путь публикации (Alpha Take + sendPhoto) против заглушки.
+    Alpha Take - через get_ai_comment_async, как в publish_post: дедлайн, лимит
+    конкурентности AI_MAX_CONCURRENCY и hedging работают так же, как в бою
+
+    Args:
+        sources: Сколько источников публиковать
+        chats: В сколько чатов публиковать каждый источник
+        concurrency: Параллельных публикаций
+        config: MockConfig (задержки и сбои)
+        with_ai: Запрашивать Alpha Take перед отправкой
+
+    Returns:
+        dict: Сводка (успехи, пропускная способность, латентность, статистика сервера)
+    """
+    import metrics
+    import openai_integration
+    import screenshot_parser
+    from openai_integration import SOURCE_PROMPTS
+
+    source_keys = [list(SOURCE_PROMPTS)[i % len(SOURCE_PROMPTS)] for i in range(sources)]
+    chat_ids = [f"-100{1000 + i}" for i in range(chats)]
+    jobs = [(source_key, chat_id) for source_key in source_keys for chat_id in chat_ids]
+
+    with MockServer(config) as server, tempfile.TemporaryDirectory() as tmp:
+        screenshot_parser.TELEGRAM_API_BASE = server.telegram_api_base
+        screenshot_parser.TELEGRAM_BOT_TOKEN = 'mock-token'
+        screenshot_parser.TELEGRAM_CHAT_ID = chat_ids[0]
+        openai_integration.init_clients(api_key='mock-key', base_url=server.openai_base_url)
+
+        image_path = _make_test_image(tmp)
+        metrics.start_run()
+        credentials_ok = screenshot_parser.validate_telegram_credentials()
+
+        async def publish(job, limit):
+            source_key, chat_id = job
+            async with limit:
+                started = time.perf_counter()
+                ai_result = await openai_integration.get_ai_comment_async(source_key, image_path) if with_ai else None
+                caption = openai_integration.add_alpha_take_to_caption(source_key, "#Crypto", ai_result)
+                sent = await asyncio.to_thread(screenshot_parser.send_telegram_photo, image_path, caption, chat_id=chat_id)
+                return bool(sent), ai_result is not None, time.perf_counter() - started
+
+        async def publish_all():
+            limit = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(publish(job, limit) for job in jobs))
+
+        wall_started = time.perf_counter()
+        results = asyncio.run(publish_all())
+        wall = time.perf_counter() - wall_started
+
+        latencies = [elapsed for _, _, elapsed in results]
+        sent = sum(1 for ok, _, _ in results if ok)
+        return {
+            "jobs": len(jobs),
+            "sent": sent,
+            "failed": len(jobs) - sent,
+            "with_alpha_take": sum(1 for _, ai, _ in results if ai),
+            "credentials_ok": credentials_ok,
+            "wall_seconds": round(wall, 3),
+            "throughput_per_second": round(len(jobs) / wall, 2) if wall else None,
+            "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000, 1),
+            "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+            "telegram_retries": metrics.current_run().counters.get('telegram_retries', 0),
+            "ai_timeouts": metrics.current_run().counters.get('ai_timeouts', 0),
+            "ai_hedged": metrics.current_run().counters.get('ai_hedged', 0),
+            "server": server.stats.snapshot()
+        }
+
+
+def _add_fault_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=0, help='Задержка ответа')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Случайная добавка к задержке')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Доля ответов 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after в ответах 429 (сек)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed для воспроизводимых сбоев')
+
+
+def _config_from_args(args):
+    return MockConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушки OpenAI и Telegram Bot API")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='Запустить заглушку')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8081)
+    _add_fault_arguments(serve)
+
+    load = commands.add_parser('loadtest', help='Нагрузочный тест пути публикации')
+    load.add_argument('--sources', type=int, default=7)
+    load.add_argument('--chats', type=int, default=3)
+    load.add_argument('--concurrency', type=int, default=8)
+    load.add_argument('--no-ai', action='store_true', help='Без запроса Alpha Take')
+    load.add_argument('--verbose', action='store_true', help='Логи парсера (по умолчанию только предупреждения)')
+    _add_fault_arguments(load)
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        server = MockServer(_config_from_args(args), args.host, args.port)
+        print(f"🧪 Mock OpenAI + Telegram: {server.base_url}")
+        print(f"   TELEGRAM_API_BASE={server.telegram_api_base}")
+        print(f"   OPENAI_BASE_URL={server.openai_base_url}")
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print(json.dumps(server.stats.snapshot(), indent=2, ensure_ascii=False))
+            server.httpd.server_close()
+        return
+
+    import screenshot_parser  # Настраивает logging при импорте - уровень меняем после
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    summary = run_load_test(args.sources, args.chats, args.concurrency, _config_from_args(args), not args.no_ai)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    sys.exit(0 if summary['failed'] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
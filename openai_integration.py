@@ -5,137 +5,174 @@ Version: 1.0.0
 """
 
 import os
+import re
+import json
+import math
+import asyncio
 import logging
 import base64
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import metrics
 
 logger = logging.getLogger(__name__)
 
 # OpenAI API Key
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 
+AI_MODEL = "gpt-4o-mini"
+
+# Таймауты и конкурентность
+AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', '20'))  # Один HTTP запрос
+AI_DEADLINE = float(os.getenv('AI_DEADLINE', '30'))                # Весь Alpha Take (async)
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '3'))      # Параллельных запросов
+AI_HEDGE_AFTER = float(os.getenv('AI_HEDGE_AFTER', '0'))            # Дублирующий запрос (0 - выкл)
+
+# Базовый URL API (None - api.openai.com; для локального mock_servers.py - http://127.0.0.1:8081/v1)
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or None
+
 # Инициализация клиента
 client = None
-if OPENAI_API_KEY:
+async_client = None
+
+
+def init_clients(api_key=None, base_url=None):
+    """
+    Создает sync и async клиентов OpenAI (при импорте - из переменных окружения)
+    
+    Returns:
+        bool: True если клиенты созданы
+    """
+    global client, async_client
+    api_key = api_key or OPENAI_API_KEY
+    base_url = base_url or OPENAI_BASE_URL
+    client = None
+    async_client = None
+    
+    if not api_key:
+        logger.warning("⚠️ OPENAI_API_KEY not found - AI comments disabled")
+        return False
+    
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        logger.info("✓ OpenAI client initialized")
+        client = OpenAI(api_key=api_key, base_url=base_url, timeout=AI_REQUEST_TIMEOUT, max_retries=1)
+        async_client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=AI_REQUEST_TIMEOUT, max_retries=1)
+        logger.info(f"✓ OpenAI client initialized{f' ({base_url})' if base_url else ''}")
+        return True
     except Exception as e:
         logger.error(f"✗ Failed to initialize OpenAI client: {e}")
         client = None
-else:
-    logger.warning("⚠️ OPENAI_API_KEY not found - AI comments disabled")
+        async_client = None
+        return False
+
+
+init_clients()
+
+
+# Формат ответа: json - structured output по ALPHA_TAKE_SCHEMA (проверяется локально),
+# text - старый формат строк KEY: value (для моделей без json_schema)
+AI_OUTPUT_MODE = os.getenv('AI_OUTPUT_MODE', 'json').lower()
+AI_SCHEMA_RETRIES = int(os.getenv('AI_SCHEMA_RETRIES', '1'))
+
+# Поля Alpha Take: (лимит символов, описание для модели)
+ALPHA_TAKE_FIELDS = {
+    "indicator_line": (70, "Indicator value line in the format given for the source"),
+    "alpha_take": (220, "One clear sentence in simple language: where prices are likely headed and why"),
+    "context_tag": (24, "[Strength] [Sentiment]. Strength: Low/Medium/High/Moderate/Strong, Sentiment: Neutral/Negative/Positive/Critical/Hype"),
+    "hashtags": (50, "3 relevant hashtags, each starting with #")
+}
+
+# Консервативная оценка для английского текста (tiktoken дает ~4 символа на токен)
+CHARS_PER_TOKEN = 3.5
+# Ключи, кавычки, скобки JSON на одно поле
+JSON_TOKENS_PER_FIELD = 8
+# Допуск сверх лимита символов при проверке ответа
+FIELD_LIMIT_TOLERANCE = 1.25
 
 
-# Промпты для разных типов источников - Alpha Take + Context Tag + AI Hashtags
+def _build_schema(fields):
+    properties = {}
+    for name, (limit, description) in fields.items():
+        if name == 'hashtags':
+            properties[name] = {"type": "array", "items": {"type": "string"}, "description": description}
+        else:
+            properties[name] = {"type": "string", "description": f"{description} (max {limit} characters)"}
+    # strict режим: все поля обязательны, лишние запрещены (maxLength strict не поддерживает -
+    # лимиты передаются в описаниях и через max_tokens, проверяются в validate_alpha_take)
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(fields),
+        "additionalProperties": False
+    }
+
+
+ALPHA_TAKE_SCHEMA = _build_schema(ALPHA_TAKE_FIELDS)
+
+
+def schema_max_tokens(fields=ALPHA_TAKE_FIELDS):
+    """max_tokens из лимитов схемы: текст всех полей + JSON разметка"""
+    text_tokens = sum(limit for limit, _ in fields.values()) / CHARS_PER_TOKEN
+    return math.ceil(text_tokens) + JSON_TOKENS_PER_FIELD * (len(fields) + 1)
+
+
+AI_MAX_TOKENS = schema_max_tokens()
+
+# Старый текстовый формат (AI_OUTPUT_MODE=text) - собирается из тех же описаний полей
+TEXT_OUTPUT_FORMAT = "OUTPUT FORMAT (exactly these lines):\n" + "\n".join(
+    f"{name.upper()}: {description}" for name, (_, description) in ALPHA_TAKE_FIELDS.items()
+)
+
+
+class AlphaTakeFormatError(ValueError):
+    """Ответ модели не соответствует схеме Alpha Take"""
+
+
+# Общий статический префикс (system) - одинаковый для всех источников и запусков,
+# поэтому идет первым: OpenAI кэширует совпадающий префикс промпта.
+# Все что зависит от источника - после него, скриншот - в самом конце
+SYSTEM_PROMPT = """You are a crypto market analyst. You get a screenshot of one market indicator and write a short Alpha Take for a Telegram post.
+Rules:
+- Read the value from the screenshot; never invent numbers that are not visible.
+- alpha_take answers the question given for the indicator in one clear sentence: direction (up/down/sideways), timeframe and the reason.
+- Use simple language, no financial-advice disclaimers, no emojis.
+- Follow the indicator_line template exactly, replacing the [placeholders]."""
+
+# Промпты для разных типов источников - только то, что отличается: вопрос,
+# шаблон indicator_line и короткий пример (описание полей ответа передается схемой)
 SOURCE_PROMPTS = {
-    "fear_greed": """You are a crypto market analyst. Analyze the Fear & Greed Index and explain what it means for prices.
-
-OUTPUT FORMAT:
-INDICATOR_LINE: Fear & Greed Index at [X] ([label])
-ALPHA_TAKE: One clear sentence explaining: Will prices likely go UP, DOWN, or SIDEWAYS in the coming days/weeks and WHY. Use simple language. Be specific.
-CONTEXT_TAG: [Strength] [Sentiment] (Strength: Low/Medium/High/Moderate/Strong, Sentiment: Neutral/Negative/Positive/Critical/Hype)
-HASHTAGS: 3 relevant hashtags
-
-Example:
-INDICATOR_LINE: Fear & Greed Index at 26 (Extreme Fear)
-ALPHA_TAKE: Extreme fear usually means prices are near bottom and likely to bounce up in 1-2 weeks as scared sellers finish selling and buyers see opportunity.
-CONTEXT_TAG: Strong negative
-HASHTAGS: #ExtremeFear #BuyOpportunity #BottomSignal
-""",
-    
-    "altcoin_season": """You are a crypto market analyst. Analyze the Altcoin Season Index and explain what it means for prices.
-
-OUTPUT FORMAT:
-INDICATOR_LINE: Altcoin Season Index at [X]
-ALPHA_TAKE: One clear sentence: Are altcoins likely to rise or fall vs Bitcoin, and why. Use simple language.
-CONTEXT_TAG: [Strength] [Sentiment]
-HASHTAGS: 3 relevant hashtags
-
-Example:
-INDICATOR_LINE: Altcoin Season Index at 32 (Bitcoin Season)
-ALPHA_TAKE: Bitcoin is sucking up all the money right now, so altcoins will likely keep falling or stay flat until Bitcoin stabilizes or crashes.
-CONTEXT_TAG: Moderate negative
-HASHTAGS: #BitcoinSeason #AltcoinWeakness #BTCDominance
-""",
-    
-    "btc_dominance": """You are a crypto market analyst. Analyze Bitcoin Dominance and explain what it means for prices.
-
-OUTPUT FORMAT:
-INDICATOR_LINE: Bitcoin Dominance at [X]%
-ALPHA_TAKE: One clear sentence: Will altcoins rise or fall relative to Bitcoin, and why. Simple language.
-CONTEXT_TAG: [Strength] [Sentiment]
-HASHTAGS: 3 relevant hashtags
-
-Example:
-INDICATOR_LINE: Bitcoin Dominance at 58%
-ALPHA_TAKE: High dominance means investors prefer Bitcoin safety over risky altcoins, so altcoin prices will likely stay weak until dominance drops.
-CONTEXT_TAG: Moderate negative
-HASHTAGS: #HighDominance #AltcoinPressure #SafetyFirst
-""",
-    
-    "eth_etf": """You are a crypto market analyst. Analyze Ethereum ETF flows and explain what it means for ETH price.
-
-OUTPUT FORMAT:
-INDICATOR_LINE: ETH ETF net [inflow/outflow]: $[X]M
-ALPHA_TAKE: One clear sentence: Will ETH price go up or down based on these flows, and why. Simple language.
-CONTEXT_TAG: [Strength] [Sentiment]
-HASHTAGS: 3 relevant hashtags
-
-Example:
-INDICATOR_LINE: ETH ETF net outflow: -$75M
-ALPHA_TAKE: Big money is pulling out of ETH, which usually means price will drop or stay weak for the next week until selling pressure eases.
-CONTEXT_TAG: Strong negative
-HASHTAGS: #ETHOutflows #SellPressure #Bearish
-""",
-    
-    "btc_etf": """You are a crypto market analyst. Analyze Bitcoin ETF flows and explain what it means for BTC price.
-
-OUTPUT FORMAT:
-INDICATOR_LINE: BTC ETF net [inflow/outflow]: $[X]M
-ALPHA_TAKE: One clear sentence: Will BTC price go up or down based on these flows, and why. Simple language.
-CONTEXT_TAG: [Strength] [Sentiment]
-HASHTAGS: 3 relevant hashtags
-
-Example:
-INDICATOR_LINE: BTC ETF net inflow: +$120M
-ALPHA_TAKE: Big institutions are buying Bitcoin through ETFs, which usually pushes price higher over the next 1-2 weeks as demand exceeds selling.
-CONTEXT_TAG: Strong positive
-HASHTAGS: #BTCInflows #InstitutionalBuying #Bullish
-""",
-    
-    "top_gainers": """You are a crypto market analyst. Analyze Top Gainers and explain what it means for the market.
-
-OUTPUT FORMAT:
-INDICATOR_LINE: Top gainers led by [sector/theme]: [token examples]
-ALPHA_TAKE: One clear sentence: What does this rally tell us about where prices are headed, and why. Simple language.
-CONTEXT_TAG: [Strength] [Sentiment]
-HASHTAGS: 3 relevant hashtags
-
-Example:
-INDICATOR_LINE: Top gainers led by AI tokens: FET, AGIX, RNDR
-ALPHA_TAKE: AI tokens pumping hard means speculative money is flowing into risky coins, which usually signals short-term gains but often leads to sharp drops within days.
-CONTEXT_TAG: Moderate hype
-HASHTAGS: #AITokens #SpeculativeRally #QuickGains
-""",
-    
-    "heatmap": """You are a crypto market analyst. Analyze the market heatmap and explain what it means for overall crypto prices.
-
-OUTPUT FORMAT:
-INDICATOR_LINE: Market breadth: [narrow/wide], [concentrated/diversified]
-ALPHA_TAKE: One clear sentence: Are most coins rising or falling, and what does this mean for prices this week. Simple language.
-CONTEXT_TAG: [Strength] [Sentiment]
-HASHTAGS: 3 relevant hashtags
-
-Example:
-INDICATOR_LINE: Market breadth: narrow, concentrated in BTC
-ALPHA_TAKE: Only Bitcoin is green while most altcoins are red, which means overall crypto prices will likely stay weak until money spreads to other coins.
-CONTEXT_TAG: Moderate negative
-HASHTAGS: #NarrowMarket #AltcoinWeakness #BTCOnly
-"""
+    "fear_greed": """Indicator: Fear & Greed Index. Question: will prices likely go UP, DOWN or SIDEWAYS in the coming days/weeks and why. Be specific.
+indicator_line: Fear & Greed Index at [X] ([label])
+Example: {"indicator_line": "Fear & Greed Index at 26 (Extreme Fear)", "alpha_take": "Extreme fear usually marks a near-bottom, so prices are likely to bounce in 1-2 weeks as scared sellers run out.", "context_tag": "Strong negative", "hashtags": ["#ExtremeFear", "#BuyOpportunity", "#BottomSignal"]}""",
+    
+    "altcoin_season": """Indicator: Altcoin Season Index. Question: are altcoins likely to rise or fall vs Bitcoin, and why.
+indicator_line: Altcoin Season Index at [X]
+Example: {"indicator_line": "Altcoin Season Index at 32 (Bitcoin Season)", "alpha_take": "Bitcoin is absorbing the money, so altcoins will likely stay flat or weak until Bitcoin stabilizes.", "context_tag": "Moderate negative", "hashtags": ["#BitcoinSeason", "#AltcoinWeakness", "#BTCDominance"]}""",
+    
+    "btc_dominance": """Indicator: Bitcoin Dominance. Question: will altcoins rise or fall relative to Bitcoin, and why.
+indicator_line: Bitcoin Dominance at [X]%
+Example: {"indicator_line": "Bitcoin Dominance at 58%", "alpha_take": "Investors prefer Bitcoin safety over risky altcoins, so altcoins will likely stay weak until dominance drops.", "context_tag": "Moderate negative", "hashtags": ["#HighDominance", "#AltcoinPressure", "#SafetyFirst"]}""",
+    
+    "eth_etf": """Indicator: Ethereum ETF flows. Question: will ETH price go up or down based on these flows, and why.
+indicator_line: ETH ETF net [inflow/outflow]: $[X]M
+Example: {"indicator_line": "ETH ETF net outflow: -$75M", "alpha_take": "Big money is pulling out of ETH, so price will likely stay weak next week until selling pressure eases.", "context_tag": "Strong negative", "hashtags": ["#ETHOutflows", "#SellPressure", "#Bearish"]}""",
+    
+    "btc_etf": """Indicator: Bitcoin ETF flows. Question: will BTC price go up or down based on these flows, and why.
+indicator_line: BTC ETF net [inflow/outflow]: $[X]M
+Example: {"indicator_line": "BTC ETF net inflow: +$120M", "alpha_take": "Institutions are buying through ETFs, which usually pushes price higher over 1-2 weeks as demand exceeds selling.", "context_tag": "Strong positive", "hashtags": ["#BTCInflows", "#InstitutionalBuying", "#Bullish"]}""",
+    
+    "top_gainers": """Indicator: Top Gainers. Question: what does this rally tell us about where prices are headed, and why.
+indicator_line: Top gainers led by [sector/theme]: [token examples]
+Example: {"indicator_line": "Top gainers led by AI tokens: FET, AGIX, RNDR", "alpha_take": "Speculative money is chasing AI tokens, which brings short-term gains but often sharp drops within days.", "context_tag": "Moderate hype", "hashtags": ["#AITokens", "#SpeculativeRally", "#QuickGains"]}""",
+    
+    "heatmap": """Indicator: market heatmap. Question: are most coins rising or falling, and what does this mean for prices this week.
+indicator_line: Market breadth: [narrow/wide], [concentrated/diversified]
+Example: {"indicator_line": "Market breadth: narrow, concentrated in BTC", "alpha_take": "Only Bitcoin is green while most altcoins are red, so prices will likely stay weak until money spreads out.", "context_tag": "Moderate negative", "hashtags": ["#NarrowMarket", "#AltcoinWeakness", "#BTCOnly"]}"""
 }
 
 
+_ai_semaphore = None
+_ai_semaphore_loop = None
+
+
 def encode_image_to_base64(image_path):
     """Конвертирует изображение в base64 для OpenAI API"""
     try:
@@ -146,6 +183,225 @@ def encode_image_to_base64(image_path):
         return None
 
 
+def source_prompt(source_key):
+    """
+    Промпт источника для текущего AI_OUTPUT_MODE (None если не настроен)
+
+    Пример в SOURCE_PROMPTS записан JSON-ом; в режиме text он переводится в строки
+    KEY: value - иначе пример противоречит TEXT_OUTPUT_FORMAT и модель отвечает JSON-ом
+    """
+    prompt = SOURCE_PROMPTS.get(source_key)
+    if not prompt or AI_OUTPUT_MODE == 'json':
+        return prompt
+    head, separator, example = prompt.partition("\nExample: ")
+    if not separator:
+        return prompt
+    lines = []
+    for name, value in json.loads(example).items():
+        lines.append(f"{name.upper()}: {' '.join(value) if isinstance(value, list) else value}")
+    return head + "\nExample:\n" + "\n".join(lines)
+
+
+def system_prompt():
+    """Статический префикс для текущего AI_OUTPUT_MODE"""
+    if AI_OUTPUT_MODE == 'json':
+        return SYSTEM_PROMPT
+    return f"{SYSTEM_PROMPT}\n\n{TEXT_OUTPUT_FORMAT}"
+
+
+def build_messages(prompt, base64_image):
+    """Сообщения chat.completions: общий system префикс -> промпт источника -> скриншот"""
+    return [
+        {
+            "role": "system",
+            "content": system_prompt()
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{base64_image}"
+                    }
+                }
+            ]
+        }
+    ]
+
+
+def _prepare_request(source_key, image_path):
+    """Промпт + base64 изображения или None если запрос невозможен"""
+    # Получаем промпт для этого источника
+    prompt = source_prompt(source_key)
+    if not prompt:
+        logger.warning(f"No prompt configured for source: {source_key}")
+        return None
+    
+    # Кодируем изображение в base64
+    base64_image = encode_image_to_base64(image_path)
+    if not base64_image:
+        return None
+    
+    return build_messages(prompt, base64_image)
+
+
+def _completion_kwargs(messages):
+    """Параметры chat.completions.create для текущего AI_OUTPUT_MODE"""
+    kwargs = {
+        "model": AI_MODEL,
+        "messages": messages,
+        "max_tokens": AI_MAX_TOKENS,
+        "temperature": 0.7
+    }
+    if AI_OUTPUT_MODE == 'json':
+        kwargs["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "alpha_take", "strict": True, "schema": ALPHA_TAKE_SCHEMA}
+        }
+    return kwargs
+
+
+def validate_alpha_take(data):
+    """
+    Проверяет JSON ответ по ALPHA_TAKE_FIELDS
+    
+    Returns:
+        dict: {"indicator_line", "alpha_take", "context_tag", "hashtags"} (hashtags - строкой)
+    
+    Raises:
+        AlphaTakeFormatError: если поля отсутствуют, пустые или длиннее лимита
+    """
+    if not isinstance(data, dict):
+        raise AlphaTakeFormatError("response is not a JSON object")
+    
+    missing = [name for name in ALPHA_TAKE_FIELDS if name not in data]
+    if missing:
+        raise AlphaTakeFormatError(f"missing fields: {', '.join(missing)}")
+    
+    hashtags = data['hashtags']
+    if not isinstance(hashtags, list) or not 1 <= len(hashtags) <= 5:
+        raise AlphaTakeFormatError("hashtags must be a list of 1-5 items")
+    if not all(isinstance(tag, str) and tag.startswith('#') and ' ' not in tag.strip() for tag in hashtags):
+        raise AlphaTakeFormatError(f"invalid hashtags: {hashtags}")
+    
+    result = {name: data[name] for name in ALPHA_TAKE_FIELDS}
+    result['hashtags'] = " ".join(tag.strip() for tag in hashtags)
+    
+    for name, (limit, _) in ALPHA_TAKE_FIELDS.items():
+        value = result[name]
+        if not isinstance(value, str) or not value.strip():
+            raise AlphaTakeFormatError(f"empty field: {name}")
+        if len(value) > limit * FIELD_LIMIT_TOLERANCE:
+            raise AlphaTakeFormatError(f"{name} too long ({len(value)} > {limit})")
+        result[name] = value.strip()
+    return result
+
+
+def _parse_text_content(content):
+    """
+    Старый формат KEY: value построчно (AI_OUTPUT_MODE=text)
+
+    Raises:
+        AlphaTakeFormatError: ответ JSON-ом вместо строк KEY: value
+    """
+    # Извлекаем INDICATOR_LINE, ALPHA_TAKE, CONTEXT_TAG и HASHTAGS
+    indicator_line = None
+    alpha_take = None
+    context_tag = None
+    hashtags = None
+    
+    for line in content.split('\n'):
+        line = line.strip()
+        if line.startswith('INDICATOR_LINE:'):
+            indicator_line = line.replace('INDICATOR_LINE:', '').strip()
+        elif line.startswith('ALPHA_TAKE:'):
+            alpha_take = line.replace('ALPHA_TAKE:', '').strip()
+        elif line.startswith('CONTEXT_TAG:'):
+            context_tag = line.replace('CONTEXT_TAG:', '').strip()
+        elif line.startswith('HASHTAGS:'):
+            hashtags = line.replace('HASHTAGS:', '').strip()
+    
+    # Валидация
+    if not alpha_take and re.match(r'\s*(```(json)?\s*)?[{\[]', content):
+        # JSON целиком в alpha_take попал бы в пост - считаем ответ не по формату
+        raise AlphaTakeFormatError("JSON response in text mode")
+    if not alpha_take:
+        logger.warning(f"Could not parse Alpha Take from response")
+        logger.warning(f"  Response: {content}")
+        # Fallback: используем весь ответ если нет маркера
+        alpha_take = content
+    
+    return {
+        "indicator_line": indicator_line,
+        "alpha_take": alpha_take,
+        "context_tag": context_tag,
+        "hashtags": hashtags
+    }
+
+
+def parse_ai_response(response):
+    """
+    Разбирает ответ OpenAI в dict Alpha Take
+    
+    Returns:
+        dict: {"indicator_line", "alpha_take", "context_tag", "hashtags"}
+    
+    Raises:
+        AlphaTakeFormatError: в режиме json - ответ обрезан, отклонен или не прошел схему;
+            в режиме text - ответ JSON-ом
+    """
+    # Учет токенов для оценки стоимости
+    usage = getattr(response, 'usage', None)
+    if usage:
+        metrics.incr('ai_prompt_tokens', usage.prompt_tokens or 0)
+        metrics.incr('ai_completion_tokens', usage.completion_tokens or 0)
+        # Сколько токенов промпта пришло из кэша префикса
+        details = getattr(usage, 'prompt_tokens_details', None)
+        metrics.incr('ai_cached_tokens', getattr(details, 'cached_tokens', None) or 0)
+    
+    choice = response.choices[0]
+    content = (choice.message.content or "").strip()
+    logger.info(f"  OpenAI response: {content}")
+    
+    if AI_OUTPUT_MODE == 'json':
+        if getattr(choice.message, 'refusal', None):
+            raise AlphaTakeFormatError(f"refusal: {choice.message.refusal}")
+        if getattr(choice, 'finish_reason', None) == 'length':
+            raise AlphaTakeFormatError(f"truncated at max_tokens={AI_MAX_TOKENS}")
+        try:
+            result = validate_alpha_take(json.loads(content))
+        except json.JSONDecodeError as e:
+            raise AlphaTakeFormatError(f"invalid JSON: {e}") from e
+    else:
+        result = _parse_text_content(content)
+    
+    if result['indicator_line']:
+        logger.info(f"  ✓ Indicator Line: {result['indicator_line']}")
+    logger.info(f"  ✓ Alpha Take: {result['alpha_take']}")
+    if result['context_tag']:
+        logger.info(f"  ✓ Context Tag: {result['context_tag']}")
+    if result['hashtags']:
+        logger.info(f"  ✓ Hashtags: {result['hashtags']}")
+    
+    return result
+
+
+def _schema_failed(error, attempt):
+    """Логирует ответ не по схеме; True если еще можно повторить запрос"""
+    metrics.incr('ai_schema_failures')
+    if attempt < AI_SCHEMA_RETRIES:
+        logger.warning(f"⚠️ Alpha Take failed schema check ({error}) - retrying")
+        return True
+    logger.warning(f"⚠️ Alpha Take failed schema check ({error}) - posting without AI")
+    return False
+
+
+@metrics.timed('ai')
 def get_ai_comment(source_key, image_path):
     """
     Получает AI Alpha Take от OpenAI для скриншота
@@ -155,98 +411,125 @@ def get_ai_comment(source_key, image_path):
         image_path: Путь к изображению скриншота
         
     Returns:
-        dict: {"alpha_take": "..."}
-        или None если ошибка
+        dict: {"indicator_line", "alpha_take", "context_tag", "hashtags"}
+        или None если ошибка или ответ дважды не прошел схему
     """
     if not client:
         logger.warning("OpenAI client not initialized - skipping AI comment")
         return None
     
     try:
-        # Получаем промпт для этого источника
-        prompt = SOURCE_PROMPTS.get(source_key)
-        if not prompt:
-            logger.warning(f"No prompt configured for source: {source_key}")
-            return None
-        
-        # Кодируем изображение в base64
-        base64_image = encode_image_to_base64(image_path)
-        if not base64_image:
+        messages = _prepare_request(source_key, image_path)
+        if not messages:
             return None
         
         logger.info(f"🤖 Requesting Alpha Take from OpenAI for {source_key}...")
         
-        # Вызываем OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=200,
-            temperature=0.7
-        )
+        # Вызываем OpenAI API (ответ не по схеме - один повтор, затем пост без AI)
+        for attempt in range(AI_SCHEMA_RETRIES + 1):
+            response = client.chat.completions.create(**_completion_kwargs(messages))
+            try:
+                return parse_ai_response(response)
+            except AlphaTakeFormatError as e:
+                if not _schema_failed(e, attempt):
+                    return None
+        
+    except Exception as e:
+        logger.error(f"Error getting Alpha Take: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def _get_semaphore():
+    """Семафор конкурентности, привязанный к текущему event loop"""
+    global _ai_semaphore, _ai_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _ai_semaphore is None or _ai_semaphore_loop is not loop:
+        _ai_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+        _ai_semaphore_loop = loop
+    return _ai_semaphore
+
+
+async def _hedged(request, hedge_after):
+    """
+    Запускает request(); если ответа нет за hedge_after секунд - запускает второй
+    такой же запрос. Побеждает первый успешный, проигравший отменяется.
+    """
+    tasks = [asyncio.create_task(request('primary'))]
+    last_error = None
+    try:
+        if hedge_after:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                logger.info(f"  ⏱️  No response in {hedge_after:.1f}s - sending hedged request")
+                metrics.incr('ai_hedged')
+                tasks.append(asyncio.create_task(request('hedge')))
         
-        # Парсим ответ
-        content = response.choices[0].message.content.strip()
-        logger.info(f"  OpenAI response: {content}")
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.remove(task)
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+                logger.warning(f"  ⚠️ OpenAI request failed: {last_error}")
+        raise last_error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@metrics.timed('ai')
+async def get_ai_comment_async(source_key, image_path, deadline=None, hedge_after=None):
+    """
+    Async версия get_ai_comment с дедлайном, лимитом конкурентности и hedging
+    
+    Args:
+        source_key: Ключ источника
+        image_path: Путь к изображению скриншота
+        deadline: Общий дедлайн в секундах (по умолчанию AI_DEADLINE)
+        hedge_after: Через сколько секунд отправить дублирующий запрос (0 - выкл)
         
-        # Извлекаем INDICATOR_LINE, ALPHA_TAKE, CONTEXT_TAG и HASHTAGS
-        indicator_line = None
-        alpha_take = None
-        context_tag = None
-        hashtags = None
+    Returns:
+        dict как у get_ai_comment или None (ошибка или дедлайн) -
+        тогда пост уходит с обычным caption без Alpha Take
+    """
+    if not async_client:
+        logger.warning("OpenAI client not initialized - skipping AI comment")
+        return None
+    
+    deadline = AI_DEADLINE if deadline is None else deadline
+    hedge_after = AI_HEDGE_AFTER if hedge_after is None else hedge_after
+    
+    try:
+        messages = _prepare_request(source_key, image_path)
+        if not messages:
+            return None
         
-        for line in content.split('\n'):
-            line = line.strip()
-            if line.startswith('INDICATOR_LINE:'):
-                indicator_line = line.replace('INDICATOR_LINE:', '').strip()
-            elif line.startswith('ALPHA_TAKE:'):
-                alpha_take = line.replace('ALPHA_TAKE:', '').strip()
-            elif line.startswith('CONTEXT_TAG:'):
-                context_tag = line.replace('CONTEXT_TAG:', '').strip()
-            elif line.startswith('HASHTAGS:'):
-                hashtags = line.replace('HASHTAGS:', '').strip()
+        logger.info(f"🤖 Requesting Alpha Take from OpenAI for {source_key} (deadline {deadline:g}s)...")
         
-        # Валидация
-        if not alpha_take:
-            logger.warning(f"Could not parse Alpha Take from response")
-            logger.warning(f"  Response: {content}")
-            # Fallback: используем весь ответ если нет маркера
-            alpha_take = content
+        async def request(tag):
+            async with _get_semaphore():
+                return await async_client.chat.completions.create(**_completion_kwargs(messages))
         
-        if indicator_line:
-            logger.info(f"  ✓ Indicator Line: {indicator_line}")
-        logger.info(f"  ✓ Alpha Take: {alpha_take}")
-        if context_tag:
-            logger.info(f"  ✓ Context Tag: {context_tag}")
-        if hashtags:
-            logger.info(f"  ✓ Hashtags: {hashtags}")
+        async def request_validated():
+            for attempt in range(AI_SCHEMA_RETRIES + 1):
+                response = await _hedged(request, hedge_after)
+                try:
+                    return parse_ai_response(response)
+                except AlphaTakeFormatError as e:
+                    if not _schema_failed(e, attempt):
+                        return None
         
-        return {
-            "indicator_line": indicator_line,  # NEW!
-            "alpha_take": alpha_take,
-            "context_tag": context_tag,
-            "hashtags": hashtags
-        }
+        return await asyncio.wait_for(request_validated(), timeout=deadline)
         
+    except asyncio.TimeoutError:
+        logger.warning(f"⏱️ Alpha Take deadline ({deadline:g}s) exceeded - posting without AI")
+        metrics.incr('ai_timeouts')
+        return None
     except Exception as e:
         logger.error(f"Error getting Alpha Take: {e}")
-        import traceback
-        traceback.print_exc()
         return None
 
 
@@ -302,3 +585,59 @@ def add_alpha_take_to_caption(title, hashtags_fallback, ai_result):
     caption += f"{hashtags}"
     
     return caption
+
+
+# Минимальная длина префикса, с которой OpenAI начинает кэшировать промпт
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+def count_tokens(text):
+    """Токены текста: tiktoken если установлен, иначе оценка ~4 символа на токен"""
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(AI_MODEL)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return len(encoding.encode(text)), True
+    except ImportError:
+        return math.ceil(len(text) / 4), False
+
+
+def prompt_token_report():
+    """
+    Токены промпта по источникам: общий префикс (system + схема) и суффикс источника
+    Скриншот не учитывается (зависит от размера изображения)
+    
+    Returns:
+        list: [{"source", "prefix", "suffix", "total"}], bool - точный подсчет (tiktoken)
+    """
+    prefix_text = system_prompt()
+    if AI_OUTPUT_MODE == 'json':
+        prefix_text += json.dumps(ALPHA_TAKE_SCHEMA)
+    prefix, exact = count_tokens(prefix_text)
+    
+    rows = []
+    for source_key in SOURCE_PROMPTS:
+        suffix, _ = count_tokens(source_prompt(source_key))
+        rows.append({"source": source_key, "prefix": prefix, "suffix": suffix, "total": prefix + suffix})
+    return rows, exact
+
+
+def main():
+    rows, exact = prompt_token_report()
+    method = "tiktoken" if exact else "оценка ~4 символа/токен (pip install tiktoken для точного подсчета)"
+    print(f"Токены промпта Alpha Take ({AI_MODEL}, режим {AI_OUTPUT_MODE}, {method}):")
+    print(f"  {'источник':16} {'префикс':>8} {'суффикс':>8} {'всего':>6}  доля общего префикса")
+    for row in rows:
+        share = row['prefix'] / row['total'] * 100
+        print(f"  {row['source']:16} {row['prefix']:>8} {row['suffix']:>8} {row['total']:>6}  {share:.0f}%")
+    prefix = rows[0]['prefix'] if rows else 0
+    if prefix < PROMPT_CACHE_MIN_TOKENS:
+        print(f"  ℹ️  Префикс {prefix} < {PROMPT_CACHE_MIN_TOKENS} токенов - кэш OpenAI не сработает, "
+              f"экономия только за счет короткого промпта")
+    print("  Скриншот не учтен; фактические cached_tokens пишутся в метрики (ai_cached_tokens)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Профилирование и Playwright трассировка (opt-in через переменные окружения)
+Version: 1.0.0
+- PROFILE_MODE=cprofile|sampling - оборачивает весь запуск в профайлер
+- PLAYWRIGHT_TRACE=failure|slow - сохраняет trace.zip только для неудачных/медленных попыток
+Для всех артефактов ограничено хранение на диске (по количеству и размеру)
+"""
+
+import os
+import io
+import time
+import logging
+import pstats
+import cProfile
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Профайлер всего запуска: off | cprofile | sampling
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'off').lower()
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '10'))
+
+# Playwright tracing: off | failure | slow (slow = неудачные + медленные)
+PLAYWRIGHT_TRACE = os.getenv('PLAYWRIGHT_TRACE', 'off').lower()
+TRACE_DIR = os.getenv('TRACE_DIR', 'traces')
+TRACE_SLOW_SECONDS = float(os.getenv('TRACE_SLOW_SECONDS', '45'))
+TRACE_MAX_FILES = int(os.getenv('TRACE_MAX_FILES', '5'))
+TRACE_MAX_MB = float(os.getenv('TRACE_MAX_MB', '200'))
+
+# Sampling профайлер - опциональная зависимость
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+    HAS_PYINSTRUMENT = True
+except ImportError:
+    HAS_PYINSTRUMENT = False
+
+
+def prune_directory(directory, max_files, max_bytes=None):
+    """
+    Удаляет самые старые файлы пока директория не уложится в лимиты
+
+    Returns:
+        int: Количество удаленных файлов
+    """
+    if not os.path.isdir(directory):
+        return 0
+
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()  # Самые старые первыми
+
+    total_bytes = sum(size for _, size, _ in entries)
+    deleted = 0
+    while entries and (len(entries) > max_files or (max_bytes is not None and total_bytes > max_bytes)):
+        _, size, path = entries.pop(0)
+        try:
+            os.remove(path)
+            total_bytes -= size
+            deleted += 1
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось удалить {path}: {e}")
+    return deleted
+
+
+def _artifact_path(directory, name, extension):
+    os.makedirs(directory, exist_ok=True)
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+    return os.path.join(directory, f"{name}_{timestamp}.{extension}")
+
+
+def run_profiled(func, name="run"):
+    """
+    Выполняет func() под профайлером если PROFILE_MODE включен
+
+    Args:
+        func: Функция без аргументов (например lambda: asyncio.run(main_parser()))
+        name: Префикс имени файла отчета
+
+    Returns:
+        Результат func()
+    """
+    if PROFILE_MODE == 'sampling':
+        if HAS_PYINSTRUMENT:
+            return _run_sampling(func, name)
+        logger.warning("⚠️ pyinstrument не установлен, использую cProfile")
+        return _run_cprofile(func, name)
+    if PROFILE_MODE == 'cprofile':
+        return _run_cprofile(func, name)
+    return func()
+
+
+def _run_cprofile(func, name):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        try:
+            prof_path = _artifact_path(PROFILE_DIR, name, 'prof')
+            profiler.dump_stats(prof_path)
+
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(30)
+            with open(f"{os.path.splitext(prof_path)[0]}.txt", 'w', encoding='utf-8') as f:
+                f.write(summary.getvalue())
+
+            # .prof + .txt на каждый запуск
+            prune_directory(PROFILE_DIR, PROFILE_MAX_FILES * 2)
+            logger.info(f"🔬 cProfile отчет сохранен: {prof_path}")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить профиль: {e}")
+
+
+def _run_sampling(func, name):
+    profiler = SamplingProfiler(async_mode='enabled')
+    profiler.start()
+    try:
+        return func()
+    finally:
+        profiler.stop()
+        try:
+            html_path = _artifact_path(PROFILE_DIR, name, 'html')
+            with open(html_path, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+            prune_directory(PROFILE_DIR, PROFILE_MAX_FILES)
+            logger.info(f"🔬 Sampling профиль сохранен: {html_path}")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить профиль: {e}")
+
+
+class AttemptTracer:
+    """
+    Playwright tracing по попыткам: каждая попытка пишется в отдельный chunk,
+    на диск сохраняются только неудачные (и медленные, если PLAYWRIGHT_TRACE=slow)
+    Ошибки трассировки никогда не ломают сам скриншот
+    """
+
+    def __init__(self, context, mode=None):
+        self.context = context
+        self.mode = (mode or PLAYWRIGHT_TRACE)
+        self.enabled = self.mode in ('failure', 'slow')
+        self._started = False
+        self._attempt_started = None
+
+    async def start(self):
+        if not self.enabled:
+            return
+        try:
+            await self.context.tracing.start(screenshots=True, snapshots=True)
+            self._started = True
+            logger.info(f"🎥 Playwright tracing включен (режим: {self.mode})")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось включить tracing: {e}")
+
+    async def begin_attempt(self):
+        self._attempt_started = time.perf_counter()
+        if not self._started:
+            return
+        try:
+            await self.context.tracing.start_chunk()
+        except Exception as e:
+            logger.warning(f"⚠️ Tracing start_chunk: {e}")
+
+    async def end_attempt(self, source_key, attempt, success):
+        """Завершает chunk; сохраняет zip если попытка неудачная или медленная"""
+        duration = time.perf_counter() - (self._attempt_started or time.perf_counter())
+        if not self._started:
+            return None
+
+        is_slow = duration > TRACE_SLOW_SECONDS
+        keep = not success or (self.mode == 'slow' and is_slow)
+        try:
+            if not keep:
+                await self.context.tracing.stop_chunk()
+                return None
+
+            trace_path = _artifact_path(TRACE_DIR, f"{source_key}_attempt{attempt}", 'zip')
+            await self.context.tracing.stop_chunk(path=trace_path)
+            prune_directory(TRACE_DIR, TRACE_MAX_FILES, int(TRACE_MAX_MB * 1024 * 1024))
+            reason = "ошибка" if not success else f"медленно ({duration:.1f}s)"
+            logger.info(f"🎥 Trace сохранен ({reason}): {trace_path}")
+            logger.info(f"   Открыть: playwright show-trace {trace_path}")
+            return trace_path
+        except Exception as e:
+            logger.warning(f"⚠️ Tracing stop_chunk: {e}")
+            return None
+
+    async def stop(self):
+        if not self._started:
+            return
+        self._started = False
+        try:
+            await self.context.tracing.stop()
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось остановить tracing: {e}")
@@ -0,0 +1,154 @@
+"""
+История публикаций: снапшот + журнал событий
+Version: 1.0.0
+- publication_history.json   - снапшот (прежний формат: last_published + last_publication)
+- publication_events.jsonl   - журнал: одна строка на публикацию, только дописывается
+Каждые compact_every событий журнал сворачивается в снапшот (атомарная запись),
+источники, которых больше нет в SCREENSHOT_SOURCES (кроме дайджеста), при этом удаляются.
+Между свертками git-коммит истории - одна новая строка журнала
+"""
+
+import os
+import json
+import logging
+from datetime import datetime, timezone
+
+from atomic_io import atomic_write_json, atomic_write_text, append_json_line
+from sources_config import SCREENSHOT_SOURCES, PUBLICATION_HISTORY_SETTINGS
+from source_specs import DIGEST_KEY
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(value):
+    """ISO время -> datetime для сравнения (невалидное - самое старое)"""
+    try:
+        parsed = datetime.fromisoformat(value)
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return datetime.min.replace(tzinfo=timezone.utc)
+
+
+class PublicationStore:
+    """Последняя публикация по каждому источнику (индекс в памяти, один load на запуск)"""
+
+    def __init__(self, snapshot_path=None, events_path=None, known_sources=None, compact_every=None):
+        settings = PUBLICATION_HISTORY_SETTINGS
+        self.snapshot_path = snapshot_path or settings['snapshot_file']
+        self.events_path = events_path or settings['events_file']
+        # Дайджест - не источник SCREENSHOT_SOURCES, но его история нужна для паузы между постами
+        self.known_sources = {*SCREENSHOT_SOURCES, DIGEST_KEY} if known_sources is None else set(known_sources)
+        self.compact_every = compact_every or settings['compact_every']
+        self.last_published = {}
+        self.last_publication = None
+        self.pending_events = 0
+        self.load()
+
+    def load(self):
+        """Читает снапшот и доигрывает поверх него журнал"""
+        self.last_published = {}
+        self.last_publication = None
+        self.pending_events = 0
+
+        try:
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+                self.last_published = dict(snapshot.get('last_published', {}))
+                self.last_publication = snapshot.get('last_publication')
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка загрузки истории: {e}")
+
+        try:
+            if os.path.exists(self.events_path):
+                with open(self.events_path, 'r', encoding='utf-8') as f:
+                    for line_number, line in enumerate(f, 1):
+                        if not line.strip():
+                            continue
+                        try:
+                            self._apply(json.loads(line))
+                            self.pending_events += 1
+                        except (ValueError, AttributeError):
+                            # Оборванная строка после падения - пропускаем, остальное валидно
+                            logger.warning(f"⚠️ Пропущена битая строка журнала {self.events_path}:{line_number}")
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка чтения журнала публикаций: {e}")
+
+        if self.last_published:
+            logger.info(f"✓ История публикаций загружена: {len(self.last_published)} источников"
+                        f"{f' (+{self.pending_events} в журнале)' if self.pending_events else ''}")
+        else:
+            logger.info("📝 Создание новой истории публикаций")
+
+    def _apply(self, event):
+        """Применяет событие (идемпотентно: повторное применение ничего не меняет)"""
+        source_key = event['source']
+        published_at = event['published_at']
+        current = self.last_published.get(source_key)
+        if current is None or _timestamp(published_at) >= _timestamp(current):
+            self.last_published[source_key] = published_at
+        if (self.last_publication is None
+                or _timestamp(published_at) >= _timestamp(self.last_publication.get('published_at'))):
+            self.last_publication = event
+
+    def get_last_published(self, source_key):
+        """ISO время последней публикации источника или None"""
+        return self.last_published.get(source_key)
+
+    def dead_sources(self):
+        """Источники из истории, которых больше нет в конфиге"""
+        return [key for key in self.last_published if key not in self.known_sources]
+
+    def record(self, source_key, name, telegram, twitter):
+        """
+        Дописывает публикацию в журнал (и сворачивает журнал если пора)
+
+        Returns:
+            bool: True если событие записано на диск
+        """
+        if source_key not in self.known_sources:
+            # Свертка удалит такую запись сразу после записи - пауза между постами не сработает
+            logger.warning(f"⚠️ Источник {source_key} не входит в known_sources: запись не переживет свертку")
+        now = datetime.now(timezone.utc)
+        event = {
+            "source": source_key,
+            "name": name,
+            "published_at": now.isoformat(),
+            "hour_utc": now.hour,
+            "telegram": telegram,
+            "twitter": twitter
+        }
+        try:
+            append_json_line(self.events_path, event)
+        except OSError as e:
+            logger.error(f"✗ Ошибка записи журнала публикаций: {e}")
+            return False
+
+        self._apply(event)
+        self.pending_events += 1
+        logger.info("✓ История публикаций обновлена")
+
+        if self.pending_events >= self.compact_every or self.dead_sources():
+            self.compact()
+        return True
+
+    def compact(self):
+        """Сворачивает журнал в снапшот: сначала атомарно пишется снапшот, потом очищается журнал"""
+        for source_key in self.dead_sources():
+            del self.last_published[source_key]
+            logger.info(f"  🗑️  Удален из истории отсутствующий источник: {source_key}")
+
+        snapshot = {
+            "last_published": self.last_published,
+            "last_publication": self.last_publication
+        }
+        try:
+            atomic_write_json(self.snapshot_path, snapshot, indent=2)
+            # Падение между двумя записями безопасно: журнал доигрывается идемпотентно
+            atomic_write_text(self.events_path, "")
+            logger.info(f"✓ Журнал публикаций свернут ({self.pending_events} событий)")
+            self.pending_events = 0
+            return True
+        except OSError as e:
+            logger.error(f"✗ Ошибка свертки истории публикаций: {e}")
+            return False
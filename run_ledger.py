@@ -0,0 +1,306 @@
+"""
+Журнал запусков в SQLite
+Version: 1.0.0
+Одна транзакция на запуск (из записи metrics.finish_run): запуск, падения по этапам
+и тайминги. Индексы по (source, time) - запросы за окно не сканируют всю таблицу.
+В GitHub Actions база переносится между запусками через actions/cache (иначе каждый
+запуск начинал бы с пустой базы); записи старше RUN_LEDGER_RETENTION_DAYS удаляются
+
+Использование:
+    python run_ledger.py stats --days 7
+    python run_ledger.py stats --days 30 --source fear_greed
+    python run_ledger.py import metrics/runs.jsonl      # загрузить старые JSON-строки
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+RUN_LEDGER_PATH = os.getenv('RUN_LEDGER_PATH', os.path.join('metrics', 'runs.sqlite'))
+RUN_LEDGER_RETENTION_DAYS = int(os.getenv('RUN_LEDGER_RETENTION_DAYS', '90'))  # 0 - хранить все
+
+# gpt-4o-mini (openai_integration.AI_MODEL), USD за 1M токенов
+AI_PRICE_PER_1M = {
+    "input": 0.15,
+    "cached_input": 0.075,
+    "output": 0.60
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started_ts REAL NOT NULL,
+    started_at TEXT NOT NULL,
+    source TEXT,
+    status TEXT NOT NULL,
+    duration_ms REAL,
+    capture_ms REAL,
+    attempts INTEGER,
+    bytes_raw INTEGER,
+    bytes_optimized INTEGER,
+    ai_ok INTEGER,
+    ai_prompt_tokens INTEGER,
+    ai_completion_tokens INTEGER,
+    ai_cached_tokens INTEGER,
+    ai_cost_usd REAL,
+    telegram INTEGER,
+    twitter INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_runs_source_time ON runs (source, started_ts);
+CREATE INDEX IF NOT EXISTS idx_runs_time ON runs (started_ts);
+
+CREATE TABLE IF NOT EXISTS stage_failures (
+    run_id TEXT NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (run_id, stage)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS timings (
+    run_id TEXT NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    ms REAL NOT NULL,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+"""
+
+
+def connect(path=None):
+    """Открывает базу (создает схему при первом обращении)"""
+    path = path or RUN_LEDGER_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    # WAL: запись запуска не блокирует чтение статистики
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _bool(value):
+    return None if value is None else int(bool(value))
+
+
+def ai_cost_usd(prompt_tokens, completion_tokens, cached_tokens=0):
+    """Стоимость запроса по AI_PRICE_PER_1M (кэшированные токены дешевле)"""
+    uncached = max(0, (prompt_tokens or 0) - (cached_tokens or 0))
+    return (uncached * AI_PRICE_PER_1M['input']
+            + (cached_tokens or 0) * AI_PRICE_PER_1M['cached_input']
+            + (completion_tokens or 0) * AI_PRICE_PER_1M['output']) / 1_000_000
+
+
+def _row_from_record(record):
+    counters = record.get('counters', {})
+    values = record.get('values', {})
+    timings = record.get('timings_ms', {})
+    started = datetime.fromisoformat(record['started_at'])
+
+    prompt_tokens = counters.get('ai_prompt_tokens', 0)
+    completion_tokens = counters.get('ai_completion_tokens', 0)
+    cached_tokens = counters.get('ai_cached_tokens', 0)
+    captured = 'take_screenshot' in timings
+
+    return (
+        record['run_id'],
+        started.timestamp(),
+        record['started_at'],
+        record.get('source'),
+        record['status'],
+        record.get('duration_ms'),
+        timings.get('take_screenshot'),
+        (counters.get('retries', 0) + 1) if captured else 0,
+        counters.get('bytes_raw'),
+        counters.get('bytes_optimized'),
+        _bool(values.get('ai')),
+        prompt_tokens,
+        completion_tokens,
+        cached_tokens,
+        ai_cost_usd(prompt_tokens, completion_tokens, cached_tokens),
+        _bool(values.get('telegram')),
+        _bool(values.get('twitter'))
+    )
+
+
+def _insert(conn, record):
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        _row_from_record(record)
+    )
+    if cursor.rowcount == 0:
+        return False  # Уже записан (повторный import)
+
+    failures = [(record['run_id'], name[len('failures_'):], count)
+                for name, count in record.get('counters', {}).items() if name.startswith('failures_')]
+    conn.executemany("INSERT INTO stage_failures VALUES (?, ?, ?)", failures)
+    conn.executemany("INSERT INTO timings VALUES (?, ?, ?)",
+                     [(record['run_id'], name, ms) for name, ms in record.get('timings_ms', {}).items()])
+    return True
+
+
+def record_run(record, path=None):
+    """
+    Записывает запуск одной транзакцией
+
+    Args:
+        record: Запись из metrics.finish_run() (None - метрики отключены)
+
+    Returns:
+        bool: True если запись добавлена
+    """
+    if not record:
+        return False
+    try:
+        conn = connect(path)
+        try:
+            with conn:
+                added = _insert(conn, record)
+                if RUN_LEDGER_RETENTION_DAYS > 0:
+                    # Старые запуски удаляются вместе с этапами (ON DELETE CASCADE)
+                    cutoff = datetime.now(timezone.utc) - timedelta(days=RUN_LEDGER_RETENTION_DAYS)
+                    conn.execute("DELETE FROM runs WHERE started_ts < ?", (cutoff.timestamp(),))
+        finally:
+            conn.close()
+        if added:
+            logger.info(f"🗃️  Запуск записан в журнал: {path or RUN_LEDGER_PATH}")
+        return added
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось записать запуск в журнал: {e}")
+        return False
+
+
+def import_jsonl(jsonl_path, path=None):
+    """Загружает записи metrics/runs.jsonl (уже записанные run_id пропускаются)"""
+    conn = connect(path)
+    added = 0
+    try:
+        with conn, open(jsonl_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    added += _insert(conn, json.loads(line))
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"⚠️ Пропущена запись: {e}")
+    finally:
+        conn.close()
+    return added
+
+
+def source_stats(days=7, source=None, path=None):
+    """
+    Статистика по источникам за последние days дней
+
+    Returns:
+        list: [{"source", "runs", "success_rate", "median_capture_s", "avg_attempts",
+                "ai_calls", "ai_cost_usd", "top_failure"}]
+    """
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).timestamp()
+    conn = connect(path)
+    try:
+        where = "started_ts >= ?" + (" AND source = ?" if source else "")
+        params = (since, source) if source else (since,)
+        rows = conn.execute(f"""
+            SELECT source,
+                   COUNT(*),
+                   SUM(status = 'success'),
+                   SUM(status != 'skipped'),
+                   AVG(NULLIF(attempts, 0)),
+                   SUM(ai_prompt_tokens > 0),
+                   SUM(ai_cost_usd)
+            FROM runs
+            WHERE {where}
+            GROUP BY source
+            ORDER BY source
+        """, params).fetchall()
+
+        stats = []
+        for source_key, runs, successes, attempted, avg_attempts, ai_calls, cost in rows:
+            # Медиана по индексу (source, started_ts): сортируется только окно источника
+            captured = conn.execute(
+                "SELECT COUNT(capture_ms) FROM runs WHERE source IS ? AND started_ts >= ?",
+                (source_key, since)
+            ).fetchone()[0]
+            median = None
+            if captured:
+                median = conn.execute(
+                    "SELECT capture_ms FROM runs WHERE source IS ? AND started_ts >= ? AND capture_ms IS NOT NULL "
+                    "ORDER BY capture_ms LIMIT 1 OFFSET ?",
+                    (source_key, since, (captured - 1) // 2)
+                ).fetchone()[0]
+
+            top_failure = conn.execute("""
+                SELECT f.stage, SUM(f.count) AS total
+                FROM stage_failures f JOIN runs r ON r.run_id = f.run_id
+                WHERE r.source IS ? AND r.started_ts >= ?
+                GROUP BY f.stage ORDER BY total DESC LIMIT 1
+            """, (source_key, since)).fetchone()
+
+            stats.append({
+                "source": source_key,
+                "runs": runs,
+                "success_rate": (successes / attempted) if attempted else None,
+                "median_capture_s": median / 1000 if median is not None else None,
+                "avg_attempts": avg_attempts,
+                "ai_calls": ai_calls or 0,
+                "ai_cost_usd": cost or 0.0,
+                "top_failure": f"{top_failure[0]} x{top_failure[1]}" if top_failure else None
+            })
+        return stats
+    finally:
+        conn.close()
+
+
+def _format(value, pattern, empty="-"):
+    return empty if value is None else pattern.format(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Журнал запусков парсера (SQLite)")
+    parser.add_argument('--db', default=None, help=f'Путь к базе (по умолчанию {RUN_LEDGER_PATH})')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stats = commands.add_parser('stats', help='Статистика по источникам за окно')
+    stats.add_argument('--days', type=float, default=7)
+    stats.add_argument('--source', default=None)
+    stats.add_argument('--json', action='store_true', help='Вывод в JSON')
+
+    load = commands.add_parser('import', help='Загрузить metrics/runs.jsonl')
+    load.add_argument('jsonl', nargs='?', default=os.getenv('METRICS_JSONL_PATH', os.path.join('metrics', 'runs.jsonl')))
+
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        added = import_jsonl(args.jsonl, args.db)
+        print(f"✓ Загружено запусков: {added}")
+        return
+
+    rows = source_stats(args.days, args.source, args.db)
+    if args.json:
+        print(json.dumps(rows, indent=2, ensure_ascii=False))
+        return
+    if not rows:
+        print(f"Нет запусков за последние {args.days:g} дн.")
+        sys.exit(1)
+
+    print(f"Запуски за последние {args.days:g} дн.:")
+    print(f"  {'источник':22} {'запусков':>8} {'успех':>6} {'медиана':>8} {'попыток':>8} {'AI':>4} {'AI $':>8}  частое падение")
+    for row in rows:
+        print(f"  {str(row['source']):22} {row['runs']:>8} "
+              f"{_format(row['success_rate'], '{:.0%}'):>6} "
+              f"{_format(row['median_capture_s'], '{:.1f}s'):>8} "
+              f"{_format(row['avg_attempts'], '{:.2f}'):>8} "
+              f"{row['ai_calls']:>4} {row['ai_cost_usd']:>8.4f}  "
+              f"{row['top_failure'] or '-'}")
+
+
+if __name__ == "__main__":
+    main()
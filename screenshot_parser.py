@@ -5,7 +5,7 @@ Version: 1.3.2 (Production Ready - QA Approved)
 ✅ Обрезка под Telegram формат
 ✅ Публикация в Telegram и Twitter
 ✅ История публикаций
-✅ Lock-файлы и retry логика
+✅ Очередь задач с арендой (job_queue.py) и retry логика
 ✅ Полное тестирование и QA
 ✅ Правильный resource management (finally blocks)
 ✅ Complete cleanup (all temp files)
@@ -15,8 +15,8 @@ Version: 1.3.2 (Production Ready - QA Approved)
 import asyncio
 from playwright.async_api import async_playwright
 import time
-import json
 import traceback
+import importlib
 from datetime import datetime, timezone, timedelta
 import requests
 import os
@@ -24,27 +24,37 @@ import sys
 import logging
 import tweepy
 from io import BytesIO
-import tempfile
 import platform
 from PIL import Image
 import html  # FIX ISSUE #26: Для HTML escaping
+import metrics  # Тайминги и структурированная запись запуска
+import profiling  # Opt-in профайлер и Playwright tracing
+import image_pool  # Обработка изображений вне event loop
+import run_ledger  # SQLite журнал запусков
+from image_optimize import optimize_image_for_telegram  # Легкий модуль для воркеров пула
+import argparse
 
 # Импорты конфигурации
 from sources_config import (
     SCREENSHOT_SOURCES, 
     POST_SCHEDULE,  # ✅ НОВОЕ: Расписание постов
-    IMAGE_SETTINGS, 
-    SCREENSHOT_SETTINGS
+    SCREENSHOT_SETTINGS,
+    ADAPTIVE_WAIT_SETTINGS,
+    ARTIFACT_SETTINGS,
+    DIGEST_SETTINGS
 )
+from wait_budget import WaitBudgets
+from publication_store import PublicationStore
+from artifact_store import ArtifactStore
+from selector_chain import SelectorCache, resolve_strategies
+from source_specs import compile_sources, validate_schedule, DigestSpec, DIGEST_KEY, CLOSE_MODAL_BUTTONS_JS, CLOSE_MODAL_BACKDROP_JS, CLOSE_MODAL_HIDE_JS
+from image_quality import assess_capture
+from browser_session import open_session, watch_cache
+from job_queue import JobQueue, Lease, slot_job
+from step_graph import Step, run_steps
+from source_probe import PROBE_ENABLED, ProbeState, probe_source
 import random  # ✅ НОВОЕ: Для случайного выбора источников
 
-# Пытаемся импортировать fcntl (только Unix)
-try:
-    import fcntl
-    HAS_FCNTL = True
-except ImportError:
-    HAS_FCNTL = False
-
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -57,7 +67,7 @@ logger = logging.getLogger(__name__)
 
 # OpenAI Integration для AI комментариев (после logger!)
 try:
-    from openai_integration import get_ai_comment, add_alpha_take_to_caption
+    from openai_integration import get_ai_comment, get_ai_comment_async, add_alpha_take_to_caption
     OPENAI_ENABLED = True
     logger.info("✓ OpenAI integration loaded")
 except ImportError as e:
@@ -65,6 +75,8 @@ except ImportError as e:
     logger.warning(f"⚠️ OpenAI integration not available: {e}")
     def get_ai_comment(*args, **kwargs):
         return None
+    async def get_ai_comment_async(*args, **kwargs):
+        return None
     def add_alpha_take_to_caption(title, hashtags_fallback, *args, **kwargs):
         return f"<b>{title}</b>\n\n{hashtags_fallback}"
 except Exception as e:
@@ -72,15 +84,39 @@ except Exception as e:
     logger.warning(f"⚠️ OpenAI integration error: {e}")
     def get_ai_comment(*args, **kwargs):
         return None
+    async def get_ai_comment_async(*args, **kwargs):
+        return None
     def add_alpha_take_to_caption(title, hashtags_fallback, *args, **kwargs):
         return f"<b>{title}</b>\n\n{hashtags_fallback}"
 
 # Глобальные настройки
 MAX_RETRIES = int(os.getenv('MAX_RETRIES', '2'))
 
+# Локальная отрисовка (native_render источника); false - всегда браузер
+NATIVE_RENDER_ENABLED = os.getenv('NATIVE_RENDER', 'true').lower() == 'true'
+# (модуль, функция): модули на numpy импортируются только при отрисовке
+NATIVE_RENDERERS = {
+    'treemap': ('treemap_renderer', 'render_source'),
+    'gauge': ('indicator_renderer', 'render_gauge_source'),
+    'card': ('indicator_renderer', 'render_card_source')
+}
+
+# direct - захват и публикация подряд; staged - захват заранее, публикация ровно в publish_at_msk слота
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'direct').lower()
+READY_MAX_AGE_SECONDS = int(os.getenv('READY_MAX_AGE_SECONDS', '900'))  # Старше - перезахват перед публикацией
+
+# Publish-first: фото уходит сразу с заголовком и хештегами, Alpha Take дописывается
+# в подпись через editMessageCaption, если успевает за AI_CAPTION_EDIT_DEADLINE секунд
+PUBLISH_FIRST = os.getenv('PUBLISH_FIRST', 'false').lower() == 'true'
+AI_CAPTION_EDIT_DEADLINE = float(os.getenv('AI_CAPTION_EDIT_DEADLINE', '60'))
+
 # Telegram настройки
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+# Базовый URL Bot API (для локального mock_servers.py - http://127.0.0.1:8081)
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/')
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))  # Повторы при 429/5xx
+TELEGRAM_MAX_RETRY_AFTER = 30  # Дольше не ждем даже если Telegram просит
 
 # Twitter API настройки
 TWITTER_API_KEY = os.getenv('TWITTER_API_KEY')
@@ -96,116 +132,61 @@ TWITTER_ENABLED = os.getenv('TWITTER_ENABLED', 'true').lower() == 'true'
 SCREENSHOTS_DIR = "screenshots"
 os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
 
+# Учет готовых скриншотов: LRU с бюджетом, последний удачный по источнику закреплен
+ARTIFACTS = ArtifactStore(SCREENSHOTS_DIR)
 
-def get_lock_file_path():
-    """Возвращает путь к lock-файлу (кросс-платформенный)"""
-    if platform.system() == 'Windows':
-        return os.path.join(tempfile.gettempdir(), 'cmc_screenshots.lock')
-    else:
-        return '/tmp/cmc_screenshots.lock'
+# Этапы захвата скриншота (порядок важен - retry продолжает с упавшего этапа)
+CAPTURE_STAGES = ('navigation', 'readiness', 'selector', 'capture', 'postprocess', 'quality')
 
+# Упавший этап -> (с какого этапа повторять, пауза перед повтором в секундах)
+# Полная перезагрузка страницы только при ошибке навигации
+RETRY_POLICY = {
+    'navigation': ('navigation', 3.0),
+    'readiness': ('readiness', 1.0),
+    'selector': ('selector', 0.5),
+    'capture': ('selector', 0.2),  # element handle мог устареть - ищем заново
+    'postprocess': ('postprocess', 0),
+    'quality': ('readiness', 2.0),  # Пустой/битый кадр - даем странице дорисоваться и снимаем заново
+}
 
-def is_process_running(pid):
-    """Проверяет что процесс с PID запущен"""
-    try:
-        os.kill(pid, 0)
-        return True
-    except (OSError, ProcessLookupError):
-        return False
-
+# Конфиг источников компилируется и проверяется один раз при импорте:
+# опечатка в ключе или пустой селектор падают сразу, а не посреди захвата
+SOURCE_SPECS = compile_sources(SCREENSHOT_SOURCES, SCREENSHOT_SETTINGS)
+DIGEST_SPEC = DigestSpec(DIGEST_SETTINGS, SOURCE_SPECS)
+validate_schedule(POST_SCHEDULE, {**SOURCE_SPECS, DIGEST_KEY: DIGEST_SPEC})
 
-def acquire_lock():
-    """Создает lock-файл для предотвращения параллельного запуска"""
-    lock_path = get_lock_file_path()
-    
-    if os.path.exists(lock_path):
-        try:
-            with open(lock_path, 'r') as f:
-                content = f.read().strip()
-                if content:
-                    lines = content.split('\n')
-                    try:
-                        old_pid = int(lines[0])
-                        if is_process_running(old_pid):
-                            logger.error(f"✗ Парсер уже запущен (PID: {old_pid})")
-                            return None, None
-                        else:
-                            logger.warning(f"⚠️ Найден stale lock от процесса {old_pid}, удаляю")
-                            os.remove(lock_path)
-                    except (ValueError, IndexError):
-                        logger.warning(f"⚠️ Поврежденный lock-файл, удаляю")
-                        os.remove(lock_path)
-        except Exception as e:
-            logger.warning(f"⚠️ Ошибка чтения lock-файла: {e}, удаляю")
-            try:
-                os.remove(lock_path)
-            except:
-                pass
-    
-    try:
-        lock_file = open(lock_path, 'w')
-        
-        if HAS_FCNTL:
-            try:
-                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            except IOError:
-                lock_file.close()
-                return None, None
-        
-        lock_file.write(f"{os.getpid()}\n{datetime.now(timezone.utc).isoformat()}")
-        lock_file.flush()
-        
-        logger.info(f"✓ Lock-файл создан: {lock_path}")
-        return lock_file, lock_path
-        
-    except Exception as e:
-        logger.error(f"✗ Ошибка создания lock-файла: {e}")
-        return None, None
-
-
-def release_lock(lock_file, lock_path):
-    """Освобождает lock-файл"""
-    try:
-        if lock_file:
-            if HAS_FCNTL:
-                try:
-                    fcntl.flock(lock_file, fcntl.LOCK_UN)
-                except:
-                    pass
-            lock_file.close()
-        
-        if lock_path and os.path.exists(lock_path):
-            os.remove(lock_path)
-            logger.info(f"✓ Lock-файл удален: {lock_path}")
-    except Exception as e:
-        logger.warning(f"⚠️ Не удалось удалить lock-файл: {e}")
+# Адаптивные бюджеты ожидания (история в wait_history.json)
+WAIT_BUDGETS = WaitBudgets()
 
+# Последние сработавшие стратегии селекторов (selector_cache.json)
+SELECTOR_CACHE = SelectorCache()
 
-def load_publication_history():
-    """Загружает историю публикаций из JSON файла"""
-    try:
-        if os.path.exists('publication_history.json'):
-            with open('publication_history.json', 'r', encoding='utf-8') as f:
-                history = json.load(f)
-                logger.info(f"✓ История публикаций загружена: {len(history.get('last_published', {}))} источников")
-                return history
-    except Exception as e:
-        logger.warning(f"⚠️ Ошибка загрузки истории: {e}")
-    
-    logger.info("📝 Создание новой истории публикаций")
-    return {"last_published": {}}
+# JS-проверка готовности: элемент есть и его содержимое не менялось stable_ms
+# Для canvas сравнивается отрисованное содержимое, для остального - разметка и высота
+CONTENT_STABLE_JS = """(args) => {
+    let el = null;
+    try { el = args.selector ? document.querySelector(args.selector) : null; } catch (e) {}
+    el = el || document.body;
+    if (!el) return false;
+    let sig;
+    if (el.tagName === 'CANVAS') {
+        try { sig = el.toDataURL('image/jpeg', 0.1).length; } catch (e) { sig = el.width + 'x' + el.height; }
+    } else {
+        sig = el.innerHTML.length + ':' + Math.round(el.getBoundingClientRect().height);
+    }
+    const now = performance.now();
+    if (window.__cmcReadySig !== sig) {
+        window.__cmcReadySig = sig;
+        window.__cmcReadyAt = now;
+        return false;
+    }
+    return now - window.__cmcReadyAt >= args.stableMs;
+}"""
 
 
-def save_publication_history(history):
-    """Сохраняет историю публикаций в JSON файл"""
-    try:
-        with open('publication_history.json', 'w', encoding='utf-8') as f:
-            json.dump(history, f, indent=2, ensure_ascii=False)
-        logger.info("✓ История публикаций обновлена")
-        return True
-    except Exception as e:
-        logger.error(f"✗ Ошибка сохранения истории: {e}")
-        return False
+def telegram_api_url(method):
+    """URL метода Bot API с учетом TELEGRAM_API_BASE"""
+    return f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/{method}"
 
 
 def validate_telegram_credentials():
@@ -215,8 +196,7 @@ def validate_telegram_credentials():
         return False
     
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getMe"
-        response = requests.get(url, timeout=5)
+        response = requests.get(telegram_api_url('getMe'), timeout=5)
         
         if response.status_code != 200:
             logger.error(f"✗ Telegram токен невалидный: {response.status_code}")
@@ -238,157 +218,123 @@ def validate_telegram_credentials():
 
 def cleanup_old_screenshots(max_age_hours=24):
     """
-    Удаляет скриншоты старше max_age_hours
+    Удаляет скриншоты старше max_age_hours и сверх бюджета ARTIFACT_SETTINGS (LRU)
     CRITICAL: Prevents disk space leak from failed publishes and retries
     """
     try:
-        if not os.path.exists(SCREENSHOTS_DIR):
-            return
-        
-        now = time.time()
-        max_age_seconds = max_age_hours * 3600
-        deleted_count = 0
-        total_size = 0
-        
-        for filename in os.listdir(SCREENSHOTS_DIR):
-            filepath = os.path.join(SCREENSHOTS_DIR, filename)
-            
-            # Skip directories
-            if not os.path.isfile(filepath):
-                continue
-            
-            try:
-                file_age = now - os.path.getmtime(filepath)
-                
-                if file_age > max_age_seconds:
-                    file_size = os.path.getsize(filepath)
-                    os.remove(filepath)
-                    deleted_count += 1
-                    total_size += file_size
-            except Exception as e:
-                logger.warning(f"⚠️ Не удалось удалить {filename}: {e}")
+        deleted_count, total_size = ARTIFACTS.cleanup(max_age_hours)
         
         if deleted_count > 0:
             logger.info(f"🗑️  Cleanup: удалено {deleted_count} старых файлов ({total_size/1024/1024:.1f} MB)")
         else:
             logger.info("✓ Cleanup: нет старых файлов для удаления")
+        logger.info(f"  📦 Скриншоты: {len(ARTIFACTS.entries) + len(ARTIFACTS.pinned)} файлов, "
+                    f"{ARTIFACTS.total_bytes/1024/1024:.1f} MB (закреплено: {len(ARTIFACTS.pinned)})")
             
     except Exception as e:
-        logger.warning(f"⚠️ Ошибка cleanup старых файлов: {e}")
+        logger.warning(f"⚠️ Ошибка cleanup: {e}")
 
 
-def optimize_image_for_telegram(image_path, skip_width_padding=False, crop=None):
-    """Оптимизирует изображение для Telegram
-    
-    Args:
-        image_path: Путь к изображению
-        skip_width_padding: Пропустить добавление padding по ширине
-        crop: Dict с параметрами обрезки {"top": N, "right": N, "bottom": N, "left": N} в пикселях
+async def optimize_image_async(image_path, skip_width_padding=False, crop=None):
     """
-    try:
-        logger.info(f"🖼️  Оптимизация изображения: {image_path}")
-        
-        img = Image.open(image_path)
-        original_size = os.path.getsize(image_path)
-        
-        logger.info(f"  Исходный размер: {img.size[0]}x{img.size[1]} ({original_size / 1024:.1f} KB)")
-        
-        # Конвертируем в RGB если нужно
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        
-        # ✅ НОВОЕ: Обрезка изображения
-        if crop:
-            top = crop.get('top', 0)
-            right = crop.get('right', 0)
-            bottom = crop.get('bottom', 0)
-            left = crop.get('left', 0)
-            
-            width, height = img.size
-            crop_box = (
-                left,                    # left
-                top,                     # top
-                width - right,           # right
-                height - bottom          # bottom
-            )
-            
-            img = img.crop(crop_box)
-            logger.info(f"  ✂️  Обрезано: {img.size[0]}x{img.size[1]} (top:{top}, right:{right}, bottom:{bottom}, left:{left})")
-        
-        # CRITICAL: Валидация размеров изображения
-        if img.size[0] == 0 or img.size[1] == 0:
-            logger.error(f"  ✗ ОШИБКА: Изображение имеет нулевые размеры: {img.size[0]}x{img.size[1]}")
-            return None
-        
-        # Изменяем размер если больше лимита
-        max_width = IMAGE_SETTINGS['telegram_max_width']
-        max_height = IMAGE_SETTINGS['telegram_max_height']
-        
-        if img.size[0] > max_width or img.size[1] > max_height:
-            img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-            logger.info(f"  Изменен размер: {img.size[0]}x{img.size[1]}")
-        
-        # Добавляем padding если изображение слишком узкое (если не отключено)
-        min_width = IMAGE_SETTINGS.get('telegram_min_width', 0)
-        add_padding = IMAGE_SETTINGS.get('add_padding_if_narrow', False)
-        
-        if add_padding and not skip_width_padding and img.size[0] < min_width:
-            padding_color = IMAGE_SETTINGS.get('padding_color', (255, 255, 255))
-            
-            # Валидация padding_color
-            if not (isinstance(padding_color, tuple) and len(padding_color) == 3):
-                logger.warning(f"  ⚠️ Некорректный padding_color: {padding_color}, используем белый")
-                padding_color = (255, 255, 255)
-            else:
-                r, g, b = padding_color
-                if not (0 <= r <= 255 and 0 <= g <= 255 and 0 <= b <= 255):
-                    logger.warning(f"  ⚠️ padding_color вне диапазона 0-255: {padding_color}, используем белый")
-                    padding_color = (255, 255, 255)
-            
-            # Сохраняем исходную ширину для логирования
-            original_width = img.size[0]
-            
-            # Создаем новое изображение с нужной шириной
-            new_width = min_width
-            new_height = img.size[1]
-            new_img = Image.new('RGB', (new_width, new_height), padding_color)
-            
-            # Центрируем исходное изображение
-            paste_x = (new_width - img.size[0]) // 2
-            new_img.paste(img, (paste_x, 0))
-            
-            img = new_img
-            logger.info(f"  ✓ Добавлен padding: {img.size[0]}x{img.size[1]} (было {original_width}px, padding {paste_x}px с каждой стороны)")
-        
-        # Сохраняем оптимизированное изображение
-        # FIX BUG #1: Правильная обработка любого расширения
-        base_name = os.path.splitext(image_path)[0]
-        optimized_path = f"{base_name}_optimized.jpg"
-        img.save(optimized_path, 'JPEG', quality=IMAGE_SETTINGS['quality'], optimize=True)
-        
+    Async-обертка над optimize_image_for_telegram: кодирование идет в пуле (image_pool),
+    event loop и браузер продолжают работать. Метрики пишутся здесь, в основном процессе.
+    """
+    original_size = os.path.getsize(image_path) if os.path.exists(image_path) else 0
+    with metrics.span('optimize') as optimize_span:
+        optimized_path = await image_pool.run_cpu(
+            optimize_image_for_telegram, image_path,
+            skip_width_padding=skip_width_padding, crop=crop
+        )
+    
+    if optimized_path and os.path.exists(optimized_path):
         optimized_size = os.path.getsize(optimized_path)
-        logger.info(f"  ✓ Оптимизировано: {optimized_size / 1024:.1f} KB (экономия: {(1 - optimized_size/original_size)*100:.1f}%)")
-        
-        return optimized_path
-        
-    except Exception as e:
-        logger.error(f"✗ Ошибка оптимизации изображения: {e}")
-        # FIX BUG #4: Проверяем что исходник существует
-        if os.path.exists(image_path):
-            logger.info(f"  ✓ Возвращаю исходный файл: {image_path}")
-            return image_path
+        metrics.incr('bytes_raw', original_size)
+        metrics.incr('bytes_optimized', optimized_size)
+        optimize_span.set(bytes_raw=original_size, bytes_optimized=optimized_size)
+    else:
+        optimize_span.end('fail')
+    return optimized_path
+
+
+def telegram_retry_delay(response, attempt):
+    """
+    Пауза перед повтором запроса к Bot API
+    
+    Returns:
+        float: секунды (429 - retry_after из ответа, 5xx - backoff) или None если повторять нельзя
+    """
+    if response.status_code == 429:
+        retry_after = None
+        try:
+            retry_after = response.json().get('parameters', {}).get('retry_after')
+        except ValueError:
+            pass
+        if retry_after is None:
+            retry_after = response.headers.get('Retry-After', 1)
+        try:
+            return min(float(retry_after), TELEGRAM_MAX_RETRY_AFTER)
+        except (TypeError, ValueError):
+            return 1.0
+    if response.status_code >= 500:
+        return min(2 ** attempt, TELEGRAM_MAX_RETRY_AFTER)
+    return None
+
+
+def telegram_request(method, data, photo_path=None):
+    """
+    Запрос к Bot API с повторами: при 429 ждет retry_after из ответа,
+    при 5xx - короткий backoff, не больше TELEGRAM_MAX_RETRIES повторов
+    
+    Returns:
+        dict: result из ответа или None при ошибке
+    """
+    url = telegram_api_url(method)
+    for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+        if photo_path:
+            # Файл открываем заново на каждую попытку (requests дочитывает его до конца)
+            with open(photo_path, 'rb') as photo:
+                response = requests.post(url, files={'photo': photo}, data=data, timeout=30)
         else:
-            logger.error(f"  ✗ Исходный файл не существует: {image_path}")
-            return None
+            response = requests.post(url, data=data, timeout=30)
+        
+        if response.status_code == 200:
+            try:
+                return response.json().get('result') or {}
+            except ValueError:
+                return {}
+        
+        delay = telegram_retry_delay(response, attempt)
+        if delay is None or attempt == TELEGRAM_MAX_RETRIES:
+            break
+        metrics.incr('telegram_retries')
+        logger.warning(f"⚠️ Telegram {method} {response.status_code}, повтор через {delay:.1f}s "
+                       f"({attempt + 1}/{TELEGRAM_MAX_RETRIES})")
+        time.sleep(delay)
+    
+    logger.error(f"✗ Ошибка {method}: {response.status_code} - {response.text}")
+    return None
 
 
-def send_telegram_photo(photo_path, caption, parse_mode='HTML'):
-    """Отправляет фото в Telegram"""
+@metrics.timed('telegram')
+def send_telegram_photo(photo_path, caption, parse_mode='HTML', chat_id=None, return_result=False):
+    """
+    Отправляет фото в Telegram
+    
+    Args:
+        photo_path: Путь к изображению
+        caption: Подпись (HTML)
+        parse_mode: Режим разметки подписи
+        chat_id: Чат назначения (по умолчанию TELEGRAM_CHAT_ID)
+        return_result: Вернуть result ответа Telegram (message_id для editMessageCaption)
+    
+    Returns:
+        bool (или dict result / None если return_result; {} - фото отправлено, но
+        Telegram не вернул полей - отправка все равно успешна)
+    """
+    failed = None if return_result else False
     temp_compressed_file = None  # Track temporary file for cleanup
+    chat_id = chat_id or TELEGRAM_CHAT_ID
     
     try:
         # FIX BUG #2: Проверка размера файла (Telegram limit: 10 MB)
@@ -413,42 +359,40 @@ def send_telegram_photo(photo_path, caption, parse_mode='HTML'):
                 if new_size > MAX_TELEGRAM_PHOTO_SIZE:
                     logger.error(f"  ✗ Даже после сжатия файл слишком большой!")
                     os.remove(temp_compressed)  # Cleanup
-                    return False
+                    return failed
                 
                 # FIX BUG #27: Track temp file для cleanup в finally
                 temp_compressed_file = temp_compressed
                 photo_path = temp_compressed
             except Exception as e:
                 logger.error(f"  ✗ Ошибка сжатия: {e}")
-                return False
-        
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
+                return failed
         
         logger.info(f"📤 Отправка фото в Telegram...")
         logger.info(f"  Файл: {photo_path}")
         logger.info(f"  Подпись: {len(caption)} символов")
         
-        with open(photo_path, 'rb') as photo:
-            files = {'photo': photo}
-            data = {
-                'chat_id': TELEGRAM_CHAT_ID,
-                'caption': caption,
-                'parse_mode': parse_mode
-            }
-            
-            response = requests.post(url, files=files, data=data, timeout=30)
+        data = {
+            'chat_id': chat_id,
+            'caption': caption,
+            'parse_mode': parse_mode
+        }
         
-        if response.status_code == 200:
-            logger.info("✓ Фото отправлено в Telegram")
-            return True
-        else:
-            logger.error(f"✗ Ошибка отправки: {response.status_code} - {response.text}")
-            return False
+        result = telegram_request('sendPhoto', data, photo_path)
+        if result is None:
+            return failed
+        
+        logger.info("✓ Фото отправлено в Telegram")
+        if return_result:
+            if result.get('message_id') is None:
+                logger.warning("⚠️ В ответе Telegram нет message_id - подпись нельзя будет обновить")
+            return result
+        return True
             
     except Exception as e:
         logger.error(f"✗ Ошибка при отправке фото в Telegram: {e}")
         traceback.print_exc()
-        return False
+        return failed
         
     finally:
         # FIX BUG #27: Cleanup ВСЕГДА выполняется (даже при exception)
@@ -460,6 +404,25 @@ def send_telegram_photo(photo_path, caption, parse_mode='HTML'):
                 logger.warning(f"  ⚠️ Не удалось удалить временный файл: {cleanup_error}")
 
 
+@metrics.timed('telegram_edit')
+def edit_telegram_caption(message_id, caption, parse_mode='HTML', chat_id=None):
+    """Обновляет подпись уже опубликованного фото (editMessageCaption)"""
+    data = {
+        'chat_id': chat_id or TELEGRAM_CHAT_ID,
+        'message_id': message_id,
+        'caption': caption,
+        'parse_mode': parse_mode
+    }
+    try:
+        if telegram_request('editMessageCaption', data) is None:
+            return False
+        logger.info("✓ Подпись в Telegram обновлена")
+        return True
+    except Exception as e:
+        logger.error(f"✗ Ошибка обновления подписи в Telegram: {e}")
+        return False
+
+
 def init_twitter_client():
     """Инициализирует Twitter API клиент"""
     try:
@@ -493,32 +456,30 @@ def init_twitter_client():
         return None
 
 
-def send_to_twitter(title, hashtags, image_path):
-    """Отправляет твит с картинкой"""
+@metrics.timed('twitter_media')
+def upload_twitter_media(image_path):
+    """
+    Инициализирует Twitter клиент и загружает картинку (не зависит от текста твита,
+    поэтому идет параллельно с Alpha Take и отправкой в Telegram)
+    
+    Returns:
+        tuple: (twitter, media_id) - media_id None если картинка не загрузилась;
+        None если клиент не инициализирован
+    """
     try:
         if not TWITTER_ENABLED:
             logger.info("ℹ️  Twitter отключен")
-            return False
+            return None
         
         logger.info("\n🐦 ОТПРАВКА В TWITTER")
         
         twitter = init_twitter_client()
         if not twitter:
             logger.error("✗ Не удалось инициализировать Twitter клиент")
-            return False
+            return None
         
-        client = twitter["client"]
         api = twitter["api"]
         
-        # Формируем твит
-        tweet_text = f"{title}\n\n{hashtags}"
-        
-        if len(tweet_text) > 280:
-            logger.warning(f"⚠️ Твит слишком длинный ({len(tweet_text)}), сокращаю")
-            tweet_text = tweet_text[:277] + "..."
-        
-        logger.info(f"📏 Длина твита: {len(tweet_text)} символов")
-        
         # Загружаем картинку
         media_id = None
         temp_twitter_file = None  # Track temporary file for cleanup
@@ -561,31 +522,56 @@ def send_to_twitter(title, hashtags, image_path):
                 except Exception as cleanup_error:
                     logger.warning(f"  ⚠️ Не удалось удалить временный файл: {cleanup_error}")
         
-        # Публикуем твит
-        try:
-            if media_id:
-                response = client.create_tweet(text=tweet_text, media_ids=[media_id])
-            else:
-                response = client.create_tweet(text=tweet_text)
-            
-            if response and hasattr(response, 'data'):
-                tweet_id = response.data.get('id') if hasattr(response.data, 'get') else response.data.id
-                logger.info(f"✓ Твит опубликован, ID: {tweet_id}")
-                return True
-            else:
-                logger.error("✗ Получен пустой ответ от Twitter API")
-                return False
-                
-        except Exception as e:
-            logger.error(f"✗ Ошибка публикации твита: {e}")
-            return False
+        return twitter, media_id
     
     except Exception as e:
-        logger.error(f"✗ Критическая ошибка отправки в Twitter: {e}")
+        logger.error(f"✗ Критическая ошибка загрузки в Twitter: {e}")
         traceback.print_exc()
+        return None
+
+
+@metrics.timed('twitter')
+def post_tweet(twitter, title, hashtags, media_id=None):
+    """Публикует твит (картинка загружена заранее через upload_twitter_media)"""
+    # Формируем твит
+    tweet_text = f"{title}\n\n{hashtags}"
+    
+    if len(tweet_text) > 280:
+        logger.warning(f"⚠️ Твит слишком длинный ({len(tweet_text)}), сокращаю")
+        tweet_text = tweet_text[:277] + "..."
+    
+    logger.info(f"📏 Длина твита: {len(tweet_text)} символов")
+    
+    # Публикуем твит
+    try:
+        client = twitter["client"]
+        if media_id:
+            response = client.create_tweet(text=tweet_text, media_ids=[media_id])
+        else:
+            response = client.create_tweet(text=tweet_text)
+        
+        if response and hasattr(response, 'data'):
+            tweet_id = response.data.get('id') if hasattr(response.data, 'get') else response.data.id
+            logger.info(f"✓ Твит опубликован, ID: {tweet_id}")
+            return True
+        else:
+            logger.error("✗ Получен пустой ответ от Twitter API")
+            return False
+            
+    except Exception as e:
+        logger.error(f"✗ Ошибка публикации твита: {e}")
         return False
 
 
+def send_to_twitter(title, hashtags, image_path):
+    """Отправляет твит с картинкой"""
+    uploaded = upload_twitter_media(image_path)
+    if not uploaded:
+        return False
+    twitter, media_id = uploaded
+    return post_tweet(twitter, title, hashtags, media_id)
+
+
 async def accept_cookies(page):
     """Принимает cookies если баннер появился - СПЕЦИАЛЬНО ДЛЯ COINMARKETCAP"""
     try:
@@ -656,230 +642,318 @@ async def accept_cookies(page):
         return False
 
 
-async def take_screenshot(page, source_config, source_key):
-    """Делает скриншот согласно конфигурации источника"""
-    screenshot_path = None  # CRITICAL: Initialize before try
-    optimized_path = None   # CRITICAL: Initialize before try
-    success = False         # Track if operation succeeded
+async def wait_for_content_ready(page, spec, record=True):
+    """
+    Ждет готовности контента в пределах адаптивного бюджета
     
-    try:
-        url = source_config['url']
-        logger.info(f"\n📸 СКРИНШОТ: {source_config['name']}")
-        logger.info(f"  URL: {url}")
-        
-        # Загружаем страницу
-        await page.goto(url, wait_until='domcontentloaded', timeout=SCREENSHOT_SETTINGS['wait_timeout'])
-        logger.info("✓ Страница загружена")
-        
-        # Cookies и ожидание загрузки
-        logger.info("🍪 Обработка cookies...")
-        await accept_cookies(page)
-        
-        # Ожидание загрузки контента
-        base_wait = 5
-        extra_wait = source_config.get('extra_wait', 0)
-        total_wait = base_wait + extra_wait
+    Бюджет = p95 прошлых замеров + запас, но не больше wait_after_load + extra_wait.
+    Если контент стабилизировался раньше - идем дальше сразу.
+    
+    Args:
+        record: сохранять ли замер в WAIT_BUDGETS. Только для попыток со свежей
+            навигации - при повторе readiness страница уже прогрета, и замер
+            занизил бы бюджет.
+    
+    Returns:
+        str: 'ready' - готовность подтверждена,
+             'unstable' - элемент есть, но контент не успокоился за бюджет,
+             'missing' - элемент wait_for так и не появился
+    """
+    source_key = spec.key
+    base_wait = SCREENSHOT_SETTINGS['wait_after_load']
+    extra_wait = spec.extra_wait
+    total_wait = base_wait + extra_wait
+    wait_for = spec.wait_for
+    
+    if not WAIT_BUDGETS.enabled or not spec.adaptive_wait:
+        # Старое поведение: фиксированная пауза + ожидание элемента
         logger.info(f"⏳ Ожидание загрузки контента ({total_wait} секунд{' (+ ' + str(extra_wait) + ' extra)' if extra_wait > 0 else ''})...")
         await asyncio.sleep(total_wait)
-        
-        # Ждем конкретный элемент если указан
-        wait_for = source_config.get('wait_for')
         if wait_for:
             try:
-                await page.wait_for_selector(wait_for, timeout=15000)
+                await page.wait_for_selector(wait_for, timeout=ADAPTIVE_WAIT_SETTINGS['selector_timeout'] * 1000)
                 logger.info(f"✓ Элемент найден: {wait_for}")
-            except Exception as e:
-                logger.warning(f"⚠️ Элемент не найден за 15 сек: {wait_for}")
-        
-        # Специальная обработка для heatmap (coin360.com)
-        if source_key == "heatmap":
-            try:
-                await asyncio.sleep(3)  # Дополнительная задержка для рендеринга canvas
-                logger.info("✓ Heatmap: дополнительная задержка 3 сек для загрузки canvas")
-            except Exception as e:
-                logger.warning(f"⚠️ Не удалось обработать heatmap: {e}")
-        
-        # Делаем скриншот
-        timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
-        screenshot_path = os.path.join(SCREENSHOTS_DIR, f"{source_key}_{timestamp}.png")
-        
-        # Закрываем модальное окно если требуется
-        close_modal = source_config.get('close_modal', False)
-        if close_modal:
-            try:
-                # Метод 1: Нажать Escape
-                await page.keyboard.press('Escape')
-                await asyncio.sleep(0.5)
-                logger.info("  ✓ Нажат Escape для закрытия модалки")
-                
-                # Метод 2: Клик по кнопкам закрытия
-                closed = await page.evaluate("""() => {
-                    // Попытка закрыть модальное окно разными способами
-                    const closeSelectors = [
-                        'button:has-text("Maybe Later")',  // Специально для COIN360
-                        'button:has-text("Later")',
-                        '[aria-label="Close"]',
-                        '[data-dismiss="modal"]',
-                        '.close',
-                        '.modal-close',
-                        'button[class*="close"]',
-                        '[class*="closeButton"]',
-                        'button[type="button"]',  // Любые кнопки
-                        'svg[class*="close"]',    // SVG иконки закрытия
-                        '[role="button"][aria-label*="close" i]'
-                    ];
-                    
-                    for (const sel of closeSelectors) {
-                        const btns = document.querySelectorAll(sel);
-                        for (const btn of btns) {
-                            // Проверяем что это похоже на кнопку закрытия
-                            const text = btn.textContent?.toLowerCase() || '';
-                            if (text.includes('close') || text.includes('later') || text.includes('×') || text.includes('✕') || !text) {
-                                btn.click();
-                                return true;
-                            }
-                        }
-                    }
-                    return false;
-                }""")
-                await asyncio.sleep(0.5)
-                
-                # Метод 3: Клик по backdrop (темный фон)
-                await page.evaluate("""() => {
-                    const backdrops = document.querySelectorAll('[class*="backdrop"], [class*="overlay"], [class*="modal-backdrop"]');
-                    backdrops.forEach(el => el.click());
-                }""")
-                await asyncio.sleep(0.5)
-                
-                # Метод 4: Принудительное скрытие всех модальных элементов
-                await page.evaluate("""() => {
-                    // Ищем все элементы с position: fixed и высоким z-index
-                    const allElements = document.querySelectorAll('*');
-                    allElements.forEach(el => {
-                        const style = window.getComputedStyle(el);
-                        const zIndex = parseInt(style.zIndex);
-                        const position = style.position;
-                        
-                        // Если fixed/absolute с высоким z-index - скрываем
-                        if ((position === 'fixed' || position === 'absolute') && zIndex > 1000) {
-                            el.style.display = 'none';
-                        }
-                    });
-                    
-                    // Также скрываем все явные модалки
-                    const modals = document.querySelectorAll('[class*="modal"], [class*="Modal"], [class*="dialog"], [class*="Dialog"], [class*="popup"], [class*="Popup"]');
-                    modals.forEach(el => {
-                        el.style.display = 'none';
-                        el.style.visibility = 'hidden';
-                        el.style.opacity = '0';
-                    });
-                }""")
-                await asyncio.sleep(1)
-                
-                logger.info("  ✓ Модальное окно закрыто (4 метода)")
-            except Exception as e:
-                logger.warning(f"  ⚠️ Не удалось закрыть модальное окно: {e}")
-        
-        # Скрываем ненужные элементы если указано
-        hide_elements = source_config.get('hide_elements')
-        if hide_elements:
-            try:
-                await page.evaluate("""(selector) => {
-                    const elements = document.querySelectorAll(selector);
-                    elements.forEach(el => {
-                        el.style.display = 'none';
-                        el.style.visibility = 'hidden';
-                    });
-                }""", hide_elements)
-                await asyncio.sleep(0.5)
-                logger.info(f"  ✓ Скрыты элементы: {hide_elements}")
-            except Exception as e:
-                logger.warning(f"  ⚠️ Не удалось скрыть элементы: {e}")
-        
-        selector = source_config.get('selector')
-        element_padding = source_config.get('element_padding', 0)  # Может быть int или dict
-        scale = source_config.get('scale', 1.0)  # Масштаб элемента (CSS zoom)
-        
-        # Нормализуем element_padding в dict
-        if isinstance(element_padding, (int, float)):
-            padding_dict = {'top': element_padding, 'right': element_padding, 'bottom': element_padding, 'left': element_padding}
-        elif isinstance(element_padding, dict):
-            padding_dict = {
-                'top': element_padding.get('top', 0),
-                'right': element_padding.get('right', 0),
-                'bottom': element_padding.get('bottom', 0),
-                'left': element_padding.get('left', 0)
+            except Exception:
+                logger.warning(f"⚠️ Элемент не найден за {ADAPTIVE_WAIT_SETTINGS['selector_timeout']} сек: {wait_for}")
+                return 'missing'
+        return 'ready'
+    
+    budget = WAIT_BUDGETS.wait_budget(source_key, total_wait)
+    selector_timeout = WAIT_BUDGETS.selector_timeout(source_key)
+    logger.info(f"⏳ Ожидание готовности контента (бюджет {budget:.1f}s из {total_wait}s, селектор {selector_timeout:.1f}s)...")
+    
+    started = time.perf_counter()
+    status = 'ready'
+    
+    if wait_for:
+        try:
+            await page.wait_for_selector(wait_for, timeout=selector_timeout * 1000)
+            logger.info(f"✓ Элемент найден: {wait_for} ({time.perf_counter() - started:.1f}s)")
+        except Exception:
+            logger.warning(f"⚠️ Элемент не найден за {selector_timeout:.1f} сек: {wait_for}")
+            status = 'missing'
+    
+    if status == 'ready':
+        # Проверяем стабильность самого целевого элемента (xpath/text не поддерживаются querySelector)
+        probe_selector = spec.probe_selector
+        remaining = max(budget - (time.perf_counter() - started), 0.5)
+        try:
+            await page.wait_for_function(
+                CONTENT_STABLE_JS,
+                arg={"selector": probe_selector, "stableMs": ADAPTIVE_WAIT_SETTINGS['stable_ms']},
+                polling=250,
+                timeout=remaining * 1000
+            )
+        except Exception:
+            status = 'unstable'
+    
+    elapsed = time.perf_counter() - started
+    if status == 'ready':
+        logger.info(f"✓ Контент готов за {elapsed:.1f}s")
+        if record:
+            WAIT_BUDGETS.record(source_key, elapsed)
+    else:
+        # Не дождались - считаем худшим случаем, чтобы бюджет вырос обратно до потолка
+        logger.warning(f"⚠️ Готовность не подтверждена за {elapsed:.1f}s, продолжаем")
+        if record:
+            WAIT_BUDGETS.record(source_key, total_wait)
+    return status
+
+
+class CaptureError(Exception):
+    """Ошибка захвата с указанием этапа (для классификации retry)"""
+    
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+
+class CaptureState:
+    """
+    Состояние захвата между попытками одного источника
+    
+    Хранит этап, с которого надо продолжить, и сырой PNG (для повтора
+    только post-processing без повторного скриншота)
+    """
+    
+    def __init__(self):
+        self.resume_from = 'navigation'
+        self.failed_stage = None
+        self.raw_path = None
+        self.final_attempt = True  # Последняя попытка - разрешены деградации (скриншот viewport)
+        self.fallback_viewport = False
+    
+    def should_run(self, stage):
+        return CAPTURE_STAGES.index(stage) >= CAPTURE_STAGES.index(self.resume_from)
+
+
+async def prepare_page(page, spec):
+    """Закрывает модалки и скрывает лишние элементы перед скриншотом"""
+    # Закрываем модальное окно если требуется
+    if spec.close_modal:
+        try:
+            # Метод 1: Нажать Escape
+            await page.keyboard.press('Escape')
+            await asyncio.sleep(0.5)
+            logger.info("  ✓ Нажат Escape для закрытия модалки")
+            
+            # Метод 2: Клик по кнопкам закрытия
+            closed = await page.evaluate(CLOSE_MODAL_BUTTONS_JS)
+            await asyncio.sleep(0.5)
+            
+            # Метод 3: Клик по backdrop (темный фон)
+            await page.evaluate(CLOSE_MODAL_BACKDROP_JS)
+            await asyncio.sleep(0.5)
+            
+            # Метод 4: Принудительное скрытие всех модальных элементов
+            await page.evaluate(CLOSE_MODAL_HIDE_JS)
+            await asyncio.sleep(1)
+            
+            logger.info("  ✓ Модальное окно закрыто (4 метода)")
+        except Exception as e:
+            logger.warning(f"  ⚠️ Не удалось закрыть модальное окно: {e}")
+    
+    # Скрываем ненужные элементы если указано (скрипт собран при компиляции конфига)
+    if spec.hide_script:
+        try:
+            await page.evaluate(spec.hide_script)
+            await asyncio.sleep(0.5)
+            logger.info(f"  ✓ Скрыты элементы: {spec.hide_elements}")
+        except Exception as e:
+            logger.warning(f"  ⚠️ Не удалось скрыть элементы: {e}")
+
+
+async def capture_element(page, element, spec, screenshot_path):
+    """Скриншот найденного элемента с учетом scale и element_padding"""
+    scale = spec.scale  # Масштаб элемента (CSS zoom)
+    padding = spec.padding  # Insets (int или dict нормализованы при компиляции)
+    
+    # Применяем масштабирование если нужно
+    if spec.scale_script:
+        try:
+            await page.evaluate(spec.scale_script)
+            await asyncio.sleep(0.5)  # Даем время на применение стилей
+            logger.info(f"  ✓ Применен масштаб {scale}x")
+        except Exception as e:
+            logger.warning(f"  ⚠️ Не удалось применить масштаб: {e}")
+    
+    if padding:
+        # Получаем bounding box элемента
+        box = await element.bounding_box()
+        if box:
+            # Учитываем масштаб при расчете размеров
+            scaled_width = box['width'] * scale
+            scaled_height = box['height'] * scale
+            
+            # Добавляем padding с учетом разных сторон
+            clip = {
+                'x': max(0, box['x'] - padding.left),
+                'y': max(0, box['y'] - padding.top),
+                'width': min(page.viewport_size['width'], scaled_width + padding.left + padding.right),
+                'height': min(page.viewport_size['height'], scaled_height + padding.top + padding.bottom)
             }
-        else:
-            padding_dict = {'top': 0, 'right': 0, 'bottom': 0, 'left': 0}
+            await page.screenshot(path=screenshot_path, clip=clip)
+            logger.info(f"✓ Скриншот с padding (T:{padding.top} R:{padding.right} B:{padding.bottom} L:{padding.left}) и scale {scale}x")
+            return
+    
+    # Обычный скриншот элемента (без padding или нет bounding box)
+    await element.screenshot(path=screenshot_path)
+    logger.info(f"✓ Скриншот элемента сохранен: {screenshot_path}")
+
+
+@metrics.timed('take_screenshot')
+async def take_screenshot(page, spec, state=None):
+    """
+    Делает скриншот согласно конфигурации источника
+    
+    Захват идет по этапам (CAPTURE_STAGES). При ошибке этап записывается
+    в state.failed_stage, а следующая попытка продолжает с state.resume_from
+    на уже загруженной странице вместо полного page.goto.
+    
+    Args:
+        page: Playwright страница
+        spec: SourceSpec источника (SOURCE_SPECS)
+        state: CaptureState между попытками (None - одна самостоятельная попытка)
+    """
+    state = state or CaptureState()
+    state.failed_stage = None
+    stage = state.resume_from
+    if state.resume_from != 'postprocess' and state.raw_path:
+        # Повтор эскалировал выше post-processing - старый сырой PNG больше не нужен
+        if os.path.exists(state.raw_path):
+            os.remove(state.raw_path)
+        state.raw_path = None
+    screenshot_path = state.raw_path  # Сырой PNG сохраняется только для повтора post-processing
+    optimized_path = None   # CRITICAL: Initialize before try
+    success = False         # Track if operation succeeded
+    
+    try:
+        source_key = spec.key
+        url = spec.url
+        logger.info(f"\n📸 СКРИНШОТ: {spec.name}")
+        if state.resume_from != 'navigation':
+            logger.info(f"  ↪️  Продолжаем с этапа: {state.resume_from}")
+        
+        if state.should_run('navigation'):
+            stage = 'navigation'
+            logger.info(f"  URL: {url}")
+            
+            # Загружаем страницу
+            with metrics.span('navigate'):
+                await page.goto(url, wait_until='domcontentloaded', timeout=SCREENSHOT_SETTINGS['wait_timeout'])
+            logger.info("✓ Страница загружена")
+            
+            # Cookies и ожидание загрузки
+            logger.info("🍪 Обработка cookies...")
+            with metrics.span('cookies'):
+                await accept_cookies(page)
         
-        if selector:
-            # Скриншот конкретного элемента
-            try:
-                element = await page.query_selector(selector)
+        if state.should_run('readiness'):
+            stage = 'readiness'
+            
+            # Ожидание загрузки контента (замер в бюджет - только после свежего page.goto)
+            with metrics.span('wait') as wait_span:
+                readiness = await wait_for_content_ready(page, spec, record=state.resume_from == 'navigation')
+                wait_span.set(ready=readiness)
+            
+            if readiness == 'missing' and not state.final_attempt:
+                raise CaptureError('readiness', f"Элемент готовности не появился: {spec.wait_for}")
+            
+            # Специальная обработка для heatmap (coin360.com)
+            if source_key == "heatmap":
+                try:
+                    await asyncio.sleep(3)  # Дополнительная задержка для рендеринга canvas
+                    logger.info("✓ Heatmap: дополнительная задержка 3 сек для загрузки canvas")
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось обработать heatmap: {e}")
+            
+            await prepare_page(page, spec)
+        
+        if state.should_run('selector'):
+            state.fallback_viewport = False
+            
+            # Делаем скриншот
+            timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+            screenshot_path = os.path.join(SCREENSHOTS_DIR, f"{source_key}_{timestamp}.png")
+            
+            stage = 'selector'
+            selector = bool(spec.strategies)
+            element = None
+            if selector:
+                # Все стратегии проверяются за один evaluate, прошлый победитель - первым
+                with metrics.span('selector') as selector_span:
+                    element, strategy = await resolve_strategies(page, source_key, spec.strategies, SELECTOR_CACHE)
+                    selector_span.set(strategy=strategy['kind'] if strategy else None)
+            
+            if selector and not element and not state.final_attempt:
+                raise CaptureError('selector', f"Ни одна стратегия селектора не сработала ({source_key})")
+            
+            stage = 'capture'
+            with metrics.span('capture'):
                 if element:
-                    # Применяем масштабирование если нужно
-                    if scale != 1.0:
-                        try:
-                            await page.evaluate("""(args) => {
-                                const el = document.querySelector(args.selector);
-                                if (el) {
-                                    el.style.transform = 'scale(' + args.scale + ')';
-                                    el.style.transformOrigin = 'top left';
-                                }
-                            }""", {"selector": selector, "scale": scale})
-                            await asyncio.sleep(0.5)  # Даем время на применение стилей
-                            logger.info(f"  ✓ Применен масштаб {scale}x")
-                        except Exception as e:
-                            logger.warning(f"  ⚠️ Не удалось применить масштаб: {e}")
-                    
-                    has_padding = any(v > 0 for v in padding_dict.values())
-                    
-                    if has_padding:
-                        # Получаем bounding box элемента
-                        box = await element.bounding_box()
-                        if box:
-                            # Учитываем масштаб при расчете размеров
-                            scaled_width = box['width'] * scale
-                            scaled_height = box['height'] * scale
-                            
-                            # Добавляем padding с учетом разных сторон
-                            clip = {
-                                'x': max(0, box['x'] - padding_dict['left']),
-                                'y': max(0, box['y'] - padding_dict['top']),
-                                'width': min(page.viewport_size['width'], scaled_width + padding_dict['left'] + padding_dict['right']),
-                                'height': min(page.viewport_size['height'], scaled_height + padding_dict['top'] + padding_dict['bottom'])
-                            }
-                            await page.screenshot(path=screenshot_path, clip=clip)
-                            logger.info(f"✓ Скриншот с padding (T:{padding_dict['top']} R:{padding_dict['right']} B:{padding_dict['bottom']} L:{padding_dict['left']}) и scale {scale}x")
-                        else:
-                            # Fallback: обычный скриншот элемента
-                            await element.screenshot(path=screenshot_path)
-                            logger.info(f"✓ Скриншот элемента сохранен: {screenshot_path}")
-                    else:
-                        # Обычный скриншот элемента без padding
-                        await element.screenshot(path=screenshot_path)
-                        logger.info(f"✓ Скриншот элемента сохранен: {screenshot_path}")
-                else:
+                    # Скриншот конкретного элемента
+                    try:
+                        await capture_element(page, element, spec, screenshot_path)
+                    except Exception as e:
+                        # Элемент отсоединился/скрылся между поиском и скриншотом (частое на CMC)
+                        if not state.final_attempt:
+                            raise CaptureError('capture', f"Скриншот элемента не удался: {e}") from e
+                        logger.warning(f"⚠️ Скриншот элемента не удался ({e}), делаю скриншот всей страницы")
+                        await page.screenshot(path=screenshot_path, full_page=False)
+                        state.fallback_viewport = True
+                elif selector:
                     logger.warning("⚠️ Элемент не найден, делаю скриншот всей страницы")
                     await page.screenshot(path=screenshot_path, full_page=False)
-            except Exception as e:
-                logger.warning(f"⚠️ Ошибка скриншота элемента: {e}, делаю скриншот страницы")
-                await page.screenshot(path=screenshot_path, full_page=False)
-        else:
-            # Скриншот всей видимой области
-            await page.screenshot(path=screenshot_path, full_page=SCREENSHOT_SETTINGS['full_page'])
-            logger.info(f"✓ Скриншот страницы сохранен: {screenshot_path}")
+                    state.fallback_viewport = True
+                else:
+                    # Скриншот всей видимой области
+                    await page.screenshot(path=screenshot_path, full_page=SCREENSHOT_SETTINGS['full_page'])
+                    logger.info(f"✓ Скриншот страницы сохранен: {screenshot_path}")
+        
+        stage = 'postprocess'
+        if not screenshot_path or not os.path.exists(screenshot_path):
+            raise CaptureError('capture', "Нет сырого скриншота для обработки")
         
         # Оптимизируем для Telegram
-        skip_width_padding = source_config.get('skip_width_padding', False)
-        crop = source_config.get('crop', None)  # ✅ НОВОЕ: Получаем параметры обрезки
-        optimized_path = optimize_image_for_telegram(screenshot_path, skip_width_padding=skip_width_padding, crop=crop)
+        crop = spec.crop.as_dict() if spec.crop else None
+        optimized_path = await optimize_image_async(screenshot_path, skip_width_padding=spec.skip_width_padding, crop=crop)
         
         # FIX BUG #22: Проверяем что оптимизация успешна
         if not optimized_path:
-            logger.error("✗ Не удалось оптимизировать изображение!")
-            return None
+            raise CaptureError('postprocess', "Не удалось оптимизировать изображение!")
+        
+        # 🔍 Проверка качества до платного AI-вызова и публикации
+        stage = 'quality'
+        with metrics.span('quality') as quality_span:
+            verdict = await image_pool.run_io(
+                assess_capture, optimized_path, source_key,
+                overrides=spec.quality_gate,
+                fallback_viewport=state.fallback_viewport
+            )
+            quality_span.set(**verdict.metrics)
+        if not verdict:
+            raise CaptureError('quality', f"Кадр отклонен проверкой качества: {verdict.describe()}")
+        logger.info(f"  ✓ Качество кадра: OK {verdict.metrics}")
         
         # Удаляем оригинальный PNG только если оптимизация создала новый файл
         # (если optimize вернул fallback, то optimized_path == screenshot_path)
@@ -890,30 +964,43 @@ async def take_screenshot(page, source_config, source_key):
             except Exception as e:
                 logger.warning(f"  ⚠️ Не удалось удалить оригинал: {e}")
         
+        ARTIFACTS.add(optimized_path, source_key)
         success = True  # Mark as successful before return
+        state.raw_path = None
         return {
             'source_key': source_key,
             'screenshot_path': optimized_path,
             'timestamp': datetime.now(timezone.utc).isoformat(),
-            'source_name': source_config['name']
+            'source_name': spec.name,
+            'fallback_viewport': state.fallback_viewport
         }
+    
+    except CaptureError as e:
+        state.failed_stage = e.stage
+        logger.error(f"✗ Ошибка на этапе {e.stage}: {e}")
+        return None
         
     except Exception as e:
-        logger.error(f"✗ Ошибка создания скриншота: {e}")
+        state.failed_stage = stage
+        logger.error(f"✗ Ошибка создания скриншота (этап {stage}): {e}")
         traceback.print_exc()
         return None
     
     finally:
         # CRITICAL: Cleanup ONLY on failure (when success=False)
         if not success:
-            if screenshot_path and os.path.exists(screenshot_path):
+            # Сырой PNG оставляем если следующая попытка повторит только post-processing
+            keep_raw = state.failed_stage == 'postprocess' and not state.final_attempt
+            state.raw_path = screenshot_path if keep_raw else None
+            
+            if not keep_raw and screenshot_path and os.path.exists(screenshot_path):
                 try:
                     os.remove(screenshot_path)
                     logger.info(f"🗑️  Cleanup при ошибке: удален screenshot")
                 except Exception as cleanup_error:
                     logger.warning(f"⚠️ Cleanup warning: {cleanup_error}")
             
-            if optimized_path and os.path.exists(optimized_path):
+            if optimized_path and optimized_path != screenshot_path and os.path.exists(optimized_path):
                 try:
                     os.remove(optimized_path)
                     logger.info(f"🗑️  Cleanup при ошибке: удален optimized")
@@ -928,6 +1015,39 @@ def get_source_by_schedule():
     Returns:
         str: Ключ источника или None если не время публикации
     """
+    slot = get_schedule_slot()
+    return slot[2] if slot else None
+
+
+def published_in_slot(publications, job):
+    """
+    Опубликован ли слот задачи (любым из его источников) с начала окна
+    
+    В режиме staged cron стартует и в начале окна, и позже внутри него - поздний тик
+    не должен публиковать слот с publish_at_msk второй раз (в том числе другим
+    источником random-слота).
+    """
+    slot_config = POST_SCHEDULE.get(job.slot)
+    if not slot_config or slot_config.get('publish_at_msk') is None or not job.publish_at:
+        return False
+    window_start = job.publish_at - (slot_config['publish_at_msk'] - slot_config['time_range_msk'][0]) * 3600
+    for slot_source in slot_config['sources']:
+        try:
+            published_ts = datetime.fromisoformat(publications.get_last_published(slot_source)).timestamp()
+        except (ValueError, TypeError):
+            continue
+        if published_ts >= window_start:
+            return True
+    return False
+
+
+def get_schedule_slot():
+    """
+    Определяет слот расписания MSK и источник для него
+    
+    Returns:
+        tuple: (имя слота, конфиг слота, ключ источника) или None если не время публикации
+    """
     # MSK = UTC+3
     now_utc = datetime.now(timezone.utc)
     now_msk = now_utc + timedelta(hours=3)
@@ -956,13 +1076,13 @@ def get_source_by_schedule():
             if selection_type == 'random':
                 source_key = random.choice(sources)
                 logger.info(f"🎲 Случайный выбор из {len(sources)} источников: {source_key}")
-                return source_key
+                return slot_name, slot_config, source_key
             
             # Фиксированный источник
             elif selection_type == 'fixed':
                 source_key = sources[0]
                 logger.info(f"📌 Фиксированный источник: {source_key}")
-                return source_key
+                return slot_name, slot_config, source_key
             
             # Условная логика (ETF Anomaly)
             elif selection_type == 'conditional':
@@ -1000,9 +1120,457 @@ async def simulate_human_behavior(page):
     await page.mouse.move(random.randint(100, 300), random.randint(100, 300))
 
 
-async def main_parser():
-    """Главная функция парсера со скриншотами"""
-    browser = None  # CRITICAL: Initialize before try block
+async def capture_source(spec):
+    """
+    Браузер + захват скриншота с повторными попытками
+    Браузер закрывается сразу после захвата (AI и публикация идут уже без него)
+    
+    Returns:
+        dict: результат take_screenshot
+    """
+    source_key = spec.key
+    playwright = None
+    session = None  # CRITICAL: Initialize before try block
+    
+    try:
+        # Playwright останавливается в finally - после закрытия браузера (профиль успевает сбросить кэш)
+        playwright = await async_playwright().start()
+        # Общий браузер (BROWSER_SERVER_URL) -> постоянный профиль -> обычный запуск
+        with metrics.span('browser_start') as browser_span:
+            session = await open_session(playwright, spec.user_agent, spec.viewport)
+            browser_span.set(mode=session.mode)
+        metrics.set_value('browser', session.mode)
+        context = session.context
+
+        # ✅ Удаляем webdriver флаги
+        page = await session.new_page()
+        cache_stats = await watch_cache(context, page) if session.persistent else None
+        
+        # ✅ Stealth mode если включен
+        if spec.stealth_mode:
+            await page.add_init_script("""
+                // Удаляем webdriver
+                Object.defineProperty(navigator, 'webdriver', {
+                    get: () => undefined
+                });
+                
+                // Скрываем automation
+                Object.defineProperty(navigator, 'plugins', {
+                    get: () => [1, 2, 3, 4, 5]
+                });
+                
+                Object.defineProperty(navigator, 'languages', {
+                    get: () => ['en-US', 'en']
+                });
+                
+                // Chrome runtime
+                window.chrome = {
+                    runtime: {}
+                };
+            """)
+        else:
+            await page.add_init_script("""
+                Object.defineProperty(navigator, 'webdriver', {
+                    get: () => undefined
+                });
+            """)
+        
+        # 🎥 Trace пишется только для неудачных/медленных попыток (PLAYWRIGHT_TRACE)
+        tracer = profiling.AttemptTracer(context)
+        await tracer.start()
+        
+        # Делаем скриншот с повторными попытками
+        # Повтор продолжает с упавшего этапа на уже загруженной странице
+        result = None
+        state = CaptureState()
+        previous_failure = None
+        for retry in range(MAX_RETRIES + 1):
+            state.final_attempt = retry == MAX_RETRIES
+            if retry > 0:
+                failed_stage = state.failed_stage or 'navigation'
+                resume_from, delay = RETRY_POLICY[failed_stage]
+                # Тот же этап упал дважды подряд - страница, вероятно, сломана: перезагружаем
+                if failed_stage == previous_failure:
+                    resume_from, delay = RETRY_POLICY['navigation']
+                previous_failure = failed_stage
+                state.resume_from = resume_from
+                
+                logger.info(f"\n🔄 Повторная попытка {retry}/{MAX_RETRIES} (упал этап: {failed_stage}, продолжаем с: {resume_from})")
+                metrics.incr('retries')
+                metrics.incr(f'failures_{failed_stage}')
+                await asyncio.sleep(delay)
+            
+            await tracer.begin_attempt()
+            result = await take_screenshot(page, spec, state)
+            await tracer.end_attempt(source_key, retry, bool(result))
+            
+            if result:
+                break
+        
+        await tracer.stop()
+        
+        if cache_stats:
+            metrics.incr('http_requests', cache_stats.requests)
+            metrics.incr('http_cache_hits', cache_stats.cache_hits)
+            logger.info(f"💾 HTTP-кэш профиля: {cache_stats.cache_hits}/{cache_stats.requests} запросов ({cache_stats.hit_rate:.0%})")
+        
+        if not result:
+            raise Exception(f"Не удалось создать скриншот после {MAX_RETRIES + 1} попыток")
+        return result
+    
+    finally:
+        # CRITICAL: Guaranteed browser cleanup
+        if session:
+            await session.close()
+        if playwright:
+            try:
+                await playwright.stop()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка остановки Playwright: {e}")
+
+
+async def render_native(spec, values=None):
+    """
+    Картинка источника без браузера (native_render)
+    
+    Returns:
+        str: путь к JPEG или None при ошибке
+    """
+    native = spec.native_render
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+    output_path = os.path.join(SCREENSHOTS_DIR, f"{spec.key}_{timestamp}_native.jpg")
+    logger.info(f"\n🎨 ЛОКАЛЬНАЯ ОТРИСОВКА: {native.renderer}")
+    try:
+        module_name, func_name = NATIVE_RENDERERS[native.renderer]
+        renderer = getattr(importlib.import_module(module_name), func_name)
+        with metrics.span('native_render', renderer=native.renderer):
+            await asyncio.to_thread(renderer, spec.key, native.options, output_path, values)
+    except Exception as e:
+        logger.warning(f"⚠️ Локальная отрисовка не удалась: {e}")
+        metrics.incr('native_render_failures')
+        return None
+    ARTIFACTS.add(output_path, spec.key)
+    logger.info(f"✓ Отрисовано: {output_path} ({os.path.getsize(output_path) / 1024:.1f} KB)")
+    return output_path
+
+
+async def capture_or_render(spec, values=None):
+    """
+    Скриншот или локальная отрисовка по native_render.mode:
+    prefer - сначала локально, браузер если не вышло; fallback - браузер, локально если он упал
+    
+    Returns:
+        dict: {"screenshot_path": ...} как у take_screenshot
+    """
+    native = spec.native_render if NATIVE_RENDER_ENABLED else None
+    if native and native.mode == 'prefer':
+        path = await render_native(spec, values)
+        if path:
+            metrics.set_value('capture', 'native')
+            return {'screenshot_path': path}
+        logger.info("  ↪️  Переход на скриншот в браузере")
+    
+    try:
+        result = await capture_source(spec)
+    except Exception as e:
+        if not native or native.mode != 'fallback':
+            raise
+        logger.warning(f"⚠️ Скриншот не удался ({e}), переход на локальную отрисовку")
+        path = await render_native(spec, values)
+        if not path:
+            raise
+        metrics.set_value('capture', 'native')
+        return {'screenshot_path': path}
+    
+    metrics.set_value('capture', 'browser')
+    return result
+
+
+def build_caption(title, hashtags, ai_result=None):
+    """Caption для Telegram: заголовок, Alpha Take (если есть), хештеги - не длиннее 1024"""
+    # FIX ISSUE #26: HTML escape для безопасности
+    caption = add_alpha_take_to_caption(html.escape(title), html.escape(hashtags), ai_result)
+    
+    # FIX ISSUE #10: Валидация длины caption (Telegram limit: 1024)
+    if len(caption) > 1024:
+        logger.warning(f"⚠️ Caption слишком длинный ({len(caption)} символов), обрезаю")
+        caption = caption[:1020] + "..."
+    return caption
+
+
+async def prepare_post(spec, with_ai=True, values=None):
+    """
+    Фаза 1: скриншот + Alpha Take + caption
+    
+    Args:
+        with_ai: False - без Alpha Take (его запрашивает publish_post параллельно с публикацией)
+        values: Значения из probe (для native_render gauge/card без собственного url)
+    
+    Returns:
+        dict: пост, готовый к публикации (сериализуется в очередь готовых постов)
+    """
+    if spec.key == DIGEST_KEY:
+        return await prepare_digest(spec)
+    
+    source_key = spec.key
+    result = await capture_or_render(spec, values)
+    
+    # Формируем caption для Telegram
+    title = spec.telegram_title
+    hashtags = spec.telegram_hashtags
+    
+    # 🤖 ALPHA TAKE от OpenAI
+    ai_result = None
+    skip_ai = spec.skip_ai
+    if OPENAI_ENABLED and not skip_ai and not with_ai:
+        logger.info("  ℹ️  Alpha Take запрашивается параллельно с публикацией")
+    elif OPENAI_ENABLED and not skip_ai:
+        logger.info("\n🤖 ГЕНЕРАЦИЯ ALPHA TAKE")
+        ai_result = await get_ai_comment_async(source_key, result['screenshot_path'])
+        if ai_result:
+            logger.info("  ✓ Alpha Take получен")
+        else:
+            logger.info("  ⚠️ Alpha Take не получен")
+    else:
+        if skip_ai:
+            logger.info("  ℹ️  AI отключен для этого источника (skip_ai=True)")
+        else:
+            logger.info("  ℹ️  OpenAI отключен")
+    
+    # Формируем финальный caption
+    caption = build_caption(title, hashtags, ai_result)
+    
+    return {
+        'source_key': source_key,
+        'screenshot_path': result['screenshot_path'],
+        'caption': caption,
+        'title': title,
+        'hashtags': hashtags,
+        'ai': bool(ai_result),
+        'captured_ts': time.time()
+    }
+
+
+async def prepare_digest(spec):
+    """
+    Фаза 1 для дайджеста: скриншоты источников spec.sources -> одна картинка-сетка
+    Неудачный источник пропускается, меньше spec.min_tiles плиток - ошибка
+    
+    Returns:
+        dict: пост как у prepare_post
+    """
+    logger.info(f"\n🧭 ДАЙДЖЕСТ: {', '.join(spec.sources)}")
+    tiles = []
+    # Источники снимаются по очереди: несколько Chromium одновременно раннер не потянет
+    for source_key in spec.sources:
+        try:
+            result = await capture_or_render(SOURCE_SPECS[source_key])
+            tiles.append((spec.labels[source_key], result['screenshot_path']))
+        except Exception as e:
+            logger.warning(f"⚠️ Дайджест: {source_key} пропущен ({e})")
+            metrics.incr('digest_failed_tiles')
+    
+    if len(tiles) < spec.min_tiles:
+        raise Exception(f"Дайджест: получено {len(tiles)} из {len(spec.sources)} скриншотов (минимум {spec.min_tiles})")
+    
+    import digest_image  # numpy нужен только для дайджеста
+    
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+    digest_path = os.path.join(SCREENSHOTS_DIR, f"{DIGEST_KEY}_{timestamp}.jpg")
+    with metrics.span('digest', tiles=len(tiles)):
+        await image_pool.run_cpu(digest_image.compose_digest, tiles, spec.layout(), digest_path)
+    ARTIFACTS.add(digest_path, DIGEST_KEY)
+    logger.info(f"✓ Дайджест собран: {len(tiles)} плиток, {os.path.getsize(digest_path) / 1024:.1f} KB")
+    
+    # Плитки больше не нужны - публикуется только сетка
+    for _, tile_path in tiles:
+        ARTIFACTS.remove(tile_path)
+    
+    return {
+        'source_key': DIGEST_KEY,
+        'screenshot_path': digest_path,
+        'caption': build_caption(spec.telegram_title, spec.telegram_hashtags),
+        'title': spec.telegram_title,
+        'hashtags': spec.telegram_hashtags,
+        'ai': False,
+        'captured_ts': time.time()
+    }
+
+
+async def stage_post(spec, queue, job, values=None):
+    """
+    Capture-ahead: пост готовится заранее (или берется из очереди готовых),
+    публикация - ровно в job.publish_at. Перезахват только если пост устарел
+    
+    Returns:
+        dict: пост, готовый к публикации
+    """
+    post, captured_ts = queue.get_ready(job)
+    if post and not os.path.exists(post['screenshot_path']):
+        post = None
+    if post:
+        logger.info(f"📦 Найден подготовленный пост ({time.time() - captured_ts:.0f}s назад)")
+    else:
+        post = await prepare_post(spec, values=values)
+        queue.put_ready(job, post, post['captured_ts'])
+    
+    wait = job.publish_at - time.time()
+    if wait > 0:
+        publish_at = datetime.fromtimestamp(job.publish_at, timezone.utc) + timedelta(hours=3)
+        logger.info(f"⏳ Публикация в {publish_at.strftime('%H:%M:%S')} MSK, ждем {wait:.0f}s")
+        await asyncio.sleep(wait)
+    
+    age = time.time() - post['captured_ts']
+    if age > READY_MAX_AGE_SECONDS:
+        logger.warning(f"⚠️ Подготовленный пост устарел ({age:.0f}s > {READY_MAX_AGE_SECONDS}s), перезахват")
+        stale_path = post['screenshot_path']
+        post = await prepare_post(spec, values=values)
+        queue.put_ready(job, post, post['captured_ts'])
+        if stale_path != post['screenshot_path'] and os.path.exists(stale_path):
+            ARTIFACTS.remove(stale_path)
+    
+    metrics.set_value('publish_lag_s', round(time.time() - job.publish_at, 2))
+    return post
+
+
+async def publish_post(spec, post, publications, lease=None, with_ai=False, publish_first=False):
+    """
+    Фаза 2: публикация подготовленного поста по графу шагов (step_graph):
+    
+        ai ──────────────┐
+                         ├─> telegram (подпись с Alpha Take)
+        twitter_media ───> tweet
+    
+    Загрузка картинки в Twitter идет параллельно с Alpha Take и Telegram,
+    ждет результат OpenAI только шаг с подписью
+    
+    Args:
+        with_ai: Alpha Take еще не получен - запросить параллельно с публикацией
+        publish_first: Фото в Telegram сразу, Alpha Take - через editMessageCaption
+            (не дольше AI_CAPTION_EDIT_DEADLINE)
+    
+    message_id отправленного фото сохраняется в post['telegram_message_id']
+    
+    Returns:
+        bool: True если Telegram принял пост
+    """
+    source_key = spec.key
+    screenshot_path = post['screenshot_path']
+    
+    def check_lease():
+        # Аренду перехватил другой воркер (мы слишком долго не продлевали) - он и опубликует
+        if lease and lease.lost:
+            raise Exception(f"Аренда задачи {lease.job.job_id} потеряна, публикация отменена")
+    
+    check_lease()
+    
+    async def alpha_take():
+        deadline = AI_CAPTION_EDIT_DEADLINE if publish_first else None
+        ai_result = await get_ai_comment_async(source_key, screenshot_path, deadline=deadline)
+        logger.info("  ✓ Alpha Take получен" if ai_result else "  ⚠️ Alpha Take не получен")
+        return ai_result
+    
+    def telegram(ai=None):
+        check_lease()
+        if ai:
+            post['caption'] = build_caption(post['title'], post['hashtags'], ai)
+            post['ai'] = True
+        logger.info("\n📤 ОТПРАВКА В TELEGRAM")
+        return send_telegram_photo(screenshot_path, post['caption'], return_result=True)
+    
+    def caption_edit(ai, telegram):
+        if not ai:
+            logger.info("  ⚠️ Alpha Take не получен - подпись остается без него")
+            return False
+        if telegram is None:
+            logger.info("  ⚠️ Фото не опубликовано - Alpha Take некуда добавить")
+            return False
+        if telegram.get('message_id') is None:
+            logger.info("  ⚠️ Нет message_id - подпись без Alpha Take")
+            return False
+        caption = build_caption(post['title'], post['hashtags'], ai)
+        if not edit_telegram_caption(telegram['message_id'], caption):
+            return False
+        post['caption'] = caption
+        post['ai'] = True
+        return True
+    
+    def twitter_media():
+        check_lease()
+        return upload_twitter_media(screenshot_path)
+    
+    def tweet(twitter_media):
+        if not twitter_media:
+            return False
+        twitter, media_id = twitter_media
+        return post_tweet(twitter, post['title'], post['hashtags'], media_id)
+    
+    steps = []
+    if with_ai:
+        logger.info("\n🤖 ГЕНЕРАЦИЯ ALPHA TAKE (параллельно с публикацией)")
+        steps.append(Step('ai', alpha_take))
+    steps.append(Step('telegram', telegram, ('ai',) if with_ai and not publish_first else ()))
+    if with_ai and publish_first:
+        steps.append(Step('caption_edit', caption_edit, ('ai', 'telegram')))
+    if TWITTER_ENABLED:
+        steps.append(Step('twitter_media', twitter_media))
+        steps.append(Step('tweet', tweet, ('twitter_media',)))
+    else:
+        logger.info("ℹ️  Twitter отключен")
+    
+    with metrics.span('publish'):
+        results = await run_steps(steps)
+    
+    # Отправлено = есть ответ ok; message_id нужен только для правки подписи
+    tg_result = results['telegram']
+    post['telegram_message_id'] = tg_result.get('message_id') if tg_result is not None else None
+    tg_success = tg_result is not None
+    tw_success = bool(results.get('tweet'))
+    
+    if not tg_success:
+        logger.warning("⚠️ Ошибка отправки в Telegram")
+    if publish_first and with_ai:
+        metrics.set_value('caption_edited', bool(results['caption_edit']))
+    
+    # Обновляем историю публикаций
+    publications.record(source_key, spec.name, tg_success, tw_success)
+    
+    metrics.set_value('telegram', tg_success)
+    metrics.set_value('twitter', tw_success)
+    metrics.set_value('ai', post['ai'])
+    
+    logger.info(f"\n🎯 ИТОГ")
+    logger.info(f"  ✓ Источник: {spec.name}")
+    logger.info(f"  ✓ Скриншот: {screenshot_path}")
+    logger.info(f"  ✓ Telegram: {tg_success}")
+    logger.info(f"  ✓ Twitter: {tw_success}")
+    
+    # Опубликованный скриншот закрепляем как последний удачный (предыдущий уходит в LRU)
+    if screenshot_path and os.path.exists(screenshot_path):
+        try:
+            if ARTIFACT_SETTINGS['pin_last_good'] and tg_success:
+                ARTIFACTS.pin(source_key, screenshot_path)
+                logger.info(f"  📌 Скриншот закреплен как последний удачный: {os.path.basename(screenshot_path)}")
+            else:
+                ARTIFACTS.remove(screenshot_path)
+                logger.info(f"  🗑️  Удален файл скриншота: {os.path.basename(screenshot_path)}")
+        except Exception as e:
+            logger.warning(f"  ⚠️ Не удалось обработать скриншот: {e}")
+    
+    logger.info("="*70)
+    return tg_success
+
+
+async def main_parser(source_key=None, lease=None, queue=None):
+    """
+    Главная функция парсера со скриншотами
+    
+    Args:
+        source_key: Источник (None - определить по расписанию)
+        lease: Lease задачи из job_queue (публикация отменяется если аренда потеряна)
+        queue: JobQueue - в режиме PIPELINE_MODE=staged хранит подготовленный пост
+    """
+    run_status = 'skipped'  # Статус для записи метрик
     
     try:
         logger.info("="*70)
@@ -1010,15 +1578,20 @@ async def main_parser():
         logger.info("="*70)
         
         # ✅ НОВОЕ: Определяем источник по расписанию MSK
-        source_key = get_source_by_schedule()
+        source_key = source_key or get_source_by_schedule()
         
         if not source_key:
             logger.info("⏰ Сейчас не время для публикации по расписанию")
             return True  # ✅ Это не ошибка - просто не время
         
+        # 📊 Метрики пишем только для запусков с выбранным источником
+        metrics.start_run()
+        metrics.set_source(source_key)
+        
         # ✅ ЗАЩИТА ОТ ДУБЛЕЙ: Проверяем когда последний раз публиковался этот источник
-        history = load_publication_history()
-        last_published = history.get("last_published", {}).get(source_key)
+        # (история читается один раз за запуск, запись - дописыванием в журнал)
+        publications = PublicationStore(known_sources={*SOURCE_SPECS, DIGEST_KEY})
+        last_published = publications.get_last_published(source_key)
         
         if last_published:
             try:
@@ -1036,246 +1609,147 @@ async def main_parser():
                 logger.info(f"  Продолжаем выполнение...")
                 # Продолжаем - публикуем, так как не можем определить когда была последняя публикация
         
-        source_config = SCREENSHOT_SOURCES.get(source_key)
+        job = lease.job if lease else None
+        if PIPELINE_MODE == 'staged' and job and published_in_slot(publications, job):
+            logger.info(f"⏸️  Слот {job.slot} уже опубликован в текущем окне")
+            return True  # ✅ Это не ошибка - слот уже отработал
+        
+        spec = DIGEST_SPEC if source_key == DIGEST_KEY else SOURCE_SPECS.get(source_key)
         
-        if not source_config:
+        if not spec:
             raise Exception(f"Источник {source_key} не найден в конфигурации")
         
-        if not source_config.get('enabled', True):
+        if not spec.enabled:
             logger.info(f"⚠️ Источник {source_key} отключен")
             return True  # ✅ Это не ошибка - источник просто отключен
         
-        logger.info(f"📅 Выбранный источник: {source_config['name']}")
-        
-        async with async_playwright() as p:
-            logger.info("🌐 Запуск браузера...")
-
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    '--no-sandbox',
-                    '--disable-setuid-sandbox',
-                    '--disable-dev-shm-usage',
-                    '--disable-gpu',
-                    '--single-process',
-                    '--disable-blink-features=AutomationControlled'  # ✅ Скрыть автоматизацию
-                ]
-            )
-
-            # ✅ Получаем custom user-agent если задан в конфиге
-            custom_ua = source_config.get('custom_user_agent')
-            user_agent = custom_ua if custom_ua else 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36'
-            
-            # ✅ Получаем custom viewport если задан в конфиге
-            viewport_width = source_config.get('viewport_width', SCREENSHOT_SETTINGS['viewport_width'])
-            viewport_height = source_config.get('viewport_height', SCREENSHOT_SETTINGS['viewport_height'])
-            
-            context = await browser.new_context(
-                user_agent=user_agent,
-                viewport={
-                    'width': viewport_width, 
-                    'height': viewport_height
-                },
-                # ✅ Дополнительные headers для обхода блокировки
-                extra_http_headers={
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-                    'Sec-Fetch-Dest': 'document',
-                    'Sec-Fetch-Mode': 'navigate',
-                    'Sec-Fetch-Site': 'none',
-                    'Sec-Fetch-User': '?1'
-                }
-            )
-
-            # ✅ Удаляем webdriver флаги
-            page = await context.new_page()
-            
-            # ✅ Stealth mode если включен
-            if source_config.get('stealth_mode', False):
-                await page.add_init_script("""
-                    // Удаляем webdriver
-                    Object.defineProperty(navigator, 'webdriver', {
-                        get: () => undefined
-                    });
-                    
-                    // Скрываем automation
-                    Object.defineProperty(navigator, 'plugins', {
-                        get: () => [1, 2, 3, 4, 5]
-                    });
-                    
-                    Object.defineProperty(navigator, 'languages', {
-                        get: () => ['en-US', 'en']
-                    });
-                    
-                    // Chrome runtime
-                    window.chrome = {
-                        runtime: {}
-                    };
-                """)
+        logger.info(f"📅 Выбранный источник: {spec.name}")
+        
+        # 🔎 Проверка без браузера: данные не менялись с последней публикации - Chromium не нужен
+        probe_state = None
+        probe_result = None
+        if PROBE_ENABLED and source_key != DIGEST_KEY and spec.probe:
+            probe_state = ProbeState()
+            with metrics.span('probe'):
+                probe_result = await asyncio.to_thread(probe_source, source_key, spec.probe, probe_state)
+            probe_state.save()
+            metrics.set_value('probe', probe_result.status)
+            if probe_result.unchanged:
+                logger.info(f"⏭️  Данные не изменились с последней публикации (HTTP {probe_result.http_status}, "
+                            f"{probe_result.elapsed_ms:.0f} мс) - браузер не запускается")
+                return True  # ✅ Это не ошибка - публиковать нечего
+            if probe_result.status == 'error':
+                logger.warning(f"⚠️ Проверка без браузера не удалась ({probe_result.error}) - обычный захват")
             else:
-                await page.add_init_script("""
-                    Object.defineProperty(navigator, 'webdriver', {
-                        get: () => undefined
-                    });
-                """)
-            
-            # Делаем скриншот с повторными попытками
-            result = None
-            for retry in range(MAX_RETRIES + 1):
-                if retry > 0:
-                    logger.info(f"\n🔄 Повторная попытка {retry}/{MAX_RETRIES}")
-                    await asyncio.sleep(3)
-                
-                result = await take_screenshot(page, source_config, source_key)
-                
-                if result:
-                    break
-            
-            if not result:
-                raise Exception(f"Не удалось создать скриншот после {MAX_RETRIES + 1} попыток")
-            
-            # Формируем caption для Telegram
-            title = source_config['telegram_title']
-            hashtags = source_config['telegram_hashtags']
-            
-            # FIX ISSUE #26: HTML escape для безопасности
-            title_escaped = html.escape(title)
-            hashtags_escaped = html.escape(hashtags)
-            
-            # 🤖 ALPHA TAKE от OpenAI
-            ai_result = None
-            skip_ai = source_config.get('skip_ai', False)
-            if OPENAI_ENABLED and not skip_ai:
-                logger.info("\n🤖 ГЕНЕРАЦИЯ ALPHA TAKE")
-                ai_result = get_ai_comment(source_key, result['screenshot_path'])
-                if ai_result:
-                    logger.info("  ✓ Alpha Take получен")
-                else:
-                    logger.info("  ⚠️ Alpha Take не получен")
-            else:
-                if skip_ai:
-                    logger.info("  ℹ️  AI отключен для этого источника (skip_ai=True)")
-                else:
-                    logger.info("  ℹ️  OpenAI отключен")
-            
-            # Формируем финальный caption
-            caption = add_alpha_take_to_caption(title_escaped, hashtags_escaped, ai_result)
-            
-            # FIX ISSUE #10: Валидация длины caption (Telegram limit: 1024)
-            if len(caption) > 1024:
-                logger.warning(f"⚠️ Caption слишком длинный ({len(caption)} символов), обрезаю")
-                caption = caption[:1020] + "..."
-            
-            # Отправляем в Telegram
-            logger.info("\n📤 ОТПРАВКА В TELEGRAM")
-            tg_success = send_telegram_photo(result['screenshot_path'], caption)
-            
-            if not tg_success:
-                logger.warning("⚠️ Ошибка отправки в Telegram")
-            
-            time.sleep(2)
-            
-            # Отправляем в Twitter
-            if TWITTER_ENABLED:
-                tw_success = send_to_twitter(title, hashtags, result['screenshot_path'])
-            else:
-                tw_success = False
-                logger.info("ℹ️  Twitter отключен")
-            
-            # Обновляем историю публикаций
-            history = load_publication_history()
-            current_hour = datetime.now(timezone.utc).hour  # ✅ Добавил определение
-            
-            # ✅ ИСПРАВЛЕНИЕ БАГ #1: Инициализируем last_published если его нет
-            if "last_published" not in history:
-                history["last_published"] = {}
-            
-            history["last_published"][source_key] = datetime.now(timezone.utc).isoformat()
-            history["last_publication"] = {
-                "source": source_key,
-                "name": source_config['name'],
-                "published_at": datetime.now(timezone.utc).isoformat(),
-                "hour_utc": current_hour,
-                "telegram": tg_success,
-                "twitter": tw_success
-            }
-            save_publication_history(history)
-            
-            logger.info(f"\n🎯 ИТОГ")
-            logger.info(f"  ✓ Источник: {source_config['name']}")
-            logger.info(f"  ✓ Скриншот: {result['screenshot_path']}")
-            logger.info(f"  ✓ Telegram: {tg_success}")
-            logger.info(f"  ✓ Twitter: {tw_success}")
-            
-            # Cleanup: удаляем файл скриншота после успешной публикации
-            screenshot_file = result['screenshot_path']
-            if screenshot_file and os.path.exists(screenshot_file):
-                try:
-                    os.remove(screenshot_file)
-                    logger.info(f"  🗑️  Удален файл скриншота: {os.path.basename(screenshot_file)}")
-                except Exception as e:
-                    logger.warning(f"  ⚠️ Не удалось удалить скриншот: {e}")
-            
-            logger.info("="*70)
-            
-            return True
+                logger.info(f"🔎 Данные изменились (HTTP {probe_result.http_status}, {probe_result.elapsed_ms:.0f} мс)")
+        
+        # Значения из probe - данные для native_render gauge/card без повторного запроса
+        probe_values = probe_result.values if probe_result and probe_result.status != 'error' else None
+        
+        # Воркеры обработки изображений стартуют параллельно с браузером
+        image_pool.warm_up()
+        
+        if PIPELINE_MODE == 'staged' and queue and job and job.publish_at:
+            # Capture-ahead: готовим заранее, публикуем ровно в publish_at_msk
+            post = await stage_post(spec, queue, job, probe_values)
+            tg_success = await publish_post(spec, post, publications, lease)
+        else:
+            # Alpha Take запрашивается параллельно с загрузкой в Twitter/Telegram
+            post = await prepare_post(spec, with_ai=False, values=probe_values)
+            tg_success = await publish_post(spec, post, publications, lease,
+                                            with_ai=OPENAI_ENABLED and not spec.skip_ai,
+                                            publish_first=PUBLISH_FIRST)
+        
+        # Следующий запуск с теми же данными пропустит браузер
+        if tg_success and probe_result and probe_result.fingerprint:
+            probe_state.mark_published(source_key, probe_result.fingerprint)
+            probe_state.save()
+        
+        if queue and job:
+            queue.drop_ready(job)
+        
+        run_status = 'success'
+        return True
 
     except Exception as e:
         logger.error(f"\n❌ КРИТИЧЕСКАЯ ОШИБКА: {e}")
         logger.error(traceback.format_exc())
+        run_status = 'failed'
         return False
     
     finally:
-        # CRITICAL: Guaranteed browser cleanup
-        if browser:
-            try:
-                await browser.close()
-                logger.info("✓ Браузер закрыт\n")
-            except Exception as e:
-                logger.warning(f"⚠️ Ошибка закрытия браузера: {e}")
+        run_ledger.record_run(metrics.finish_run(run_status))
+        image_pool.shutdown()
+        ARTIFACTS.save()
 
 
 def main():
     """Точка входа в программу"""
-    lock_file = None
-    lock_path = None
+    parser = argparse.ArgumentParser(description="CMC Screenshot Parser")
+    parser.add_argument('--source', help=f'Опубликовать источник сейчас, без расписания (например {DIGEST_KEY})')
+    args = parser.parse_args()
+    
+    queue = None
+    job = None
     
     try:
-        # Проверка lock-файла
-        lock_file, lock_path = acquire_lock()
-        if not lock_file:
-            logger.error("\n✗ Парсер уже запущен!")
-            sys.exit(2)
-        
         logger.info("\n" + "="*70)
         logger.info("🤖 CMC SCREENSHOT PARSER - SCHEDULED MODE")
         logger.info("="*70)
         logger.info(f"📅 Дата запуска: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')} UTC")
         logger.info(f"💻 Платформа: {platform.system()} {platform.release()}")
-        logger.info(f"🔒 Lock файл: {lock_path}")
         logger.info(f"⚙️  Настройки:")
         logger.info(f"   • MAX_RETRIES: {MAX_RETRIES}")
+        logger.info(f"   • PIPELINE_MODE: {PIPELINE_MODE}")
+        logger.info(f"   • PUBLISH_FIRST: {PUBLISH_FIRST}")
         logger.info(f"   • Telegram: {'✓' if TELEGRAM_BOT_TOKEN else '✗'}")
         logger.info(f"   • Twitter: {'✓' if TWITTER_ENABLED and TWITTER_API_KEY else '✗'}")
         logger.info("="*70 + "\n")
         
-        # Валидация Telegram
+        if args.source:
+            if args.source != DIGEST_KEY and args.source not in SOURCE_SPECS:
+                logger.error(f"✗ Неизвестный источник: {args.source}")
+                sys.exit(2)
+            # Ручной запуск - отдельная задача на каждый вызов
+            slot = (f"manual_{args.source}_{datetime.now(timezone.utc).strftime('%H%M%S')}",
+                    {'time_range_msk': (0, 24)}, args.source)
+            logger.info(f"🖐️  Ручной запуск: {args.source}")
+        else:
+            slot = get_schedule_slot()
+        if not slot:
+            logger.info("⏰ Сейчас не время для публикации по расписанию")
+            sys.exit(0)
+        slot_name, slot_config, source_key = slot
+        
+        # Валидация Telegram (до захвата задачи - неисправный воркер не должен ее занимать)
         if not validate_telegram_credentials():
             logger.error("✗ КРИТИЧЕСКАЯ ОШИБКА: Невалидные Telegram credentials!")
-            release_lock(lock_file, lock_path)
             sys.exit(1)
         
+        # Задача слота на сегодня выполняется ровно одним воркером (вместо pid lock-файла)
+        queue = JobQueue()
+        params = slot_job(slot_name, source_key, slot_config['time_range_msk'], slot_config.get('publish_at_msk'))
+        if queue.enqueue(**params):
+            queue.prune()
+        job = queue.claim(params['job_id'])
+        if not job:
+            logger.info(f"⏸️  Задача {params['job_id']} уже выполнена или выполняется другим воркером")
+            sys.exit(0)
+        logger.info(f"🔒 Задача захвачена: {job.job_id} (источник {job.source}, попытка {job.attempts}, воркер {queue.owner})")
+        
         # CRITICAL: Cleanup старых файлов перед запуском
         logger.info("\n🗑️  CLEANUP СТАРЫХ ФАЙЛОВ")
         cleanup_old_screenshots(max_age_hours=24)
         
         logger.info("")
         
-        # Запускаем основной парсер
-        success = asyncio.run(main_parser())
+        # Запускаем основной парсер (под профайлером если PROFILE_MODE задан)
+        # Пока идет запуск, аренда задачи продлевается в фоне
+        with Lease(queue, job) as lease:
+            success = profiling.run_profiled(lambda: asyncio.run(main_parser(job.source, lease, queue)), name="main_parser")
         
-        # Освобождаем lock
-        release_lock(lock_file, lock_path)
+        queue.complete(job, success, None if success else 'main_parser failed')
+        job = None
         
         if success:
             logger.info("\n✅ ПАРСИНГ ЗАВЕРШЕН УСПЕШНО!")
@@ -1286,13 +1760,18 @@ def main():
             
     except KeyboardInterrupt:
         logger.info("\n⚠️ Парсинг прерван пользователем (Ctrl+C)")
-        release_lock(lock_file, lock_path)
+        if job:
+            queue.complete(job, False, 'interrupted')
         sys.exit(130)
     except Exception as e:
         logger.error(f"\n❌ КРИТИЧЕСКАЯ ОШИБКА В MAIN: {e}")
         logger.error(traceback.format_exc())
-        release_lock(lock_file, lock_path)
+        if job:
+            queue.complete(job, False, str(e))
         sys.exit(1)
+    finally:
+        if queue:
+            queue.close()
 
 
 if __name__ == "__main__":
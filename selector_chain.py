@@ -0,0 +1,207 @@
+"""
+Цепочки селекторов с запоминанием победителя
+Version: 1.0.0
+Источник может задать "selector" строкой или упорядоченным списком стратегий:
+- "div[data-role='x']"               - CSS (в т.ч. data-role и структурные пути)
+- "xpath=//h2[...]/parent::div"     - XPath
+- "text=Bitcoin Dominance"          - текстовый якорь (текст целиком в одном текстовом узле)
+- {"text": "...", "tag": "h2", "up": 1} - текстовый якорь с тегом и подъемом к родителю
+Стратегии проверяются за один page.evaluate до первой сработавшей. Первая стратегия
+конфига (основная) всегда проверяется первой; победитель из запасных запоминается
+в selector_cache.json и идет сразу за ней, так что мертвые запасные не проверяются.
+Как только основная снова находит элемент, она же и запоминается
+"""
+
+import os
+import json
+import logging
+
+from atomic_io import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+SELECTOR_CACHE_FILE = "selector_cache.json"
+
+# Атрибут, которым помечается найденный элемент (дальше берем его через query_selector)
+CAPTURE_MARKER = "data-cmc-capture"
+
+# Проверяет стратегии по порядку за один вызов и останавливается на первой сработавшей:
+# возвращает ее индекс и результаты проверенных стратегий (для диагностики мертвых селекторов)
+RESOLVE_JS = """(args) => {
+    const marker = args.marker;
+    document.querySelectorAll('[' + marker + ']').forEach(el => el.removeAttribute(marker));
+
+    const visible = (el) => {
+        if (!el || el.nodeType !== 1) return false;
+        const r = el.getBoundingClientRect();
+        return r.width > 0 && r.height > 0;
+    };
+    const SKIP_TAGS = new Set(['SCRIPT', 'STYLE', 'NOSCRIPT', 'TEMPLATE']);
+    const climb = (el, up) => {
+        for (let i = 0; el && i < (up || 0); i++) el = el.parentElement;
+        return el;
+    };
+    const find = (s) => {
+        try {
+            if (s.kind === 'css') {
+                return Array.from(document.querySelectorAll(s.value)).find(visible) || null;
+            }
+            if (s.kind === 'xpath') {
+                const snap = document.evaluate(s.value, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+                for (let i = 0; i < snap.snapshotLength; i++) {
+                    const el = climb(snap.snapshotItem(i), s.up);
+                    if (visible(el)) return el;
+                }
+                return null;
+            }
+            if (s.kind === 'text') {
+                // Обход только текстовых узлов (один проход, без textContent по всему DOM):
+                // родитель узла - самый глубокий элемент с этим текстом, tag - ближайший предок-тег
+                const needle = s.value.toLowerCase();
+                const walker = document.createTreeWalker(document.body || document, NodeFilter.SHOW_TEXT);
+                for (let node = walker.nextNode(); node; node = walker.nextNode()) {
+                    if (!node.data.toLowerCase().includes(needle)) continue;
+                    const parent = node.parentElement;
+                    if (!parent || SKIP_TAGS.has(parent.tagName)) continue;
+                    const el = s.tag ? parent.closest(s.tag) : parent;
+                    const target = climb(el, s.up);
+                    if (visible(target)) return target;
+                }
+                return null;
+            }
+        } catch (e) {}
+        return null;
+    };
+
+    const matched = [];
+    for (let i = 0; i < args.strategies.length; i++) {
+        const el = find(args.strategies[i]);
+        matched.push(el !== null);
+        if (el) {
+            el.setAttribute(marker, '1');
+            return {index: i, matched: matched};
+        }
+    }
+    return {index: -1, matched: matched};
+}"""
+
+
+def parse_strategies(selector):
+    """
+    Нормализует selector (строка, dict или список) в список стратегий
+
+    Returns:
+        list: [{"kind": "css"|"xpath"|"text", "value": ..., "tag": ..., "up": ..., "label": ...}]
+    """
+    if not selector:
+        return []
+    items = selector if isinstance(selector, (list, tuple)) else [selector]
+
+    strategies = []
+    for item in items:
+        if isinstance(item, str):
+            if item.startswith('xpath='):
+                strategy = {"kind": "xpath", "value": item[len('xpath='):]}
+            elif item.startswith('text='):
+                strategy = {"kind": "text", "value": item[len('text='):]}
+            else:
+                strategy = {"kind": "css", "value": item}
+        elif isinstance(item, dict):
+            kinds = [k for k in ('css', 'xpath', 'text') if k in item]
+            if len(kinds) != 1:
+                raise ValueError(f"Стратегия селектора должна содержать ровно один из css/xpath/text: {item}")
+            strategy = {"kind": kinds[0], "value": item[kinds[0]]}
+            if item.get('tag'):
+                strategy['tag'] = item['tag']
+            if item.get('up'):
+                strategy['up'] = int(item['up'])
+        else:
+            raise ValueError(f"Неподдерживаемый тип селектора: {item!r}")
+
+        if not isinstance(strategy['value'], str) or not strategy['value'].strip():
+            raise ValueError(f"Пустой селектор: {item!r}")
+
+        strategy['label'] = f"{strategy['kind']}:{strategy.get('tag', '')}:{strategy.get('up', 0)}:{strategy['value']}"
+        strategies.append(strategy)
+    return strategies
+
+
+def first_css(selector):
+    """Первая CSS-стратегия (для проверок через document.querySelector) или None"""
+    for strategy in parse_strategies(selector):
+        if strategy['kind'] == 'css':
+            return strategy['value']
+    return None
+
+
+class SelectorCache:
+    """Последняя сработавшая стратегия по каждому источнику (path=None - только в памяти)"""
+
+    def __init__(self, path=SELECTOR_CACHE_FILE):
+        self.path = path
+        self.winners = {}
+        try:
+            if path and os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.winners = json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка загрузки кэша селекторов: {e}")
+
+    def order(self, source_key, strategies):
+        """
+        Основная стратегия (первая в конфиге) - первой, за ней последний победитель,
+        остальные - в порядке конфига. Запасная, сработавшая однажды, не обгоняет основную
+        """
+        if not strategies:
+            return []
+        winner = self.winners.get(source_key)
+        primary, fallbacks = strategies[0], strategies[1:]
+        return [primary] + sorted(fallbacks, key=lambda s: s['label'] != winner)
+
+    def remember(self, source_key, label):
+        if self.winners.get(source_key) == label:
+            return
+        self.winners[source_key] = label
+        if not self.path:
+            return
+        try:
+            atomic_write_json(self.path, self.winners, indent=2)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка сохранения кэша селекторов: {e}")
+
+
+async def resolve_element(page, source_key, selector, cache):
+    """
+    Находит элемент по цепочке стратегий за один evaluate
+
+    Returns:
+        tuple: (ElementHandle или None, сработавшая стратегия или None)
+    """
+    return await resolve_strategies(page, source_key, parse_strategies(selector), cache)
+
+
+async def resolve_strategies(page, source_key, strategies, cache):
+    """То же, что resolve_element, но по уже разобранным стратегиям (SourceSpec.strategies)"""
+    strategies = cache.order(source_key, strategies)
+    if not strategies:
+        return None, None
+
+    outcome = await page.evaluate(RESOLVE_JS, {
+        "marker": CAPTURE_MARKER,
+        "strategies": [{k: v for k, v in s.items() if k != 'label'} for s in strategies]
+    })
+
+    # Проверялись только стратегии до победителя включительно
+    dead = [s['label'] for s, ok in zip(strategies, outcome['matched']) if not ok]
+    if dead and len(strategies) > 1:
+        logger.info(f"  ℹ️  Не сработали стратегии: {len(dead)} из {len(outcome['matched'])} проверенных")
+
+    if outcome['index'] < 0:
+        return None, None
+
+    winner = strategies[outcome['index']]
+    cache.remember(source_key, winner['label'])
+    element = await page.query_selector(f"[{CAPTURE_MARKER}]")
+    if element and len(strategies) > 1:
+        logger.info(f"  ✓ Селектор ({winner['kind']}): {winner['value'][:80]}")
+    return element, winner
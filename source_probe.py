@@ -0,0 +1,302 @@
+"""
+Проверка изменения данных источника без браузера
+Version: 1.0.0
+Перед запуском Chromium делается обычный HTTP-запрос к странице или к JSON-эндпоинту,
+который она загружает (probe в SCREENSHOT_SOURCES):
+- условный GET (If-None-Match / If-Modified-Since): 304 - данные не менялись
+- отпечаток (sha256) извлеченных значений или всего ответа
+Если отпечаток совпадает с последним опубликованным - браузер не запускается.
+Любая ошибка проверки (сеть, формат, нет значений) - fail-open: обычный захват.
+
+Состояние (ETag, Last-Modified, отпечатки, значения) - в probe_state.json.
+Для офлайн-проверки ответы записываются и воспроизводятся из файлов:
+    python source_probe.py check fear_greed --record probe_fixtures
+    python source_probe.py check fear_greed --replay probe_fixtures
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+
+import requests
+
+from atomic_io import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Настройки (через переменные окружения)
+PROBE_ENABLED = os.getenv('PROBE_ENABLED', 'true').lower() == 'true'
+PROBE_STATE_FILE = os.getenv('PROBE_STATE_FILE', 'probe_state.json')
+PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', '5'))
+PROBE_REPLAY_DIR = os.getenv('PROBE_REPLAY_DIR', '')  # Ответы из записанных файлов вместо сети
+
+PROBE_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                    '(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36')
+
+
+class ProbeError(Exception):
+    """Проверку выполнить не удалось (парсер продолжает обычный захват)"""
+
+
+class ProbeResult:
+    """Результат проверки источника"""
+
+    __slots__ = ('source_key', 'status', 'fingerprint', 'values', 'http_status', 'elapsed_ms', 'error')
+
+    def __init__(self, source_key, status, fingerprint=None, values=None, http_status=None,
+                 elapsed_ms=0.0, error=None):
+        self.source_key = source_key
+        self.status = status  # changed | unchanged | error
+        self.fingerprint = fingerprint
+        self.values = values or {}
+        self.http_status = http_status
+        self.elapsed_ms = elapsed_ms
+        self.error = error
+
+    @property
+    def unchanged(self):
+        return self.status == 'unchanged'
+
+    def __repr__(self):
+        return f"ProbeResult({self.source_key!r}, {self.status}, http={self.http_status}, {self.elapsed_ms:.0f}ms)"
+
+
+class ProbeState:
+    """probe_state.json: {source_key: {etag, last_modified, fingerprint, values, published, checked_at}}"""
+
+    def __init__(self, path=PROBE_STATE_FILE):
+        self.path = path
+        self.entries = {}
+        self._dirty = False
+        try:
+            if path and os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка загрузки состояния проверок: {e}")
+
+    def get(self, source_key):
+        return self.entries.get(source_key, {})
+
+    def update(self, source_key, **fields):
+        self.entries.setdefault(source_key, {}).update(fields)
+        self._dirty = True
+
+    def mark_published(self, source_key, fingerprint):
+        """Отпечаток опубликованных данных - следующий запуск с тем же отпечатком пропускается"""
+        if fingerprint and self.get(source_key).get('published') != fingerprint:
+            self.update(source_key, published=fingerprint, published_at=time.time())
+
+    def save(self):
+        if not self._dirty or not self.path:
+            return
+        try:
+            atomic_write_json(self.path, self.entries, indent=2)
+            self._dirty = False
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка сохранения состояния проверок: {e}")
+
+
+class HttpTransport:
+    """Обычные HTTP-запросы (record_dir - сохранять ответы для воспроизведения)"""
+
+    def __init__(self, timeout=None, record_dir=None):
+        self.timeout = timeout or PROBE_TIMEOUT
+        self.record_dir = record_dir
+        self.session = requests.Session()
+
+    def fetch(self, source_key, url, headers):
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        result = (response.status_code, dict(response.headers), response.content)
+        if self.record_dir and response.status_code == 200:
+            _record(self.record_dir, source_key, url, *result)
+        return result
+
+
+class ReplayTransport:
+    """
+    Воспроизведение записанных ответов (<dir>/<source_key>.json) - без сети.
+    Условный запрос с совпадающим ETag/Last-Modified получает 304, как от сервера
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, source_key, url, headers):
+        path = os.path.join(self.directory, f"{source_key}.json")
+        if not os.path.exists(path):
+            raise ProbeError(f"нет записанного ответа {path}")
+        with open(path, 'r', encoding='utf-8') as f:
+            recorded = json.load(f)
+        response_headers = {k.lower(): v for k, v in recorded.get('headers', {}).items()}
+        etag = response_headers.get('etag')
+        last_modified = response_headers.get('last-modified')
+        if (etag and headers.get('If-None-Match') == etag) or \
+                (last_modified and headers.get('If-Modified-Since') == last_modified):
+            return 304, response_headers, b''
+        return recorded.get('status', 200), response_headers, recorded.get('body', '').encode('utf-8')
+
+
+def _record(directory, source_key, url, status, headers, body):
+    os.makedirs(directory, exist_ok=True)
+    keep = {k: v for k, v in headers.items() if k.lower() in ('etag', 'last-modified', 'content-type')}
+    atomic_write_json(os.path.join(directory, f"{source_key}.json"), {
+        'url': url,
+        'status': status,
+        'headers': keep,
+        'body': body.decode('utf-8', errors='replace')
+    }, indent=2)
+
+
+def json_value(data, path):
+    """Значение по пути "data.0.value" (индексы списков - числами)"""
+    value = data
+    for part in path.split('.'):
+        if isinstance(value, list) and part.lstrip('-').isdigit():
+            value = value[int(part)]
+        elif isinstance(value, dict):
+            value = value[part]
+        else:
+            raise KeyError(part)
+    return value
+
+
+def extract_values(probe, body):
+    """
+    Значения из ответа по probe.json_paths / probe.patterns
+
+    Returns:
+        dict или None если извлечение не настроено (отпечаток - по всему телу)
+
+    Raises:
+        ProbeError: значение не найдено (формат ответа поменялся)
+    """
+    if not probe.json_paths and not probe.patterns:
+        return None
+    values = {}
+    text = body.decode('utf-8', errors='replace')
+    if probe.json_paths:
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise ProbeError(f"ответ не JSON: {e}") from e
+        for path in probe.json_paths:
+            try:
+                values[path] = json_value(data, path)
+            except (KeyError, IndexError, TypeError) as e:
+                raise ProbeError(f"нет значения {path} в ответе") from e
+    for pattern in probe.patterns:
+        match = pattern.search(text)
+        if not match:
+            raise ProbeError(f"regex {pattern.pattern!r} не нашел значение")
+        values[pattern.pattern] = match.group(1) if match.groups() else match.group(0)
+    return values
+
+
+def fingerprint(values, body):
+    """sha256 извлеченных значений (или всего тела ответа)"""
+    if values is not None:
+        payload = json.dumps(values, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    else:
+        payload = body
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _header(headers, name):
+    return next((v for k, v in headers.items() if k.lower() == name), None)
+
+
+def probe_source(source_key, probe, state, transport=None):
+    """
+    Условный запрос + отпечаток
+
+    Args:
+        source_key: Ключ источника
+        probe: ProbeSpec (SourceSpec.probe)
+        state: ProbeState
+        transport: HttpTransport / ReplayTransport (по умолчанию PROBE_REPLAY_DIR или сеть)
+
+    Returns:
+        ProbeResult (status='error' при любой ошибке - вызывающий код делает обычный захват)
+    """
+    transport = transport or (ReplayTransport(PROBE_REPLAY_DIR) if PROBE_REPLAY_DIR else HttpTransport())
+    entry = state.get(source_key)
+    started = time.perf_counter()
+
+    headers = {'User-Agent': PROBE_USER_AGENT, 'Accept': 'application/json, text/html;q=0.9, */*;q=0.8'}
+    headers.update(probe.headers)
+    # Условный запрос только если есть с чем сравнить (иначе 304 ничего не скажет)
+    if entry.get('fingerprint'):
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    http_status = None
+    try:
+        http_status, response_headers, body = transport.fetch(source_key, probe.url, headers)
+        if http_status == 304:
+            current, values = entry['fingerprint'], entry.get('values') or {}
+        elif http_status == 200:
+            extracted = extract_values(probe, body)
+            current, values = fingerprint(extracted, body), extracted or {}
+            state.update(
+                source_key,
+                etag=_header(response_headers, 'etag'),
+                last_modified=_header(response_headers, 'last-modified'),
+                fingerprint=current,
+                values=values
+            )
+        else:
+            raise ProbeError(f"HTTP {http_status}")
+    except Exception as e:
+        return ProbeResult(source_key, 'error', http_status=http_status,
+                           elapsed_ms=(time.perf_counter() - started) * 1000, error=str(e))
+    finally:
+        state.update(source_key, checked_at=time.time())
+
+    status = 'unchanged' if current == entry.get('published') else 'changed'
+    return ProbeResult(source_key, status, current, values, http_status, (time.perf_counter() - started) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка изменения данных источника без браузера")
+    commands = parser.add_subparsers(dest='command', required=True)
+    check = commands.add_parser('check', help='Проверить источник (состояние не сохраняется)')
+    check.add_argument('source')
+    check.add_argument('--replay', help='Директория с записанными ответами (без сети)')
+    check.add_argument('--record', help='Сохранить ответ для воспроизведения')
+    check.add_argument('--state', default=PROBE_STATE_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from sources_config import SCREENSHOT_SOURCES, SCREENSHOT_SETTINGS
+    from source_specs import compile_sources
+
+    spec = compile_sources(SCREENSHOT_SOURCES, SCREENSHOT_SETTINGS).get(args.source)
+    if not spec or not spec.probe:
+        logger.error(f"✗ У источника {args.source} нет probe в конфигурации")
+        sys.exit(2)
+
+    transport = ReplayTransport(args.replay) if args.replay else HttpTransport(record_dir=args.record)
+    state = ProbeState(args.state)
+    result = probe_source(spec.key, spec.probe, state, transport)
+    print(json.dumps({
+        'source': result.source_key,
+        'status': result.status,
+        'http_status': result.http_status,
+        'elapsed_ms': round(result.elapsed_ms, 1),
+        'fingerprint': result.fingerprint,
+        'values': result.values,
+        'error': result.error
+    }, ensure_ascii=False, indent=2, default=str))
+    sys.exit(1 if result.status == 'error' else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,500 @@
+"""
+Скомпилированные спецификации источников
+Version: 1.0.0
+SCREENSHOT_SOURCES (вложенные dict с необязательными ключами) компилируется один раз
+при старте в неизменяемые объекты со __slots__:
+- element_padding / crop нормализованы (int или dict -> Insets)
+- селекторы разобраны в цепочку стратегий, probe-селектор выбран заранее
+- JS для скрытия элементов и масштаба собран заранее
+Ошибка в конфиге (опечатка в ключе, неверный тип, пустой селектор) падает сразу
+при загрузке, а не посреди захвата
+"""
+
+import re
+import json
+from types import MappingProxyType
+
+from selector_chain import parse_strategies, CAPTURE_MARKER
+
+DEFAULT_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                      '(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36')
+
+# Допустимые ключи источника (опечатка = ошибка конфига)
+KNOWN_KEYS = frozenset({
+    'name', 'url', 'selector', 'wait_for', 'telegram_title', 'telegram_hashtags',
+    'enabled', 'priority', 'extra_wait', 'adaptive_wait', 'hide_elements', 'close_modal',
+    'element_padding', 'crop', 'scale', 'skip_width_padding', 'viewport_width', 'viewport_height',
+    'custom_user_agent', 'stealth_mode', 'skip_ai', 'quality_gate', 'probe', 'native_render'
+})
+# Ключи probe (source_probe.py: проверка изменения данных без браузера)
+PROBE_KEYS = frozenset({'url', 'json', 'regex', 'headers'})
+# Локальная отрисовка вместо скриншота (native_render.renderer)
+NATIVE_RENDERERS = frozenset({'treemap', 'gauge', 'card'})
+# prefer - сначала локально, браузер при ошибке; fallback - браузер, локально при ошибке
+NATIVE_RENDER_MODES = ('prefer', 'fallback')
+REQUIRED_KEYS = ('name', 'url')
+# Ключ дайджеста в расписании и очереди задач (DigestSpec)
+DIGEST_KEY = 'digest'
+# Нужны только включенным источникам (отключенные заглушки могут их не иметь)
+PUBLISH_KEYS = ('telegram_title', 'telegram_hashtags')
+
+# Скрипт закрытия модалок: клик по кнопкам закрытия
+CLOSE_MODAL_BUTTONS_JS = """() => {
+    // Попытка закрыть модальное окно разными способами
+    const closeSelectors = [
+        'button:has-text("Maybe Later")',  // Специально для COIN360
+        'button:has-text("Later")',
+        '[aria-label="Close"]',
+        '[data-dismiss="modal"]',
+        '.close',
+        '.modal-close',
+        'button[class*="close"]',
+        '[class*="closeButton"]',
+        'button[type="button"]',  // Любые кнопки
+        'svg[class*="close"]',    // SVG иконки закрытия
+        '[role="button"][aria-label*="close" i]'
+    ];
+
+    for (const sel of closeSelectors) {
+        let btns = [];
+        try { btns = document.querySelectorAll(sel); } catch (e) { continue; }
+        for (const btn of btns) {
+            // Проверяем что это похоже на кнопку закрытия
+            const text = btn.textContent?.toLowerCase() || '';
+            if (text.includes('close') || text.includes('later') || text.includes('×') || text.includes('✕') || !text) {
+                btn.click();
+                return true;
+            }
+        }
+    }
+    return false;
+}"""
+
+# Клик по backdrop (темный фон)
+CLOSE_MODAL_BACKDROP_JS = """() => {
+    const backdrops = document.querySelectorAll('[class*="backdrop"], [class*="overlay"], [class*="modal-backdrop"]');
+    backdrops.forEach(el => el.click());
+}"""
+
+# Принудительное скрытие всех модальных элементов
+CLOSE_MODAL_HIDE_JS = """() => {
+    // Ищем все элементы с position: fixed и высоким z-index
+    const allElements = document.querySelectorAll('*');
+    allElements.forEach(el => {
+        const style = window.getComputedStyle(el);
+        const zIndex = parseInt(style.zIndex);
+        const position = style.position;
+
+        // Если fixed/absolute с высоким z-index - скрываем
+        if ((position === 'fixed' || position === 'absolute') && zIndex > 1000) {
+            el.style.display = 'none';
+        }
+    });
+
+    // Также скрываем все явные модалки
+    const modals = document.querySelectorAll('[class*="modal"], [class*="Modal"], [class*="dialog"], [class*="Dialog"], [class*="popup"], [class*="Popup"]');
+    modals.forEach(el => {
+        el.style.display = 'none';
+        el.style.visibility = 'hidden';
+        el.style.opacity = '0';
+    });
+}"""
+
+
+class SourceConfigError(ValueError):
+    """Ошибка в SCREENSHOT_SOURCES / POST_SCHEDULE"""
+
+
+class _Frozen:
+    """База для неизменяемых объектов со __slots__"""
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} неизменяем")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} неизменяем")
+
+    def _init(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+
+class Insets(_Frozen):
+    """Отступы по сторонам (element_padding, crop)"""
+
+    __slots__ = ('top', 'right', 'bottom', 'left')
+
+    def __init__(self, top=0, right=0, bottom=0, left=0):
+        self._init(top=top, right=right, bottom=bottom, left=left)
+
+    def __bool__(self):
+        return any((self.top, self.right, self.bottom, self.left))
+
+    def as_dict(self):
+        return {'top': self.top, 'right': self.right, 'bottom': self.bottom, 'left': self.left}
+
+    def __repr__(self):
+        return f"Insets(T:{self.top} R:{self.right} B:{self.bottom} L:{self.left})"
+
+
+def _insets(value, field):
+    """int/float или dict со сторонами -> Insets"""
+    if value is None:
+        return Insets()
+    if isinstance(value, bool):
+        raise SourceConfigError(f"{field}: ожидается число или dict, получено {value!r}")
+    if isinstance(value, (int, float)):
+        if value < 0:
+            raise SourceConfigError(f"{field}: отрицательный отступ {value}")
+        return Insets(value, value, value, value)
+    if isinstance(value, dict):
+        unknown = set(value) - {'top', 'right', 'bottom', 'left'}
+        if unknown:
+            raise SourceConfigError(f"{field}: неизвестные стороны {sorted(unknown)}")
+        sides = {side: value.get(side, 0) for side in ('top', 'right', 'bottom', 'left')}
+        for side, amount in sides.items():
+            if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount < 0:
+                raise SourceConfigError(f"{field}.{side}: ожидается неотрицательное число, получено {amount!r}")
+        return Insets(**sides)
+    raise SourceConfigError(f"{field}: ожидается число или dict, получено {type(value).__name__}")
+
+
+class ProbeSpec(_Frozen):
+    """
+    Легкая проверка источника без браузера (source_probe.py)
+
+    url: страница или JSON-эндпоинт, который она загружает (по умолчанию url источника)
+    json_paths: пути к значениям в JSON ("data.0.value"); отпечаток - по ним
+    patterns: регулярные выражения по телу ответа (значения - первая группа)
+    Без json_paths и patterns отпечаток считается по всему телу ответа
+    """
+
+    __slots__ = ('url', 'json_paths', 'patterns', 'headers')
+
+    def __init__(self, url, json_paths=(), patterns=(), headers=None):
+        self._init(url=url, json_paths=tuple(json_paths), patterns=tuple(patterns),
+                   headers=MappingProxyType(dict(headers or {})))
+
+    def __repr__(self):
+        return f"ProbeSpec({self.url!r}, json={list(self.json_paths)}, regex={len(self.patterns)})"
+
+
+def _probe(value, url):
+    """probe источника -> ProbeSpec (None если не задан)"""
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise SourceConfigError(f"probe: ожидается dict, получено {type(value).__name__}")
+    unknown = set(value) - PROBE_KEYS
+    if unknown:
+        raise SourceConfigError(f"probe: неизвестные ключи {sorted(unknown)}")
+
+    probe_url = value.get('url') or url
+    if not isinstance(probe_url, str) or not probe_url.startswith(('http://', 'https://')):
+        raise SourceConfigError(f"probe.url должен начинаться с http(s)://: {probe_url!r}")
+
+    json_paths = value.get('json') or ()
+    if isinstance(json_paths, str):
+        json_paths = (json_paths,)
+    if not all(isinstance(path, str) and path for path in json_paths):
+        raise SourceConfigError(f"probe.json: ожидаются непустые строки, получено {json_paths!r}")
+
+    patterns = value.get('regex') or ()
+    if isinstance(patterns, str):
+        patterns = (patterns,)
+    compiled = []
+    for pattern in patterns:
+        try:
+            compiled.append(re.compile(pattern))
+        except (re.error, TypeError) as e:
+            raise SourceConfigError(f"probe.regex {pattern!r}: {e}") from e
+
+    headers = value.get('headers') or {}
+    if not isinstance(headers, dict):
+        raise SourceConfigError("probe.headers: ожидается dict")
+    return ProbeSpec(probe_url, json_paths, compiled, headers)
+
+
+class NativeRenderSpec(_Frozen):
+    """Локальная отрисовка картинки источника без браузера (treemap_renderer.py, indicator_renderer.py)"""
+
+    __slots__ = ('renderer', 'mode', 'options')
+
+    def __init__(self, renderer, mode, options):
+        self._init(renderer=renderer, mode=mode, options=MappingProxyType(dict(options)))
+
+    def __repr__(self):
+        return f"NativeRenderSpec({self.renderer!r}, mode={self.mode!r})"
+
+
+def _native_render(value, probe=None):
+    """native_render источника -> NativeRenderSpec (None если не задан)"""
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise SourceConfigError(f"native_render: ожидается dict, получено {type(value).__name__}")
+    options = dict(value)
+    renderer = options.pop('renderer', None)
+    if renderer not in NATIVE_RENDERERS:
+        raise SourceConfigError(f"native_render.renderer: ожидается один из {sorted(NATIVE_RENDERERS)}, получено {renderer!r}")
+    mode = options.pop('mode', 'fallback')
+    if mode not in NATIVE_RENDER_MODES:
+        raise SourceConfigError(f"native_render.mode: ожидается prefer или fallback, получено {mode!r}")
+    url = options.get('url')
+    if url is not None and not (isinstance(url, str) and url.startswith(('http://', 'https://'))):
+        raise SourceConfigError(f"native_render.url должен начинаться с http(s)://: {url!r}")
+    if not url and not options.get('fixture') and renderer == 'treemap':
+        raise SourceConfigError("native_render: нужен url или fixture с данными")
+    if renderer in ('gauge', 'card'):
+        # Значения - из probe источника (те же json-пути) или из собственного url
+        paths = [options.get('value')] + [options[key] for key in ('label', 'delta') if options.get(key)]
+        if not all(isinstance(path, str) and path for path in paths):
+            raise SourceConfigError(f"native_render.{renderer}: value/label/delta - json-пути строкой")
+        if not url and not (probe and set(paths) <= set(probe.json_paths)):
+            raise SourceConfigError(f"native_render.{renderer}: нужен url или probe.json с путями {paths}")
+    return NativeRenderSpec(renderer, mode, options)
+
+
+def _hide_script(selector):
+    """JS скрытия элементов с уже подставленным селектором (без аргументов на каждом вызове)"""
+    return f"""() => {{
+    document.querySelectorAll({json.dumps(selector)}).forEach(el => {{
+        el.style.display = 'none';
+        el.style.visibility = 'hidden';
+    }});
+}}"""
+
+
+def _scale_script(scale):
+    """JS масштабирования найденного элемента (помечен CAPTURE_MARKER)"""
+    return f"""() => {{
+    const el = document.querySelector('[{CAPTURE_MARKER}]');
+    if (el) {{
+        el.style.transform = 'scale({scale})';
+        el.style.transformOrigin = 'top left';
+    }}
+}}"""
+
+
+class SourceSpec(_Frozen):
+    """Скомпилированный источник: все поля нормализованы, горячий путь ничего не разбирает"""
+
+    __slots__ = (
+        'key', 'name', 'url', 'enabled', 'priority',
+        'strategies', 'probe_selector', 'wait_for', 'extra_wait', 'adaptive_wait',
+        'close_modal', 'hide_elements', 'hide_script', 'scale', 'scale_script',
+        'padding', 'crop', 'skip_width_padding', 'viewport', 'user_agent', 'stealth_mode',
+        'skip_ai', 'quality_gate', 'probe', 'native_render', 'telegram_title', 'telegram_hashtags'
+    )
+
+    def __init__(self, key, config, defaults):
+        unknown = set(config) - KNOWN_KEYS
+        if unknown:
+            raise SourceConfigError(f"неизвестные ключи {sorted(unknown)}")
+        enabled = bool(config.get('enabled', True))
+        required = REQUIRED_KEYS + PUBLISH_KEYS if enabled else REQUIRED_KEYS
+        missing = [name for name in required if not config.get(name)]
+        if missing:
+            raise SourceConfigError(f"не заданы обязательные ключи {missing}")
+
+        url = config['url']
+        if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+            raise SourceConfigError(f"url должен начинаться с http(s)://: {url!r}")
+
+        try:
+            strategies = tuple(parse_strategies(config.get('selector')))
+        except ValueError as e:
+            raise SourceConfigError(f"selector: {e}") from e
+        probe_selector = next((s['value'] for s in strategies if s['kind'] == 'css'), None)
+
+        scale = config.get('scale', 1.0)
+        if isinstance(scale, bool) or not isinstance(scale, (int, float)) or scale <= 0:
+            raise SourceConfigError(f"scale: ожидается положительное число, получено {scale!r}")
+
+        extra_wait = config.get('extra_wait', 0)
+        if isinstance(extra_wait, bool) or not isinstance(extra_wait, (int, float)) or extra_wait < 0:
+            raise SourceConfigError(f"extra_wait: ожидается неотрицательное число, получено {extra_wait!r}")
+
+        hide_elements = config.get('hide_elements') or None
+        if hide_elements is not None and not isinstance(hide_elements, str):
+            raise SourceConfigError(f"hide_elements: ожидается CSS-строка, получено {type(hide_elements).__name__}")
+
+        viewport = (
+            config.get('viewport_width', defaults['viewport_width']),
+            config.get('viewport_height', defaults['viewport_height'])
+        )
+        if not all(isinstance(v, int) and v > 0 for v in viewport):
+            raise SourceConfigError(f"viewport: ожидаются положительные целые, получено {viewport}")
+
+        quality_gate = config.get('quality_gate')
+        if quality_gate is not None and not isinstance(quality_gate, dict):
+            raise SourceConfigError("quality_gate: ожидается dict")
+
+        crop = _insets(config.get('crop'), 'crop')
+        probe = _probe(config.get('probe'), url)
+        native_render = _native_render(config.get('native_render'), probe)
+
+        self._init(
+            key=key,
+            name=config['name'],
+            url=url,
+            enabled=enabled,
+            priority=config.get('priority', 0),
+            strategies=strategies,
+            probe_selector=probe_selector,
+            wait_for=config.get('wait_for') or None,
+            extra_wait=extra_wait,
+            adaptive_wait=config.get('adaptive_wait', True) is not False,
+            close_modal=bool(config.get('close_modal', False)),
+            hide_elements=hide_elements,
+            hide_script=_hide_script(hide_elements) if hide_elements else None,
+            scale=float(scale),
+            scale_script=_scale_script(float(scale)) if scale != 1.0 else None,
+            padding=_insets(config.get('element_padding', 0), 'element_padding'),
+            crop=crop if crop else None,
+            skip_width_padding=bool(config.get('skip_width_padding', False)),
+            viewport=viewport,
+            user_agent=config.get('custom_user_agent') or DEFAULT_USER_AGENT,
+            stealth_mode=bool(config.get('stealth_mode', False)),
+            skip_ai=bool(config.get('skip_ai', False)),
+            quality_gate=MappingProxyType(dict(quality_gate)) if quality_gate else None,
+            probe=probe,
+            native_render=native_render,
+            telegram_title=config.get('telegram_title') or config['name'],
+            telegram_hashtags=config.get('telegram_hashtags', '')
+        )
+
+    def __repr__(self):
+        return f"SourceSpec({self.key!r}, strategies={len(self.strategies)}, enabled={self.enabled})"
+
+
+class DigestSpec(_Frozen):
+    """
+    Дайджест (DIGEST_SETTINGS): публикуется как источник DIGEST_KEY,
+    картинка собирается из скриншотов источников sources
+    """
+
+    __slots__ = (
+        'key', 'name', 'enabled', 'sources', 'labels', 'columns', 'tile_size', 'label_height',
+        'gap', 'margin', 'font_size', 'background', 'tile_background', 'label_color',
+        'min_tiles', 'quality', 'skip_ai', 'telegram_title', 'telegram_hashtags'
+    )
+
+    def __init__(self, settings, specs):
+        errors = []
+        sources = tuple(settings.get('sources') or ())
+        if not sources:
+            errors.append("sources: пустой список")
+        for source_key in sources:
+            spec = specs.get(source_key)
+            if spec is None:
+                errors.append(f"sources: неизвестный источник {source_key}")
+            elif not spec.enabled:
+                errors.append(f"sources: источник {source_key} отключен")
+
+        layout = {}
+        for name in ('columns', 'tile_width', 'tile_height', 'label_height', 'gap', 'margin', 'font_size', 'min_tiles'):
+            value = settings.get(name)
+            minimum = 1 if name in ('columns', 'tile_width', 'tile_height', 'font_size', 'min_tiles') else 0
+            if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+                errors.append(f"{name}: ожидается целое >= {minimum}, получено {value!r}")
+            layout[name] = value
+
+        colors = {}
+        for name in ('background', 'tile_background', 'label_color'):
+            value = tuple(settings.get(name) or ())
+            if len(value) != 3 or not all(isinstance(c, int) and 0 <= c <= 255 for c in value):
+                errors.append(f"{name}: ожидается RGB (0-255), получено {settings.get(name)!r}")
+            colors[name] = value
+
+        labels = dict(settings.get('labels') or {})
+        unknown = set(labels) - set(sources)
+        if unknown:
+            errors.append(f"labels: источники {sorted(unknown)} не входят в sources")
+        if errors:
+            raise SourceConfigError("Ошибки в DIGEST_SETTINGS:\n  " + "\n  ".join(errors))
+
+        self._init(
+            key=DIGEST_KEY,
+            name=settings.get('name') or 'Digest',
+            enabled=bool(settings.get('enabled', True)),
+            sources=sources,
+            labels=MappingProxyType({key: labels.get(key) or specs[key].name for key in sources}),
+            columns=layout['columns'],
+            tile_size=(layout['tile_width'], layout['tile_height']),
+            label_height=layout['label_height'],
+            gap=layout['gap'],
+            margin=layout['margin'],
+            font_size=layout['font_size'],
+            min_tiles=min(layout['min_tiles'], len(sources)),
+            quality=int(settings.get('quality', 85)),
+            skip_ai=True,  # Alpha Take пишется по одному индикатору
+            telegram_title=settings.get('telegram_title') or settings.get('name') or 'Digest',
+            telegram_hashtags=settings.get('telegram_hashtags', ''),
+            **colors
+        )
+
+    def layout(self):
+        """Параметры сетки для digest_image.compose_digest (picklable dict для пула процессов)"""
+        return {
+            'columns': self.columns, 'tile_size': self.tile_size, 'label_height': self.label_height,
+            'gap': self.gap, 'margin': self.margin, 'font_size': self.font_size,
+            'background': self.background, 'tile_background': self.tile_background,
+            'label_color': self.label_color, 'quality': self.quality
+        }
+
+    def __repr__(self):
+        return f"DigestSpec(sources={list(self.sources)})"
+
+
+def compile_sources(sources, defaults):
+    """
+    Компилирует SCREENSHOT_SOURCES
+
+    Args:
+        sources: SCREENSHOT_SOURCES
+        defaults: SCREENSHOT_SETTINGS (viewport по умолчанию)
+
+    Returns:
+        MappingProxyType: {source_key: SourceSpec}
+
+    Raises:
+        SourceConfigError: со списком всех ошибок сразу
+    """
+    specs, errors = {}, []
+    for key, config in sources.items():
+        if key == DIGEST_KEY:
+            errors.append(f"{key}: ключ зарезервирован для дайджеста (DIGEST_SETTINGS)")
+            continue
+        if not isinstance(config, dict):
+            errors.append(f"{key}: ожидается dict")
+            continue
+        try:
+            specs[key] = SourceSpec(key, config, defaults)
+        except SourceConfigError as e:
+            errors.append(f"{key}: {e}")
+    if errors:
+        raise SourceConfigError("Ошибки в SCREENSHOT_SOURCES:\n  " + "\n  ".join(errors))
+    return MappingProxyType(specs)
+
+
+def validate_schedule(schedule, specs):
+    """Проверяет что POST_SCHEDULE ссылается только на существующие источники"""
+    errors = []
+    for slot_name, slot in schedule.items():
+        start, end = slot.get('time_range_msk', (None, None))
+        if not (isinstance(start, (int, float)) and isinstance(end, (int, float)) and 0 <= start < end <= 24):
+            errors.append(f"{slot_name}: неверный time_range_msk {slot.get('time_range_msk')}")
+        publish_at = slot.get('publish_at_msk')
+        if publish_at is not None and not (isinstance(publish_at, (int, float)) and isinstance(start, (int, float))
+                                           and isinstance(end, (int, float)) and start <= publish_at < end):
+            errors.append(f"{slot_name}: publish_at_msk {publish_at} вне time_range_msk")
+        if slot.get('selection') not in ('fixed', 'random', 'conditional'):
+            errors.append(f"{slot_name}: selection должен быть fixed, random или conditional")
+        for source_key in slot.get('sources', []):
+            if source_key not in specs:
+                errors.append(f"{slot_name}: неизвестный источник {source_key}")
+    if errors:
+        raise SourceConfigError("Ошибки в POST_SCHEDULE:\n  " + "\n  ".join(errors))
@@ -19,6 +19,13 @@ SCREENSHOT_SOURCES = {
         "scale": 1.0,
         "hide_elements": "nav, footer, [class*='banner'], [class*='ad']",  # ✅ УПРОЩЕН
         "crop": {"top": 0, "right": 0, "bottom": 0, "left": 0}  # ✅ БЕЗ crop (padding достаточно)
+        # Проверка без браузера (source_probe.py): JSON-эндпоинт, который грузит страница,
+        # и пути к значениям - при том же отпечатке запуск пропускается. Перед включением
+        # проверить: python source_probe.py check fear_greed --record probe_fixtures
+        # "probe": {"url": "https://<эндпоинт страницы>", "json": ["data.value", "data.value_classification"]}
+        # Шкала без браузера (indicator_renderer.py) по значениям probe, если скриншот не удался:
+        # "native_render": {"renderer": "gauge", "mode": "fallback", "value": "data.value",
+        #                   "label": "data.value_classification", "title": "Crypto Fear & Greed Index"}
     },
     
     "altcoin_season": {
@@ -34,12 +41,19 @@ SCREENSHOT_SOURCES = {
         "viewport_height": 800,
         "hide_elements": "aside, nav, header, footer, [class*='sidebar'], [class*='banner'], [class*='ad'], iframe, .description, h1:not(:first-of-type), table, svg[class*='chart']",
         "crop": {"top": 100, "right": 400, "bottom": 400, "left": 400}
+        # Шкала без браузера по значению probe (как у fear_greed), классы - по bands:
+        # "native_render": {"renderer": "gauge", "mode": "fallback", "value": "<json-путь из probe>",
+        #                   "title": "Altcoin Season Index",
+        #                   "bands": [[25, "Bitcoin Season"], [74, "Neutral"], [100, "Altcoin Season"]]}
     },
     
     "btc_dominance": {
         "name": "Bitcoin Dominance",
         "url": "https://coinmarketcap.com/charts/bitcoin-dominance/",
-        "selector": "xpath=//h2[contains(text(), 'Bitcoin Dominance')]/parent::div",  # ✅ ОБНОВЛЕН: Стабильный XPath
+        "selector": [  # Цепочка стратегий: первая сработавшая запоминается в selector_cache.json
+            "xpath=//h2[contains(text(), 'Bitcoin Dominance')]/parent::div",  # ✅ ОБНОВЛЕН: Стабильный XPath
+            {"text": "Bitcoin Dominance", "tag": "h2", "up": 1}                # Текстовый якорь
+        ],
         "wait_for": "h2:has-text('Bitcoin Dominance')",  # ✅ ОБНОВЛЕН: Ждем заголовок
         "telegram_title": "₿ Bitcoin Dominance",
         "telegram_hashtags": "#Bitcoin #BTC #Dominance",
@@ -50,7 +64,16 @@ SCREENSHOT_SOURCES = {
         "hide_elements": "aside, nav, header, footer, [class*='sidebar'], [class*='banner'], [class*='ad'], iframe",
         "element_padding": {"top": 40, "right": 40, "bottom": 40, "left": 40},  # ✅ ДОБАВЛЕН padding
         "crop": {"top": 0, "right": 0, "bottom": 0, "left": 0},  # ✅ БЕЗ crop
-        "skip_width_padding": True
+        "skip_width_padding": True,
+        # Если скриншот не удался - карточка с долей BTC по данным CoinGecko (indicator_renderer.py)
+        "native_render": {
+            "renderer": "card",
+            "mode": "fallback",
+            "url": "https://api.coingecko.com/api/v3/global",
+            "value": "data.market_cap_percentage.btc",
+            "title": "Bitcoin Dominance",
+            "subtitle": "BTC share of total crypto market cap"
+        }
     },
     
     "eth_etf": {
@@ -99,7 +122,11 @@ SCREENSHOT_SOURCES = {
     "top_gainers": {
         "name": "Top Gainers",
         "url": "https://dropstab.com/",
-        "selector": "#__next > div.z-app.relative > div > div.lg\\:ml-auto.w-full.flex.flex-col.lg\\:w-\\[calc\\(100\\%-72px\\)\\].xl\\:w-\\[calc\\(100\\%-256px\\)\\] > main > div > div.relative.z-0.w-full.styles_carousel__lIy83.mb-4.lg\\:mb-6 > div > div > div:nth-child(1) > div > section > span",
+        "selector": [  # Tailwind-путь ломается при каждом редеплое - дальше более устойчивые стратегии
+            "#__next > div.z-app.relative > div > div.lg\\:ml-auto.w-full.flex.flex-col.lg\\:w-\\[calc\\(100\\%-72px\\)\\].xl\\:w-\\[calc\\(100\\%-256px\\)\\] > main > div > div.relative.z-0.w-full.styles_carousel__lIy83.mb-4.lg\\:mb-6 > div > div > div:nth-child(1) > div > section > span",
+            "main div[class*='styles_carousel'] section > span",              # Структурный (без hash-суффикса)
+            {"text": "Top Gainers", "tag": "section"}                         # Текстовый якорь
+        ],
         "wait_for": "section",
         "telegram_title": "🚀 Top Gainers Today",
         "telegram_hashtags": "#TopGainers #Crypto #Movers",
@@ -164,7 +191,17 @@ SCREENSHOT_SOURCES = {
         "element_padding": {"top": 50, "right": 50, "bottom": 50, "left": 50},
         "hide_elements": "header, nav, footer, aside, [class*='navbar'], [class*='Navigation'], [class*='sidebar'], [class*='banner'], [class*='ad'], [class*='cookie']",
         "crop": {"top": 0, "right": 0, "bottom": 0, "left": 0},
-        "skip_width_padding": True
+        "skip_width_padding": True,
+        # Тепловая карта рисуется локально (treemap_renderer.py) по данным CoinGecko,
+        # скриншот canvas с blockchain.com - только если отрисовка не удалась
+        "native_render": {
+            "renderer": "treemap",
+            "mode": "prefer",
+            "url": "https://api.coingecko.com/api/v3/coins/markets?vs_currency=usd&order=market_cap_desc&per_page=60&page=1&price_change_percentage=24h",
+            "exclude": ["USDT", "USDC", "DAI", "FDUSD", "USDE", "USDS", "TUSD", "PYUSD", "WBTC", "STETH", "WSTETH", "WEETH", "WETH"],
+            "limit": 50,
+            "title": "Crypto Market Heatmap"
+        }
     },
     
     # ОТКЛЮЧЕННЫЕ (для истории)
@@ -194,11 +231,13 @@ POST_SCHEDULE = {
     "morning_heatmap": {
         "time_range_msk": (6.85, 8.0),  # 06:51-08:00 (07:00 MSK утром)
         "sources": ["heatmap_blockchain"],
+        "publish_at_msk": 7.0,  # 07:00 MSK - точное время поста (PIPELINE_MODE=staged)
         "selection": "fixed"
     },
     "evening_heatmap": {
         "time_range_msk": (18.85, 19.85),  # 18:51-19:51 (19:00 MSK) ✅ FIX: было 20.00, убрано пересечение
         "sources": ["heatmap_blockchain"],
+        "publish_at_msk": 19.0,  # 19:00 MSK - точное время поста (PIPELINE_MODE=staged)
         "selection": "fixed"
     },
     
@@ -206,30 +245,63 @@ POST_SCHEDULE = {
     "daily_market_sentiment": {
         "time_range_msk": (16.35, 17.0),  # 16:21-17:00 (16:30 MSK)
         "sources": ["fear_greed", "altcoin_season", "btc_dominance"],
+        "publish_at_msk": 16.5,  # 16:30 MSK - точное время поста (PIPELINE_MODE=staged)
         "selection": "random"
     },
     "crypto_liquidations_daily": {
         "time_range_msk": (17.85, 18.85),  # 17:51-18:51 (18:00 MSK) ✅ FIX: было 19.00, убрано пересечение
         "sources": ["crypto_liquidations"],
+        "publish_at_msk": 18.0,  # 18:00 MSK - точное время поста (PIPELINE_MODE=staged)
         "selection": "fixed"
     },
     "btc_etf_flows": {
         "time_range_msk": (19.85, 20.35),  # 19:51-20:21 ✅ FIX: убрано пересечение с ETH ETF
         "sources": ["btc_etf"],
+        "publish_at_msk": 20.0,  # 20:00 MSK - точное время поста (PIPELINE_MODE=staged)
         "selection": "fixed"
     },
     "eth_etf_flows": {
         "time_range_msk": (20.35, 21.0),  # 20:21-21:00 (20:30 MSK)
         "sources": ["eth_etf"],
+        "publish_at_msk": 20.5,  # 20:30 MSK - точное время поста (PIPELINE_MODE=staged)
         "selection": "fixed"
     },
     "top_gainers_radar": {
         "time_range_msk": (21.85, 22.5),  # 21:51-22:30 (22:00 MSK)
         "sources": ["top_gainers"],
+        "publish_at_msk": 22.0,  # 22:00 MSK - точное время поста (PIPELINE_MODE=staged)
         "selection": "fixed"
     }
 }
 
+# Дайджест: несколько источников одной картинкой-сеткой (digest_image.py)
+# В POST_SCHEDULE подключается как обычный источник: "sources": ["digest"], "selection": "fixed"
+# Вручную: python screenshot_parser.py --source digest
+DIGEST_SETTINGS = {
+    "name": "Crypto Market Digest",
+    "telegram_title": "🧭 Crypto Market Digest",
+    "telegram_hashtags": "#CryptoMarket #Bitcoin #ETF #Liquidations",
+    "sources": ["fear_greed", "btc_dominance", "btc_etf", "crypto_liquidations"],
+    "labels": {                  # Подпись плитки (по умолчанию - name источника)
+        "fear_greed": "Fear & Greed",
+        "btc_dominance": "BTC Dominance",
+        "btc_etf": "BTC ETF Flows",
+        "crypto_liquidations": "Liquidations 24h"
+    },
+    "columns": 2,
+    "tile_width": 576,           # 2 x 576 + gap + 2 x margin = 1200 (telegram_max_width)
+    "tile_height": 400,
+    "label_height": 44,
+    "gap": 16,
+    "margin": 16,
+    "font_size": 24,
+    "background": (17, 24, 39),
+    "tile_background": (255, 255, 255),
+    "label_color": (229, 231, 235),
+    "min_tiles": 2,              # Меньше удачных захватов - дайджест не публикуется
+    "quality": 85
+}
+
 # Настройки для обработки изображений
 IMAGE_SETTINGS = {
     "telegram_max_width": 1200,
@@ -250,3 +322,50 @@ SCREENSHOT_SETTINGS = {
     "wait_timeout": 30000,
     "wait_after_load": 5
 }
+
+# История публикаций: снапшот + журнал событий (publication_store.py)
+PUBLICATION_HISTORY_SETTINGS = {
+    "snapshot_file": "publication_history.json",
+    "events_file": "publication_events.jsonl",
+    "compact_every": 20          # Свертка журнала в снапшот каждые N публикаций
+}
+
+# Хранилище скриншотов (artifact_store.py): LRU с бюджетом по размеру и количеству
+ARTIFACT_SETTINGS = {
+    "index_file": ".artifact_index.json",
+    "max_mb": 200,
+    "max_files": 100,
+    "max_age_hours": 24,         # Незакрепленные файлы старше - удаляются при очистке
+    "reconcile_hours": 24,       # Полный скан директории не чаще (файлы после падений)
+    "pin_last_good": True        # Хранить последний опубликованный скриншот источника
+}
+
+# Адаптивные ожидания: бюджет = p95(время до готовности) + margin
+# extra_wait источника и selector_timeout работают как верхние границы
+ADAPTIVE_WAIT_SETTINGS = {
+    "enabled": True,
+    "history_file": "wait_history.json",
+    "window": 20,                # Последние N замеров на источник
+    "quantile": 0.95,
+    "margin_seconds": 2.0,
+    "min_samples": 3,            # До этого ждем по конфигу
+    "selector_timeout": 15,      # Потолок для wait_for_selector (сек)
+    "min_selector_timeout": 3,
+    "stable_ms": 1000            # Контент считается готовым если не меняется столько мс
+}
+
+# Проверка качества скриншота перед OpenAI и публикацией
+# Можно переопределить для источника через "quality_gate": {...}
+QUALITY_GATE_SETTINGS = {
+    "enabled": True,
+    "signatures_file": "quality_signatures.json",
+    "min_luminance_std": 8.0,          # Ниже - пустой/неотрисованный кадр
+    "max_dominant_ratio": 0.97,        # Выше - почти однотонная страница (challenge, заглушка)
+    "min_edge_density": 0.005,         # Ниже - нет текста/графиков
+    "min_signature_similarity": 0.3,   # Корреляция с эталоном источника
+    "signature_min_samples": 3,        # Эталон используется после N принятых кадров
+    "signature_alpha": 0.2,            # Вес нового кадра в эталоне
+    # Последняя попытка без найденного элемента публикует скриншот viewport (если кадр
+    # не пустой); True - считать такой кадр браком и не публиковать
+    "reject_viewport_fallback": False
+}
@@ -0,0 +1,91 @@
+"""
+Выполнение шагов публикации по графу зависимостей
+Version: 1.0.0
+Шаг стартует как только готовы его зависимости: независимые ветки
+(Alpha Take, загрузка картинки в Twitter, отправка в Telegram) идут параллельно,
+и время от скриншота до публикации - самая длинная ветка, а не сумма шагов
+"""
+
+import time
+import asyncio
+import inspect
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Step:
+    """
+    Шаг графа
+
+    Args:
+        name: Имя шага (под ним результат передается зависимым шагам)
+        func: sync или async функция; результаты зависимостей приходят
+              именованными аргументами (deps=('ai',) -> func(ai=...))
+        deps: Имена шагов, которые должны завершиться раньше
+    """
+
+    __slots__ = ('name', 'func', 'deps')
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+    def __repr__(self):
+        return f"Step({self.name!r}, deps={self.deps!r})"
+
+
+async def run_steps(steps):
+    """
+    Выполняет шаги с учетом зависимостей
+
+    Sync-функции (requests, tweepy) выполняются в потоке, чтобы не блокировать
+    остальные ветки. Ошибка шага логируется, его результат - None, а зависимые
+    шаги пропускаются (независимые ветки продолжают работу)
+
+    Args:
+        steps: Список Step; зависимости должны стоять в списке раньше шага
+
+    Returns:
+        dict: имя шага -> результат (None при ошибке или пропуске)
+    """
+    tasks = {}
+    failed = set()
+    results = {}
+    started = time.perf_counter()
+
+    for step in steps:
+        if step.name in tasks:
+            raise ValueError(f"Шаг {step.name} объявлен дважды")
+        unknown = [dep for dep in step.deps if dep not in tasks]
+        if unknown:
+            raise ValueError(f"Шаг {step.name}: зависимости {unknown} должны быть объявлены раньше")
+
+        async def run(step=step, deps=[tasks[dep] for dep in step.deps]):
+            await asyncio.gather(*deps)
+            skipped = [dep for dep in step.deps if dep in failed]
+            if skipped:
+                logger.warning(f"⏭️  Шаг {step.name} пропущен: не выполнены {', '.join(skipped)}")
+                failed.add(step.name)
+                return None
+
+            kwargs = {dep: results[dep] for dep in step.deps}
+            try:
+                if inspect.iscoroutinefunction(step.func):
+                    result = await step.func(**kwargs)
+                else:
+                    result = await asyncio.to_thread(step.func, **kwargs)
+            except Exception as e:
+                logger.error(f"✗ Шаг {step.name}: {e}")
+                failed.add(step.name)
+                return None
+
+            results[step.name] = result
+            logger.debug(f"  ✓ Шаг {step.name} за {time.perf_counter() - started:.2f}s от старта")
+            return result
+
+        tasks[step.name] = asyncio.ensure_future(run())
+
+    await asyncio.gather(*tasks.values())
+    return {name: results.get(name) for name in tasks}
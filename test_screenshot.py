@@ -9,6 +9,7 @@ import sys
 from playwright.async_api import async_playwright
 from sources_config import SCREENSHOT_SOURCES, SCREENSHOT_SETTINGS
 from screenshot_parser import accept_cookies, optimize_image_for_telegram
+from selector_chain import SelectorCache, resolve_element
 import os
 from datetime import datetime, timezone
 
@@ -78,7 +79,8 @@ async def test_screenshot(source_key):
             
             if selector:
                 try:
-                    element = await page.query_selector(selector)
+                    # Цепочка стратегий; кэш победителя только в памяти
+                    element, _ = await resolve_element(page, source_key, selector, SelectorCache(path=None))
                     if element:
                         await element.screenshot(path=screenshot_path)
                         print(f"✅ Скриншот элемента создан")
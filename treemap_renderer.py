@@ -0,0 +1,297 @@
+"""
+Тепловая карта рынка без браузера: squarified treemap по капитализации
+Version: 1.0.0
+Данные (символ, капитализация, изменение за 24ч) берутся из JSON-ответа
+(например CoinGecko /coins/markets), записанного ответа (PROBE_REPLAY_DIR)
+или файла-фикстуры. Раскладка - squarified treemap (Bruls, Huizing, van Wijk),
+заливка плиток - срезами numpy-массива, подписи - PIL. Детерминированно:
+одни и те же данные дают ту же картинку, за доли секунды
+
+Использование:
+    python treemap_renderer.py --fixture markets.json -o heatmap.jpg
+    python treemap_renderer.py --source heatmap_blockchain -o heatmap.jpg
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from digest_image import load_font
+from source_probe import PROBE_REPLAY_DIR, PROBE_USER_AGENT, HttpTransport, ReplayTransport, json_value
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию (переопределяются в native_render источника)
+TREEMAP_DEFAULTS = {
+    "items": "",                 # Путь к списку монет в ответе ("" - ответ и есть список)
+    "fields": {"symbol": "symbol", "market_cap": "market_cap", "change": "price_change_percentage_24h"},
+    "exclude": [],               # Символы, которые не показываются (стейблкоины)
+    "limit": 50,
+    "width": 1200,
+    "height": 800,
+    "header_height": 56,
+    "gap": 2,                    # Зазор между плитками (px)
+    "max_change": 10.0,          # Изменение (%), при котором цвет насыщен полностью
+    "title": "Crypto Market Heatmap",
+    "subtitle": "24h change",
+    "background": (17, 24, 39),
+    "text_color": (255, 255, 255),
+    "quality": 85
+}
+
+# Цвета шкалы изменения: -max_change -> 0 -> +max_change
+NEGATIVE_COLOR = (220, 38, 38)
+NEUTRAL_COLOR = (71, 85, 105)
+POSITIVE_COLOR = (22, 163, 74)
+
+
+def _options(options):
+    merged = dict(TREEMAP_DEFAULTS)
+    merged.update(options or {})
+    merged['fields'] = {**TREEMAP_DEFAULTS['fields'], **merged.get('fields', {})}
+    return merged
+
+
+def parse_markets(data, options=None):
+    """
+    JSON-ответ -> [{"symbol", "market_cap", "change"}] по убыванию капитализации
+
+    Монеты без капитализации пропускаются, изменение без значения считается 0
+    """
+    options = _options(options)
+    fields = options['fields']
+    items = json_value(data, options['items']) if options['items'] else data
+    if not isinstance(items, list):
+        raise ValueError(f"ожидается список монет, получено {type(items).__name__}")
+
+    exclude = {symbol.upper() for symbol in options['exclude']}
+    markets = []
+    for item in items:
+        try:
+            symbol = str(json_value(item, fields['symbol'])).upper()
+            market_cap = float(json_value(item, fields['market_cap']) or 0)
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+        if market_cap <= 0 or symbol in exclude:
+            continue
+        try:
+            change = float(json_value(item, fields['change']) or 0)
+        except (KeyError, IndexError, TypeError, ValueError):
+            change = 0.0
+        markets.append({'symbol': symbol, 'market_cap': market_cap, 'change': change})
+
+    markets.sort(key=lambda m: m['market_cap'], reverse=True)
+    return markets[:options['limit']]
+
+
+def fetch_markets(source_key, options, transport=None):
+    """Данные из options['url'] (при PROBE_REPLAY_DIR - из записанного ответа)"""
+    transport = transport or (ReplayTransport(PROBE_REPLAY_DIR) if PROBE_REPLAY_DIR else HttpTransport())
+    status, _, body = transport.fetch(source_key, options['url'], {
+        'User-Agent': PROBE_USER_AGENT,
+        'Accept': 'application/json'
+    })
+    if status != 200:
+        raise ValueError(f"HTTP {status} от {options['url']}")
+    return parse_markets(json.loads(body), options)
+
+
+def load_fixture(path, options=None):
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_markets(json.load(f), options)
+
+
+def _worst(row, side):
+    """Худшее соотношение сторон плиток ряда вдоль стороны side"""
+    total = sum(row)
+    return max(max(row) * side * side / (total * total), total * total / (side * side * min(row)))
+
+
+def squarify(values, x, y, width, height):
+    """
+    Squarified treemap: плитки с площадью пропорционально values (по убыванию)
+
+    Returns:
+        list: [(x, y, w, h)] в порядке values
+    """
+    total = float(sum(values))
+    if total <= 0 or width <= 0 or height <= 0:
+        return []
+    scale = width * height / total
+    remaining = [v * scale for v in values]
+    rects = []
+
+    while remaining:
+        side = min(width, height)
+        row = [remaining[0]]
+        # Плитки добавляются в ряд, пока соотношение сторон не начнет ухудшаться
+        while len(row) < len(remaining) and _worst(row + [remaining[len(row)]], side) <= _worst(row, side):
+            row.append(remaining[len(row)])
+        remaining = remaining[len(row):]
+        row_total = sum(row)
+
+        if width >= height:
+            # Ряд - столбец у левого края
+            column = row_total / height
+            offset = y
+            for area in row:
+                rects.append((x, offset, column, area / column))
+                offset += area / column
+            x += column
+            width -= column
+        else:
+            # Ряд - строка у верхнего края
+            line = row_total / width
+            offset = x
+            for area in row:
+                rects.append((offset, y, area / line, line))
+                offset += area / line
+            y += line
+            height -= line
+    return rects
+
+
+def change_colors(changes, max_change):
+    """Цвета плиток для всех изменений сразу (линейная шкала красный - серый - зеленый)"""
+    t = np.clip(np.asarray(changes, dtype=np.float64) / max_change, -1.0, 1.0)
+    points = [-1.0, 0.0, 1.0]
+    channels = [np.interp(t, points, [NEGATIVE_COLOR[i], NEUTRAL_COLOR[i], POSITIVE_COLOR[i]]) for i in range(3)]
+    return np.stack(channels, axis=1).round().astype(np.uint8)
+
+
+def _draw_label(draw, box, symbol, change, color):
+    x0, y0, x1, y1 = box
+    width, height = x1 - x0, y1 - y0
+    size = int(min(width / max(len(symbol), 3) * 1.4, height / 3, 64))
+    if size >= 10:
+        # Оценка по числу символов грубая - подгоняем по реальной ширине текста
+        text_width = draw.textlength(symbol, font=load_font(size))
+        if text_width > width - 8:
+            size = int(size * (width - 8) / text_width)
+    if size < 10:
+        return  # Плитка слишком мала для подписи
+    font = load_font(size)
+    change_font = load_font(max(9, int(size * 0.6)))
+    change_text = f"{change:+.2f}%"
+
+    symbol_box = draw.textbbox((0, 0), symbol, font=font)
+    change_box = draw.textbbox((0, 0), change_text, font=change_font)
+    symbol_h = symbol_box[3] - symbol_box[1]
+    change_h = change_box[3] - change_box[1]
+    show_change = symbol_h + change_h + size // 3 < height and change_box[2] - change_box[0] < width - 4
+    block_h = symbol_h + (change_h + size // 4 if show_change else 0)
+    top = y0 + (height - block_h) // 2
+
+    draw.text((x0 + (width - (symbol_box[2] - symbol_box[0])) // 2 - symbol_box[0], top - symbol_box[1]),
+              symbol, font=font, fill=color)
+    if show_change:
+        draw.text((x0 + (width - (change_box[2] - change_box[0])) // 2 - change_box[0],
+                   top + symbol_h + size // 4 - change_box[1]),
+                  change_text, font=change_font, fill=color)
+
+
+def render_treemap(markets, output_path, options=None, generated_at=None):
+    """
+    Рисует тепловую карту и сохраняет JPEG
+
+    Args:
+        markets: parse_markets(...)
+        output_path: Куда сохранить
+        options: native_render источника (размеры, цвета, заголовок)
+        generated_at: Время данных для подписи (по умолчанию сейчас, UTC)
+
+    Returns:
+        str: output_path
+    """
+    if not markets:
+        raise ValueError("Нет данных для тепловой карты")
+    options = _options(options)
+    width, height = options['width'], options['height']
+    header, gap = options['header_height'], options['gap']
+    background = tuple(options['background'])
+
+    canvas = np.empty((height, width, 3), dtype=np.uint8)
+    canvas[...] = background
+
+    rects = squarify([m['market_cap'] for m in markets], 0, header, width, height - header)
+    colors = change_colors([m['change'] for m in markets], options['max_change'])
+
+    # Границы округляются от накопленных координат - соседние плитки стыкуются без щелей
+    boxes = []
+    for (x, y, w, h), color in zip(rects, colors):
+        x0, y0, x1, y1 = round(x), round(y), round(x + w), round(y + h)
+        boxes.append((x0, y0, x1, y1))
+        canvas[y0 + gap // 2:y1 - (gap - gap // 2), x0 + gap // 2:x1 - (gap - gap // 2)] = color
+
+    image = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(image)
+    text_color = tuple(options['text_color'])
+    for box, market in zip(boxes, markets):
+        _draw_label(draw, box, market['symbol'], market['change'], text_color)
+
+    # Заголовок: название слева, шкала и время данных справа
+    generated_at = generated_at or datetime.now(timezone.utc)
+    title_font = load_font(26)
+    info_font = load_font(18)
+    draw.text((16, header // 2), options['title'], font=title_font, fill=text_color, anchor='lm')
+    info = f"{options['subtitle']} · {generated_at.strftime('%d %b %Y %H:%M')} UTC"
+    draw.text((width - 16, header // 2), info, font=info_font, fill=(156, 163, 175), anchor='rm')
+
+    image.save(output_path, 'JPEG', quality=options['quality'], optimize=True)
+    return output_path
+
+
+def render_source(source_key, options, output_path, values=None):
+    """
+    Точка входа для screenshot_parser (native_render.renderer = "treemap")
+
+    Args:
+        values: Не используется (данные берутся из url/fixture)
+    """
+    if options.get('fixture'):
+        markets = load_fixture(options['fixture'], options)
+    else:
+        markets = fetch_markets(source_key, options)
+    return render_treemap(markets, output_path, options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Тепловая карта рынка без браузера")
+    parser.add_argument('--fixture', help='JSON с монетами (формат CoinGecko /coins/markets)')
+    parser.add_argument('--source', help='Источник с native_render в sources_config.py')
+    parser.add_argument('--record', help='Сохранить ответ для PROBE_REPLAY_DIR')
+    parser.add_argument('-o', '--output', default='heatmap.jpg')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    options = {}
+    if args.source:
+        from sources_config import SCREENSHOT_SOURCES, SCREENSHOT_SETTINGS
+        from source_specs import compile_sources
+        spec = compile_sources(SCREENSHOT_SOURCES, SCREENSHOT_SETTINGS).get(args.source)
+        if not spec or not spec.native_render or spec.native_render.renderer != 'treemap':
+            logger.error(f"✗ У источника {args.source} нет native_render с renderer=treemap")
+            sys.exit(2)
+        options = dict(spec.native_render.options)
+
+    started = datetime.now(timezone.utc)
+    if args.fixture:
+        markets = load_fixture(args.fixture, options)
+    elif options.get('url'):
+        markets = fetch_markets(args.source, options, HttpTransport(record_dir=args.record))
+    else:
+        parser.error("нужен --fixture или --source")
+    render_treemap(markets, args.output, options)
+    elapsed = (datetime.now(timezone.utc) - started).total_seconds()
+    logger.info(f"✓ {args.output}: {len(markets)} монет, {os.path.getsize(args.output) / 1024:.1f} KB, {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
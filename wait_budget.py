@@ -0,0 +1,84 @@
+"""
+Адаптивные бюджеты ожидания по источникам
+Version: 1.0.0
+Запоминает сколько реально ждал каждый источник до готовности контента
+и считает бюджет как quantile (p95) + запас, с ограничением сверху
+значениями из sources_config (extra_wait / selector_timeout)
+"""
+
+import os
+import json
+import math
+import logging
+
+from atomic_io import atomic_write_json
+from sources_config import ADAPTIVE_WAIT_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+def quantile(values, q):
+    """Квантиль методом nearest-rank (без numpy, окно маленькое)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q * len(ordered)))
+    return ordered[rank - 1]
+
+
+class WaitBudgets:
+    """Скользящее окно замеров готовности по каждому источнику"""
+
+    def __init__(self, path=None, settings=None):
+        self.settings = settings or ADAPTIVE_WAIT_SETTINGS
+        self.path = path or self.settings['history_file']
+        self.samples = {}
+        self._load()
+
+    @property
+    def enabled(self):
+        return self.settings.get('enabled', False)
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.samples = json.load(f).get('ready_seconds', {})
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка загрузки истории ожиданий: {e}")
+            self.samples = {}
+
+    def save(self):
+        try:
+            atomic_write_json(self.path, {"ready_seconds": self.samples}, indent=2)
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка сохранения истории ожиданий: {e}")
+            return False
+
+    def _learned(self, source_key):
+        """p95 + margin или None если замеров пока мало"""
+        samples = self.samples.get(source_key, [])
+        if not self.enabled or len(samples) < self.settings['min_samples']:
+            return None
+        return quantile(samples, self.settings['quantile']) + self.settings['margin_seconds']
+
+    def wait_budget(self, source_key, cap):
+        """Бюджет ожидания готовности контента (сек), не больше cap"""
+        learned = self._learned(source_key)
+        return cap if learned is None else min(cap, learned)
+
+    def selector_timeout(self, source_key):
+        """Таймаут wait_for_selector (сек) в пределах [min_selector_timeout, selector_timeout]"""
+        cap = self.settings['selector_timeout']
+        learned = self._learned(source_key)
+        if learned is None:
+            return cap
+        return min(cap, max(self.settings['min_selector_timeout'], learned))
+
+    def record(self, source_key, seconds):
+        """Добавляет замер и сохраняет окно"""
+        window = self.samples.setdefault(source_key, [])
+        window.append(round(seconds, 2))
+        del window[:-self.settings['window']]
+        self.save()